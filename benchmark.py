@@ -0,0 +1,280 @@
+import argparse
+from crawl_frontier import LocalFrontier
+from db_connections import get_connection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from match_archive import MatchArchive, MATCH as ARCHIVED_MATCH, MATCHLIST as ARCHIVED_MATCHLIST
+import os
+import requests
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Sequence
+from urllib.parse import urlsplit
+
+# Offline benchmark of the importers
+# Recorded Riot responses are replayed through the importers against local stand-ins, and every mode reports
+# matches/sec, rows/sec, p50/p99 per-match latency and peak RSS:
+# - Riot API and Data Dragon: a local HTTP server serving the responses of a match archive (see MATCH_ARCHIVE_DIR) and
+#   a Data Dragon tarball. fixtures/match_archive holds 40 recorded na1 matches and a few match lists. Every crawl
+#   records an archive, so the archive of any past run can be used as larger fixtures
+# - SQS: LocalFrontier, or with --sqs endpoint the stand-in configured by AWS_SQS_ENDPOINT_URL (ElasticMQ, moto server)
+# - MySQL: the database in db_config. Point config.py at a local MySQL or MariaDB scratch database created from
+#   ./schema. Matches are upserted, so the benchmark can be run again on the same database
+# Every mode runs in its own process, so peak RSS is measured per mode. Per-match latency is the time from receiving a
+# match's message to deleting it after its match was committed.
+#
+# python benchmark.py --modes single backlog bulk
+# python benchmark.py --fixtures /tmp/match_archive --matches 500
+# python benchmark.py --modes static --data-dragon data/data_dragon.tgz --patch 10.4.1
+
+MODES = ('single', 'backlog', 'bulk', 'static')
+HISTORICAL_TABLES = ('accounts', 'matches', 'match_teams', 'match_timelines_stats', 'match_participants')
+STATIC_TABLES = ('champions', 'items', 'summoner_spells', 'item_item_map', 'stats', 'item_stat_map', 'tags',
+                 'champion_tag_map', 'item_tag_map')
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'match_archive')
+# Generous enough that the client never waits on its rate limiter
+FAKE_RATE_LIMIT = '100000:1'
+
+
+# Serves archived responses at /<region><Riot API path>, the tarball at /dragontail-<patch>.tgz and a versions
+# manifest holding only the benchmarked patch at /api/versions.json
+class FakeRiotHandler(BaseHTTPRequestHandler):
+    archive: MatchArchive = None
+    data_dragon_path: str = None
+    patch_version: str = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        if parts.path == '/api/versions.json' and self.patch_version:
+            self.send_body(json.dumps([self.patch_version]).encode('utf8'), 'application/json')
+            return
+        if parts.path.startswith('/dragontail-') and self.data_dragon_path:
+            with open(self.data_dragon_path, 'rb') as file:
+                self.send_body(file.read(), 'application/octet-stream')
+            return
+        (region, path) = parts.path[1:].split('/', 1)
+        key_id = path.rsplit('/', 1)[1]
+        if '/matchlists/' in path:
+            data = self.archive.get(ARCHIVED_MATCHLIST, region, key_id + '?' + parts.query)
+        else:
+            data = self.archive.get(ARCHIVED_MATCH, region, key_id)
+        if data is None:
+            self.send_body(json.dumps({'status': {'message': 'Data not found', 'status_code': 404}}).encode('utf8'),
+                           'application/json', 404)
+            return
+        self.send_body(json.dumps(data).encode('utf8'), 'application/json')
+
+    def send_body(self, body: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('X-App-Rate-Limit', FAKE_RATE_LIMIT)
+        self.send_header('X-Method-Rate-Limit', FAKE_RATE_LIMIT)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Sends https://<region>.api.riotgames.com/<path> to http://127.0.0.1:<port>/<region>/<path>
+class FakeRiotAdapter(requests.adapters.HTTPAdapter):
+    def __init__(self, base_url: str):
+        super().__init__(pool_maxsize=32)
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = '{}/{}{}{}'.format(self.base_url, parts.netloc.split('.')[0], parts.path,
+                                         '?' + parts.query if parts.query else '')
+        return super().send(request, **kwargs)
+
+
+def start_fake_riot_server(archive: MatchArchive, data_dragon_path: str = None,
+                           patch_version: str = None) -> ThreadingHTTPServer:
+    handler = type('Handler', (FakeRiotHandler,), {'archive': archive, 'data_dragon_path': data_dragon_path,
+                                                   'patch_version': patch_version})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Wraps an SQS client and records how long every received message took until it was deleted
+class TimedSqsClient:
+    def __init__(self, sqs_client):
+        self.sqs_client = sqs_client
+        self.lock = threading.Lock()
+        self.received_at: Dict[str, float] = {}
+        self.latencies: List[float] = []
+
+    def __getattr__(self, name):
+        return getattr(self.sqs_client, name)
+
+    def receive_message(self, **kwargs):
+        response = self.sqs_client.receive_message(**kwargs)
+        now = time.perf_counter()
+        with self.lock:
+            for message in response.get('Messages', []):
+                self.received_at[message['ReceiptHandle']] = now
+        return response
+
+    def delete_message_batch(self, **kwargs):
+        response = self.sqs_client.delete_message_batch(**kwargs)
+        now = time.perf_counter()
+        with self.lock:
+            for entry in kwargs['Entries']:
+                if entry['ReceiptHandle'] in self.received_at:
+                    self.latencies.append(now - self.received_at.pop(entry['ReceiptHandle']))
+        return response
+
+
+def count_rows(tables: Sequence[str]) -> int:
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        total = 0
+        for table in tables:
+            cursor.execute('SELECT COUNT(*) FROM {}'.format(table))
+            total += cursor.fetchone()[0]
+        cursor.close()
+        return total
+    finally:
+        connection.close()
+
+
+def get_percentile(values: Sequence[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+def run_historical_mode(mode: str, args) -> Dict:
+    import import_historical_data as importer
+    from visited_index import VisitedIndex
+
+    fixtures = MatchArchive(args.fixtures)
+    match_ids = [key_id for (kind, region, key_id) in fixtures.index
+                 if kind == ARCHIVED_MATCH and region == args.region][:args.matches]
+    if not match_ids:
+        raise SystemExit('No {} matches in fixtures {}'.format(args.region, args.fixtures))
+    server = start_fake_riot_server(fixtures)
+    # Every match has to come from the fake server, and nothing may look visited from an earlier run
+    importer.MATCH_ARCHIVE_DIR = None
+    importer.visited_index = VisitedIndex(tempfile.mkdtemp(prefix='benchmark_visited_'))
+    importer.get_riot_client().session.mount('https://', FakeRiotAdapter(
+        'http://127.0.0.1:{}'.format(server.server_address[1])))
+    queue_url = importer.get_queue_url(args.region)
+    if args.sqs == 'local':
+        sqs_client = TimedSqsClient(LocalFrontier())
+    else:
+        sqs_client = TimedSqsClient(importer.connect_to_sqs())
+        sqs_client.purge_queue(QueueUrl=queue_url)
+    importer.sqs_client = sqs_client
+    for i in range(0, len(match_ids), importer.SQS_BATCH_SIZE):
+        importer.send_matches_to_sqs(sqs_client, args.region, match_ids[i:i + importer.SQS_BATCH_SIZE])
+
+    rows_before = count_rows(HISTORICAL_TABLES)
+    started_at = time.perf_counter()
+    if mode == 'single':
+        for i in range(len(match_ids)):
+            importer.process_match_breadth_traversal(queue_url)
+    elif mode == 'backlog':
+        importer.process_backlog_matches(queue_url, importer.WorkBudget(max_messages=len(match_ids)))
+    else:
+        importer.process_backlog_matches_bulk(queue_url, importer.WorkBudget(max_messages=len(match_ids)))
+    elapsed = time.perf_counter() - started_at
+    rows = count_rows(HISTORICAL_TABLES) - rows_before
+    server.shutdown()
+    return {
+        'matches': len(sqs_client.latencies),
+        'rows': rows,
+        'seconds': elapsed,
+        'p50_ms': get_percentile(sqs_client.latencies, 50) * 1000,
+        'p99_ms': get_percentile(sqs_client.latencies, 99) * 1000,
+    }
+
+
+def run_static_mode(args) -> Dict:
+    import import_static_data as static_importer
+
+    if not args.data_dragon or not args.patch:
+        raise SystemExit('The static mode needs --data-dragon and --patch')
+    server = start_fake_riot_server(MatchArchive(tempfile.mkdtemp(prefix='benchmark_fixtures_')),
+                                    os.path.abspath(args.data_dragon), args.patch)
+    static_importer.DATA_DRAGON_URL_HTTP = 'http://127.0.0.1:{}/dragontail-%s.tgz'.format(server.server_address[1])
+    static_importer.DATA_DRAGON_VERSIONS_URL = 'http://127.0.0.1:{}/api/versions.json'.format(server.server_address[1])
+    # The static importer downloads into a fresh ./data/cache, so the download is part of the benchmark
+    os.chdir(tempfile.mkdtemp(prefix='benchmark_static_'))
+    os.makedirs('data')
+    rows_before = count_rows(STATIC_TABLES)
+    started_at = time.perf_counter()
+    static_importer.initialize_static_tables()
+    elapsed = time.perf_counter() - started_at
+    rows = count_rows(STATIC_TABLES) - rows_before
+    server.shutdown()
+    return {'matches': 0, 'rows': rows, 'seconds': elapsed, 'p50_ms': 0.0, 'p99_ms': 0.0}
+
+
+def run_mode(mode: str, args) -> Dict:
+    result = run_static_mode(args) if mode == 'static' else run_historical_mode(mode, args)
+    result['mode'] = mode
+    result['matches_per_second'] = result['matches'] / result['seconds'] if result['seconds'] else 0.0
+    result['rows_per_second'] = result['rows'] / result['seconds'] if result['seconds'] else 0.0
+    # ru_maxrss is in kilobytes on Linux
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+# Run every mode in a child process and return their results
+def run_benchmarks(args) -> List[Dict]:
+    results = []
+    for mode in args.modes:
+        print('Benchmarking {} mode...'.format(mode))
+        command = [sys.executable, os.path.abspath(__file__), '--run-mode', mode] + sys.argv[1:]
+        child = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+        result_lines = [line for line in child.stdout.splitlines() if line.startswith('BENCHMARK_RESULT ')]
+        if child.returncode != 0 or not result_lines:
+            print('Benchmark of {} mode failed:\n{}'.format(mode, child.stdout[-2000:]))
+            continue
+        results.append(json.loads(result_lines[-1][len('BENCHMARK_RESULT '):]))
+    return results
+
+
+def print_results(results: Sequence[Dict]):
+    print('{:<8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'mode', 'matches', 'matches/s', 'rows/s', 'p50 ms', 'p99 ms', 'seconds', 'peak RSS MB'))
+    for result in results:
+        print('{mode:<8} {matches:>8} {matches_per_second:>10.1f} {rows_per_second:>10.1f} {p50_ms:>10.1f} '
+              '{p99_ms:>10.1f} {seconds:>10.2f} {peak_rss_mb:>12.1f}'.format(**result))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the importers')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help='Match archive with the recorded responses')
+    parser.add_argument('--matches', type=int, default=200, help='Matches imported by each historical mode')
+    parser.add_argument('--region', default='na1')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['single', 'backlog', 'bulk'])
+    parser.add_argument('--sqs', choices=('local', 'endpoint'), default='local',
+                        help='LocalFrontier, or the SQS stand-in at AWS_SQS_ENDPOINT_URL')
+    parser.add_argument('--data-dragon', help='Data Dragon tarball served to the static importer')
+    parser.add_argument('--patch', help='Patch version of the Data Dragon tarball')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    parser.add_argument('--run-mode', choices=MODES, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_args()
+    if arguments.run_mode:
+        print('BENCHMARK_RESULT ' + json.dumps(run_mode(arguments.run_mode, arguments)))
+    else:
+        benchmark_results = run_benchmarks(arguments)
+        if arguments.json:
+            print(json.dumps(benchmark_results))
+        else:
+            print_results(benchmark_results)
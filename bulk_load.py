@@ -0,0 +1,95 @@
+from metrics import logger, SAMPLED
+import mysql.connector
+import os
+import shutil
+import tempfile
+from typing import Dict, Sequence, Tuple
+
+# Spool rows into one TSV file per table and load them with LOAD DATA LOCAL INFILE, which is much faster than even
+# multi-row INSERTs for large imports. Files use the LOAD DATA defaults: tab separated fields, newline terminated
+# lines, backslash escapes and \N for NULL.
+
+LOAD_DATA_STMT = (
+    "LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE {0} "
+    "CHARACTER SET utf8mb4 "
+    "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+    "LINES TERMINATED BY '\\n' "
+    "({1})"
+)
+ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+
+def format_field(value) -> str:
+    if value is None:
+        return '\\N'
+    if value is True:
+        return '1'
+    if value is False:
+        return '0'
+    if isinstance(value, str):
+        return value.translate(ESCAPES)
+    return str(value)
+
+
+class BulkLoadSpool:
+    # @param tables (table, columns) pairs in the order they have to be loaded for their foreign keys
+    def __init__(self, tables: Sequence[Tuple[str, Sequence[str]]], directory: str = None):
+        self.tables = tables
+        self.directory = tempfile.mkdtemp(prefix='bulk_load_', dir=directory)
+        self.files = {table: open(os.path.join(self.directory, table + '.tsv'), 'w', encoding='utf8', newline='\n')
+                      for (table, columns) in tables}
+        self.row_counts: Dict[str, int] = {table: 0 for (table, columns) in tables}
+
+    def __len__(self) -> int:
+        return sum(self.row_counts.values())
+
+    def add_rows(self, table: str, rows: Sequence[Tuple]):
+        file = self.files[table]
+        for row in rows:
+            file.write('\t'.join(map(format_field, row)) + '\n')
+        self.row_counts[table] += len(rows)
+
+    # Load every spool file in a single transaction. Return True if all tables were loaded and committed
+    # @param disable_foreign_key_checks Skip foreign key and unique checks while loading. Only safe if the spooled rows
+    #   are known to be consistent, e.g. when they were built from complete matches
+    def load(self, connection, disable_foreign_key_checks: bool = False) -> bool:
+        for file in self.files.values():
+            file.flush()
+        cursor = connection.cursor()
+        try:
+            if disable_foreign_key_checks:
+                cursor.execute('SET foreign_key_checks = 0')
+                cursor.execute('SET unique_checks = 0')
+            for (table, columns) in self.tables:
+                if not self.row_counts[table]:
+                    continue
+                logger.info('Loading %s rows into %s table...', self.row_counts[table], table, extra=SAMPLED)
+                cursor.execute(LOAD_DATA_STMT.format(table, ', '.join(columns)), (self.files[table].name,))
+                if cursor.rowcount < self.row_counts[table]:
+                    logger.info('%s rows already existed in %s table and were skipped',
+                                self.row_counts[table] - cursor.rowcount, table)
+            connection.commit()
+            return True
+        except mysql.connector.Error as err:
+            logger.warning('Exception encountered when bulk loading spool files (change rolled back): %s', str(err),
+                           exc_info=True)
+            try:
+                connection.rollback()
+            except mysql.connector.Error as rollback_err:
+                logger.warning('Exception encountered when rolling back the bulk load: %s', str(rollback_err))
+            return False
+        finally:
+            # A broken connection fails here too. Log that instead of hiding the error of the load
+            try:
+                if disable_foreign_key_checks:
+                    cursor.execute('SET foreign_key_checks = 1')
+                    cursor.execute('SET unique_checks = 1')
+                cursor.close()
+            except mysql.connector.Error as err:
+                logger.warning('Exception encountered when restoring the checks of the bulk load connection: %s',
+                               str(err))
+
+    def close(self):
+        for file in self.files.values():
+            file.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
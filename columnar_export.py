@@ -0,0 +1,191 @@
+import config
+from metrics import logger
+import os
+import shutil
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+import uuid
+
+# Columnar export of imported matches for analysis
+# Rows are buffered per table and partition and written as Parquet files partitioned by patch and region, e.g.
+# <directory>/match_participants/patch=10.4/region=na1/part-<timestamp>-<id>.parquet, which Spark, Athena, DuckDB and
+# pyarrow.dataset all read as Hive partitions. Every column gets the narrowest type that holds its values, strings
+# such as account ids are dictionary encoded, and Parquet dictionary encodes and compresses every column on top of that.
+# pyarrow is only imported once rows are written, so the importers run without it as long as nothing is exported.
+
+EXPORT_COMPRESSION = getattr(config, 'EXPORT_COMPRESSION', 'zstd')
+# Rows buffered across all partitions before they are written out
+EXPORT_FLUSH_ROWS = getattr(config, 'EXPORT_FLUSH_ROWS', 500000)
+UNKNOWN_PARTITION = 'unknown'
+# Columns held by the partition path. They are left out of the files, where they would clash with it
+PARTITION_COLUMNS = ('patch', 'region')
+DICTIONARY = 'dictionary'
+# Arrow type of every exported column. Columns of a table that are not listed get the type under None
+COLUMN_TYPES = {
+    'matches': {
+        None: 'int32',
+        'match_id': 'int64',
+        'game_creation': 'int64',
+        'game_duration': 'int16',
+        'season_id': 'int8',
+        'game_version': DICTIONARY,
+    },
+    'match_teams': {
+        None: 'bool',
+        'match_team_id': 'int16',
+        'match_id': 'int64',
+        'win': DICTIONARY,
+        'tower_kills': 'int8',
+        'inhibitor_kills': 'int8',
+        'baron_kills': 'int8',
+        'dragon_kills': 'int8',
+        'riftherald_kills': 'int8',
+    },
+    'match_timelines_stats': {
+        None: 'float32',
+        'match_timeline_id': 'int64',
+    },
+    'match_participant_timelines': {
+        None: 'float32',
+        'match_id': 'int64',
+        'match_participant_id': 'int8',
+    },
+    'match_participants': {
+        None: 'int32',
+        'match_participant_id': 'int8',
+        'match_team_id': 'int16',
+        'match_id': 'int64',
+        'champion_id': 'int16',
+        'spell1_id': 'int16',
+        'spell2_id': 'int16',
+        'account_id': DICTIONARY,
+        'highest_achieved_season_tier': DICTIONARY,
+        'win': 'bool',
+        'kills': 'int16',
+        'deaths': 'int16',
+        'assists': 'int16',
+        'largestKillingSpree': 'int16',
+        'largestMultiKill': 'int8',
+        'killingSprees': 'int16',
+        'doubleKills': 'int16',
+        'tripleKills': 'int16',
+        'quadraKills': 'int16',
+        'pentaKills': 'int16',
+        'unrealKills': 'int16',
+        'turretKills': 'int16',
+        'inhibitorKills': 'int16',
+        'champLevel': 'int8',
+        'visionWardsBoughtInGame': 'int16',
+        'sightWardsBoughtInGame': 'int16',
+        'firstBloodKill': 'bool',
+        'firstBloodAssist': 'bool',
+        'firstTowerKill': 'bool',
+        'firstTowerAssist': 'bool',
+        'firstInhibitorKill': 'bool',
+        'firstInhibitorAssist': 'bool',
+        'creepsPerMinDelta_id': 'int64',
+        'xpPerMinDelta_id': 'int64',
+        'goldPerMinDelta_id': 'int64',
+        'csDiffPerMinDelta_id': 'int64',
+        'xpDiffPerMinDelta_id': 'int64',
+        'damageTakenPerMinDelta_id': 'int64',
+        'damageTakenDiffPerMinDelta_id': 'int64',
+    },
+}
+
+
+def get_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('The columnar export needs pyarrow. Install it with: pip install pyarrow')
+    return pyarrow
+
+
+def get_column_type(table: str, column: str) -> str:
+    column_types = COLUMN_TYPES.get(table, {})
+    return column_types.get(column, column_types.get(None, 'int64'))
+
+
+def get_partition_path(directory: str, table: str, patch: str, region: str) -> str:
+    return os.path.join(directory, table, 'patch=' + (patch or UNKNOWN_PARTITION),
+                        'region=' + (region or UNKNOWN_PARTITION))
+
+
+class ColumnarExport:
+    # @param tables (table, columns) pairs, like BulkLoadSpool
+    # @param overwrite Remove the files a partition already has the first time this export writes to it, so a
+    #   partition can be exported again from the DB. Otherwise new files are added next to the existing ones
+    def __init__(self, directory: str, tables: Sequence[Tuple[str, Sequence[str]]], overwrite: bool = False,
+                 flush_rows: int = EXPORT_FLUSH_ROWS):
+        self.directory = directory
+        self.columns: Dict[str, Sequence[str]] = dict(tables)
+        self.overwrite = overwrite
+        self.flush_rows = flush_rows
+        self.lock = threading.Lock()
+        # (table, patch, region) -> buffered rows
+        self.buffers: Dict[Tuple[str, str, str], List[Tuple]] = {}
+        self.num_buffered = 0
+        self.written_partitions = set()
+        self.row_counts: Dict[str, int] = {table: 0 for (table, columns) in tables}
+        self.num_files = 0
+
+    # @param patch Partition of the rows, e.g. '10.4'
+    def add_rows(self, table: str, patch: str, region: str, rows: Sequence[Tuple]):
+        if not rows:
+            return
+        with self.lock:
+            self.buffers.setdefault((table, patch, region), []).extend(rows)
+            self.num_buffered += len(rows)
+            if self.num_buffered >= self.flush_rows:
+                self.write_buffers()
+
+    def flush(self):
+        with self.lock:
+            self.write_buffers()
+
+    def close(self):
+        self.flush()
+        logger.info('Exported %s files: %s', self.num_files, ', '.join(
+            '{} {} rows'.format(table, count) for (table, count) in self.row_counts.items()))
+
+    def __enter__(self) -> 'ColumnarExport':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write_buffers(self):
+        for ((table, patch, region), rows) in self.buffers.items():
+            self.write_partition(table, patch, region, rows)
+        self.buffers.clear()
+        self.num_buffered = 0
+
+    def write_partition(self, table: str, patch: str, region: str, rows: List[Tuple]):
+        pyarrow = get_pyarrow()
+        path = get_partition_path(self.directory, table, patch, region)
+        if self.overwrite and path not in self.written_partitions and os.path.isdir(path):
+            shutil.rmtree(path)
+        self.written_partitions.add(path)
+        os.makedirs(path, exist_ok=True)
+        (columns, arrays) = ([], [])
+        for (column, values) in zip(self.columns[table], zip(*rows)):
+            if column not in PARTITION_COLUMNS:
+                columns.append(column)
+                arrays.append(get_array(pyarrow, get_column_type(table, column), values))
+        file_name = 'part-{}-{}.parquet'.format(int(time.time()), uuid.uuid4().hex[:12])
+        pyarrow.parquet.write_table(pyarrow.Table.from_arrays(arrays, names=columns), os.path.join(path, file_name),
+                                    compression=EXPORT_COMPRESSION)
+        self.row_counts[table] = self.row_counts.get(table, 0) + len(rows)
+        self.num_files += 1
+
+
+def get_array(pyarrow, column_type: str, values: Sequence):
+    if column_type == DICTIONARY:
+        return pyarrow.array(values, pyarrow.string()).dictionary_encode()
+    if column_type == 'bool':
+        # The DB returns booleans as 0 and 1
+        return pyarrow.array([None if value is None else bool(value) for value in values], pyarrow.bool_())
+    return pyarrow.array(values, getattr(pyarrow, column_type)())
@@ -0,0 +1,193 @@
+import heapq
+import itertools
+import threading
+import time
+import uuid
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# Crawl frontier of the match queue
+# Candidate matches are scored by the highest tier of the account they were found through, how recently they were
+# played and whether they were found from a match of the current patch. Messages are spread over many FIFO message
+# groups so consumers can receive from the queue in parallel.
+# SQS FIFO queues only keep the order within a message group, so on SQS the score only decides which candidates are
+# queued and in which order they are sent. LocalFrontier is an in-memory stand-in for the SQS client that always hands
+# out the highest scored message first, for local runs and testing. Like a FIFO queue it hides every message group
+# that has messages in flight, so it shows the same starvation as SQS when a consumer holds on to many messages.
+
+# highestAchievedSeasonTier values of the Riot API
+TIER_SCORES = {
+    'UNRANKED': 0,
+    'IRON': 1,
+    'BRONZE': 2,
+    'SILVER': 3,
+    'GOLD': 4,
+    'PLATINUM': 5,
+    'DIAMOND': 6,
+    'MASTER': 7,
+    'GRANDMASTER': 8,
+    'CHALLENGER': 9,
+}
+# Recency and patch each add at most 1, so they can lift a candidate by about one tier
+TIER_WEIGHT = 2.0
+PATCH_BONUS = 1.0
+RECENCY_HALF_LIFE_DAYS = 7
+PRIORITY_ATTRIBUTE = 'Priority'
+NUM_MESSAGE_GROUPS = 16
+
+
+# Return 'major.minor' of a game version such as '10.4.311.9752', or None
+def get_patch(game_version: str) -> Optional[str]:
+    if not game_version:
+        return None
+    return '.'.join(game_version.split('.')[:2])
+
+
+def get_patch_key(patch: str) -> Tuple[int, ...]:
+    try:
+        return tuple(int(part) for part in patch.split('.'))
+    except (AttributeError, ValueError):
+        return ()
+
+
+# Newest of the given patches, ignoring unknown ones
+def get_latest_patch(patches) -> Optional[str]:
+    return max((patch for patch in patches if patch), key=get_patch_key, default=None)
+
+
+def get_tier_score(tier: str) -> int:
+    return TIER_SCORES.get(tier, 0)
+
+
+# Accounts with an unknown tier are crawled. Their matches just rank below every ranked account
+# @param min_tier Lowest tier worth crawling. None crawls every account
+def is_crawled_tier(tier: str, min_tier: str = None) -> bool:
+    if min_tier is None or tier is None or tier not in TIER_SCORES:
+        return True
+    return get_tier_score(tier) >= get_tier_score(min_tier)
+
+
+# @param timestamp Creation time of the candidate match in epoch milliseconds
+# @param patch Patch of the match the candidate was found through
+# @param current_patch Newest patch the crawler has seen
+def score_candidate(tier: str, timestamp: int, patch: str = None, current_patch: str = None,
+                    now: float = None) -> float:
+    now = time.time() if now is None else now
+    age_days = max(0.0, now - (timestamp or 0) / 1000) / (24 * 60 * 60)
+    recency = 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+    patch_score = PATCH_BONUS if current_patch and patch == current_patch else 0.0
+    return get_tier_score(tier) * TIER_WEIGHT + recency + patch_score
+
+
+# Stable shard of a match, so every delivery of the same match lands in the same message group
+def get_message_group_id(match_id, num_groups: int = NUM_MESSAGE_GROUPS) -> str:
+    return str(zlib.crc32(str(match_id).encode('utf8')) % num_groups)
+
+
+def get_priority_attribute(score: float) -> Dict:
+    return {PRIORITY_ATTRIBUTE: {'DataType': 'Number', 'StringValue': '{:.6f}'.format(score)}}
+
+
+class LocalFrontier:
+    # Implements the subset of the boto3 SQS client the importer uses. Messages of every queue url are kept in a heap
+    # ordered by their Priority message attribute, then by the order they were sent. Received messages stay in flight
+    # until they are deleted or their visibility timeout runs out. While a message group has messages in flight, none
+    # of its other messages are received, and WaitTimeSeconds long-polls until a message can be received
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Notified whenever messages are sent, deleted or change visibility, to wake up long polls
+        self.changed = threading.Condition(self.lock)
+        self.counter = itertools.count()
+        # queue url -> heap of (-priority, sequence number, message)
+        self.queues: Dict[str, List[Tuple[float, int, Dict]]] = {}
+        # queue url -> receipt handle -> (visible again at, -priority, sequence number, message)
+        self.in_flight: Dict[str, Dict[str, Tuple[float, float, int, Dict]]] = {}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        successful = []
+        with self.lock:
+            heap = self.queues.setdefault(QueueUrl, [])
+            for entry in Entries:
+                attributes = entry.get('MessageAttributes', {})
+                priority = float(attributes.get(PRIORITY_ATTRIBUTE, {}).get('StringValue', 0))
+                sequence_number = next(self.counter)
+                message = {
+                    'MessageId': str(sequence_number),
+                    'Body': entry['MessageBody'],
+                    'MessageAttributes': attributes,
+                    'Attributes': {'ApproximateReceiveCount': '0',
+                                   'MessageGroupId': entry.get('MessageGroupId')},
+                }
+                heapq.heappush(heap, (-priority, sequence_number, message))
+                successful.append({'Id': entry['Id'], 'MessageId': message['MessageId']})
+            self.changed.notify_all()
+        return {'Successful': successful, 'Failed': []}
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, VisibilityTimeout: int = 30,
+                        WaitTimeSeconds: int = 0, **kwargs) -> Dict:
+        deadline = time.monotonic() + WaitTimeSeconds
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                messages = self.receive_visible_messages(QueueUrl, MaxNumberOfMessages, VisibilityTimeout, now)
+                if messages or now >= deadline:
+                    break
+                # Wake up when the next in-flight message becomes visible again, unless something changes before
+                visible_times = [visible_at for (visible_at, negative_priority, sequence_number, message)
+                                 in self.in_flight[QueueUrl].values()]
+                self.changed.wait(min([deadline] + visible_times) - now)
+        return {'Messages': messages} if messages else {}
+
+    # Called with the lock held
+    def receive_visible_messages(self, queue_url: str, max_messages: int, visibility_timeout: int,
+                                 now: float) -> List[Dict]:
+        heap = self.queues.setdefault(queue_url, [])
+        in_flight = self.in_flight.setdefault(queue_url, {})
+        # Messages whose visibility timeout ran out are delivered again
+        for (receipt_handle, (visible_at, negative_priority, sequence_number, message)) in list(in_flight.items()):
+            if visible_at <= now:
+                del in_flight[receipt_handle]
+                heapq.heappush(heap, (negative_priority, sequence_number, message))
+        blocked_groups = set(message['Attributes'].get('MessageGroupId')
+                             for (visible_at, negative_priority, sequence_number, message) in in_flight.values())
+        blocked_groups.discard(None)
+        messages = []
+        skipped = []
+        while heap and len(messages) < max_messages:
+            (negative_priority, sequence_number, message) = heapq.heappop(heap)
+            if message['Attributes'].get('MessageGroupId') in blocked_groups:
+                skipped.append((negative_priority, sequence_number, message))
+                continue
+            receive_count = int(message['Attributes']['ApproximateReceiveCount']) + 1
+            message['Attributes']['ApproximateReceiveCount'] = str(receive_count)
+            receipt_handle = uuid.uuid4().hex
+            in_flight[receipt_handle] = (now + visibility_timeout, negative_priority, sequence_number, message)
+            messages.append(dict(message, ReceiptHandle=receipt_handle, Attributes=dict(message['Attributes'])))
+        for item in skipped:
+            heapq.heappush(heap, item)
+        return messages
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        with self.lock:
+            in_flight = self.in_flight.setdefault(QueueUrl, {})
+            for entry in Entries:
+                in_flight.pop(entry['ReceiptHandle'], None)
+            self.changed.notify_all()
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    def change_message_visibility_batch(self, QueueUrl: str, Entries: List[Dict]) -> Dict:
+        now = time.monotonic()
+        with self.lock:
+            in_flight = self.in_flight.setdefault(QueueUrl, {})
+            for entry in Entries:
+                if entry['ReceiptHandle'] in in_flight:
+                    (visible_at, negative_priority, sequence_number, message) = in_flight[entry['ReceiptHandle']]
+                    in_flight[entry['ReceiptHandle']] = (now + entry['VisibilityTimeout'], negative_priority,
+                                                         sequence_number, message)
+            self.changed.notify_all()
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries], 'Failed': []}
+
+    # Number of queued messages that are not in flight
+    def get_queue_length(self, queue_url: str) -> int:
+        with self.lock:
+            return len(self.queues.get(queue_url, []))
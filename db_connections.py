@@ -0,0 +1,47 @@
+import config
+from config import db_config
+import mysql.connector
+from metrics import logger
+import mysql.connector.pooling
+import threading
+
+# Pool of MySQL connections kept at module level, so warm Lambda invocations reuse already authenticated
+# connections instead of paying for a new TLS handshake and login every time.
+# Connections returned by get_connection go back to the pool when they are closed.
+
+DB_POOL_NAME = 'league_importer'
+DB_POOL_SIZE = getattr(config, 'DB_POOL_SIZE', 5)
+PING_ATTEMPTS = 3
+PING_DELAY = 1
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool() -> mysql.connector.pooling.MySQLConnectionPool:
+    global pool
+    with pool_lock:
+        if pool is None:
+            logger.info('Creating pool of %s DB connections...', DB_POOL_SIZE)
+            pool = mysql.connector.pooling.MySQLConnectionPool(pool_name=DB_POOL_NAME, pool_size=DB_POOL_SIZE,
+                                                               **db_config)
+        return pool
+
+
+# Return a healthy pooled connection. Connections that went stale while the Lambda container was frozen
+# are reconnected before they are handed out
+def get_connection():
+    connection = get_pool().get_connection()
+    try:
+        connection.ping(reconnect=True, attempts=PING_ATTEMPTS, delay=PING_DELAY)
+    except mysql.connector.Error as err:
+        logger.warning('Pooled DB connection is stale and could not be reconnected: %s', str(err))
+        connection.close()
+        raise
+    return connection
+
+
+# LOAD DATA LOCAL INFILE has to be allowed by the client. Bulk loads run for a long time, so they get their own
+# connection instead of holding on to a pooled one
+def get_bulk_load_connection():
+    return mysql.connector.connect(**dict(db_config, allow_local_infile=True))
@@ -1,383 +1,1519 @@
-from config import db_config, RIOT_GAMES_API_KEY, \
-    AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_SQS_URL, AWS_REGION_NAME
+import config
+from config import AWS_ACCESS_KEY, AWS_SECRET_KEY, AWS_SQS_URL, AWS_REGION_NAME
 import boto3
 from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+from crawl_frontier import LocalFrontier, NUM_MESSAGE_GROUPS, get_latest_patch, get_message_group_id, get_patch, \
+    get_priority_attribute, get_tier_score, is_crawled_tier, score_candidate
+from bulk_load import BulkLoadSpool
+from columnar_export import ColumnarExport
+from db_connections import get_bulk_load_connection, get_connection
 import mysql.connector
-import requests
-import traceback
-from typing import Dict, Sequence, Tuple
+from match_archive import MatchArchive, MATCH as ARCHIVED_MATCH, MATCHLIST as ARCHIVED_MATCHLIST
+from metrics import logger, metrics, SAMPLED
+from pipeline import Pipeline
+from riot_api import RiotApiClient, get_region_and_method
+from rollups import Rollups
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+from urllib.parse import urlsplit
+from visited_index import VisitedIndex, ACCOUNTS, MATCHES
 
 REGION_PREFIXES = ('na1', 'kr', 'euw1')
+# Regional Riot API host a match is fetched from, e.g. 'na1' for na1.api.riotgames.com. Match ids are only unique
+# within a region, but the match tables are keyed by match_id alone, so a match whose id is already stored for another
+# region is refused instead of overwriting that match. Messages without a region prefix predate multi-region crawling
+DEFAULT_REGION = 'na1'
+MATCH_MESSAGE_SEPARATOR = ':'
+# Optional per-region match queues, e.g. {'kr': 'https://sqs...'}. Regions without their own queue use AWS_SQS_URL
+AWS_SQS_URL_BY_REGION = getattr(config, 'AWS_SQS_URL_BY_REGION', {})
+# Optional queue that messages go to after failing MAX_RECEIVE_COUNT times
+AWS_SQS_DEAD_LETTER_URL = getattr(config, 'AWS_SQS_DEAD_LETTER_URL', None)
+# Optional endpoint of a local SQS stand-in such as ElasticMQ or moto server
+AWS_SQS_ENDPOINT_URL = getattr(config, 'AWS_SQS_ENDPOINT_URL', None)
+# 'local' replaces SQS with an in-memory priority queue, for local runs and testing
+CRAWL_FRONTIER = getattr(config, 'CRAWL_FRONTIER', 'sqs')
+# Match lists of accounts below this highestAchievedSeasonTier are not crawled. None crawls every account
+MIN_CRAWL_TIER = getattr(config, 'MIN_CRAWL_TIER', 'DIAMOND')
+# Match queue messages are spread over this many FIFO message groups so consumers can receive in parallel
+MATCH_QUEUE_MESSAGE_GROUPS = getattr(config, 'MATCH_QUEUE_MESSAGE_GROUPS', NUM_MESSAGE_GROUPS)
+# Directory of the raw response archive. Set to None in config to disable archiving
+MATCH_ARCHIVE_DIR = getattr(config, 'MATCH_ARCHIVE_DIR', '/tmp/match_archive')
 RIOT_GET_MATCH_URL = 'https://{0}.api.riotgames.com/lol/match/v4/matches/{1}'
 RIOT_GET_MATCHLIST_URL = 'https://{0}.api.riotgames.com/lol/match/v4/matchlists/by-account/{1}?queue=420'
+RIOT_MATCHLIST_PAGE_PARAMS = '&beginIndex={0}&endIndex={1}'
+RIOT_MATCHLIST_BEGIN_TIME_PARAM = '&beginTime={0}'
+# Riot returns at most 100 games per match list request
+MATCHLIST_PAGE_SIZE = 100
+# Match list requests per account and crawl. Deeper history is paged on the following crawls
+MAX_MATCHLIST_PAGES = getattr(config, 'MAX_MATCHLIST_PAGES', 5)
+# Accounts seen again within this time are not crawled again
+MATCHLIST_RECRAWL_SECONDS = getattr(config, 'MATCHLIST_RECRAWL_SECONDS', 24 * 60 * 60)
+# Accounts whose match lists are paged at the same time
+MATCHLIST_WORKERS = 10
+
+
+def get_insert_columns(insert_stmt: str) -> List[str]:
+    return [column.strip() for column in insert_stmt[insert_stmt.index('(') + 1:insert_stmt.index(')')].split(',')]
+
+
+# Build the ON DUPLICATE KEY UPDATE clause that overwrites every column of an INSERT statement. Match rows are
+# upserted so a message that is delivered again rewrites the rows it already committed instead of failing
+def get_upsert_clause(insert_stmt: str) -> str:
+    return ' ON DUPLICATE KEY UPDATE ' + ', '.join('{0} = VALUES({0})'.format(column)
+                                                   for column in get_insert_columns(insert_stmt))
+
 
 ACCOUNTS_INSERT_STMT = (
     'INSERT INTO accounts (account_id, summoner_name, summoner_id, region) '
     'VALUES (%s, %s, %s, %s)'
 )
+# Summoner names change, so known accounts get their name updated. Crawl cursors are left untouched
+ACCOUNTS_INSERT_STMT += get_upsert_clause(ACCOUNTS_INSERT_STMT)
+ACCOUNT_CURSORS_SELECT_STMT = (
+    'SELECT account_id, last_match_timestamp, matchlist_end_index, matchlist_crawled_at FROM accounts '
+    'WHERE account_id IN ({0})'
+)
+ACCOUNT_CURSORS_UPDATE_STMT = (
+    'UPDATE accounts SET last_match_timestamp = %s, matchlist_end_index = %s, matchlist_crawled_at = %s '
+    'WHERE account_id = %s'
+)
 MATCHES_INSERT_STMT = (
     'INSERT INTO matches (match_id, region, game_creation, game_duration, season_id, game_version) '
     'VALUES (%s, %s, %s, %s, %s, %s)'
 )
+MATCHES_INSERT_STMT += get_upsert_clause(MATCHES_INSERT_STMT)
 MATCH_TEAMS_INSERT_STMT = (
     'INSERT INTO match_teams (match_team_id, match_id, win, first_blood, first_tower, first_inhibitor, first_baron, '
     'first_dragon, first_riftherald, tower_kills, inhibitor_kills, baron_kills, dragon_kills, riftherald_kills) '
     'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)'
 )
-# 64
-MATCH_PARTICIPANTS_INSERT_STMT = (
-    'INSERT INTO match_participants (match_participant_id, match_team_id, match_id, champion_id, spell1_id, spell2_id, '
-    'account_id, highest_achieved_season_tier, win, item0_id, item1_id, item2_id, item3_id, item4_id, item5_id, '
-    'item6_id, kills, deaths, assists, largestKillingSpree, largestMultiKill, killingSprees, longestTimeSpentLiving, '
-    'doubleKills, tripleKills, quadraKills, pentaKills, unrealKills, totalDamageDealt, magicDamageDealt, '
-    'physicalDamageDealt, trueDamageDealt, largestCriticalStrike, totalDamageDealtToChampions, '
-    'magicDamageDealtToChampions, physicalDamageDealtToChampions, trueDamageDealtToChampions, totalHeal, '
-    'totalUnitsHealed, damageSelfMitigated, damageDealtToObjectives, damageDealtToTurrets, visionScore, '
-    'timeCCingOthers, totalDamageTaken, magicalDamageTaken, physicalDamageTaken, trueDamageTaken, goldEarned, '
-    'goldSpent, turretKills, inhibitorKills, totalMinionsKilled, neutralMinionsKilled, totalTimeCrowdControlDealt, '
-    'champLevel, visionWardsBoughtInGame, sightWardsBoughtInGame, firstBloodKill, firstBloodAssist, firstTowerKill, '
-    'firstTowerAssist, firstInhibitorKill, firstInhibitorAssist, creepsPerMinDelta_id, xpPerMinDelta_id, '
-    'goldPerMinDelta_id, csDiffPerMinDelta_id, xpDiffPerMinDelta_id, damageTakenPerMinDelta_id, '
-    'damageTakenDiffPerMinDelta_id) '
-
-    'VALUES ({match_participant_id}, {match_team_id}, {match_id}, {champion_id}, {spell1_id}, {spell2_id}, '
-    '{account_id}, {highest_achieved_season_tier}, {win}, {item0_id}, {item1_id}, {item2_id}, {item3_id}, {item4_id}, '
-    '{item5_id}, {item6_id}, {kills}, {deaths}, {assists}, {largestKillingSpree}, {largestMultiKill}, {killingSprees}, '
-    '{longestTimeSpentLiving}, {doubleKills}, {tripleKills}, {quadraKills}, {pentaKills}, {unrealKills}, '
-    '{totalDamageDealt}, {magicDamageDealt}, {physicalDamageDealt}, {trueDamageDealt}, {largestCriticalStrike}, '
-    '{totalDamageDealtToChampions}, {magicDamageDealtToChampions}, {physicalDamageDealtToChampions}, '
-    '{trueDamageDealtToChampions}, {totalHeal}, {totalUnitsHealed}, {damageSelfMitigated}, {damageDealtToObjectives}, '
-    '{damageDealtToTurrets}, {visionScore}, {timeCCingOthers}, {totalDamageTaken}, {magicalDamageTaken}, '
-    '{physicalDamageTaken}, {trueDamageTaken}, {goldEarned}, {goldSpent}, {turretKills}, {inhibitorKills}, '
-    '{totalMinionsKilled}, {neutralMinionsKilled}, {totalTimeCrowdControlDealt}, {champLevel}, '
-    '{visionWardsBoughtInGame}, {sightWardsBoughtInGame}, {firstBloodKill}, {firstBloodAssist}, {firstTowerKill}, '
-    '{firstTowerAssist}, {firstInhibitorKill}, {firstInhibitorAssist}, {creepsPerMinDelta_id}, {xpPerMinDelta_id}, '
-    '{goldPerMinDelta_id}, {csDiffPerMinDelta_id}, {xpDiffPerMinDelta_id}, {damageTakenPerMinDelta_id}, '
-    '{damageTakenDiffPerMinDelta_id})'
+MATCH_TEAMS_INSERT_STMT += get_upsert_clause(MATCH_TEAMS_INSERT_STMT)
+# Source of every match_participants column, in column order:
+# (column, PARTICIPANT_FIELD or STATS_FIELD and the name of the field in the Riot API, or COMPUTED and None).
+# Missing fields are inserted as NULL. The same mapping drives MATCH_PARTICIPANTS_INSERT_STMT and the row extractor
+PARTICIPANT_FIELD = 'participant'
+STATS_FIELD = 'stats'
+# Values the importer computes itself. Passed to the extractor in this order
+COMPUTED = 'computed'
+MATCH_PARTICIPANTS_COLUMN_MAPPING = (
+    ('match_participant_id', PARTICIPANT_FIELD, 'participantId'),
+    ('match_team_id', PARTICIPANT_FIELD, 'teamId'),
+    ('match_id', COMPUTED, None),
+    ('champion_id', PARTICIPANT_FIELD, 'championId'),
+    ('spell1_id', PARTICIPANT_FIELD, 'spell1Id'),
+    ('spell2_id', PARTICIPANT_FIELD, 'spell2Id'),
+    ('account_id', COMPUTED, None),
+    ('highest_achieved_season_tier', PARTICIPANT_FIELD, 'highestAchievedSeasonTier'),
+    ('win', STATS_FIELD, 'win'),
+    ('item0_id', STATS_FIELD, 'item0'),
+    ('item1_id', STATS_FIELD, 'item1'),
+    ('item2_id', STATS_FIELD, 'item2'),
+    ('item3_id', STATS_FIELD, 'item3'),
+    ('item4_id', STATS_FIELD, 'item4'),
+    ('item5_id', STATS_FIELD, 'item5'),
+    ('item6_id', STATS_FIELD, 'item6'),
+    ('kills', STATS_FIELD, 'kills'),
+    ('deaths', STATS_FIELD, 'deaths'),
+    ('assists', STATS_FIELD, 'assists'),
+    ('largestKillingSpree', STATS_FIELD, 'largestKillingSpree'),
+    ('largestMultiKill', STATS_FIELD, 'largestMultiKill'),
+    ('killingSprees', STATS_FIELD, 'killingSprees'),
+    ('longestTimeSpentLiving', STATS_FIELD, 'longestTimeSpentLiving'),
+    ('doubleKills', STATS_FIELD, 'doubleKills'),
+    ('tripleKills', STATS_FIELD, 'tripleKills'),
+    ('quadraKills', STATS_FIELD, 'quadraKills'),
+    ('pentaKills', STATS_FIELD, 'pentaKills'),
+    ('unrealKills', STATS_FIELD, 'unrealKills'),
+    ('totalDamageDealt', STATS_FIELD, 'totalDamageDealt'),
+    ('magicDamageDealt', STATS_FIELD, 'magicDamageDealt'),
+    ('physicalDamageDealt', STATS_FIELD, 'physicalDamageDealt'),
+    ('trueDamageDealt', STATS_FIELD, 'trueDamageDealt'),
+    ('largestCriticalStrike', STATS_FIELD, 'largestCriticalStrike'),
+    ('totalDamageDealtToChampions', STATS_FIELD, 'totalDamageDealtToChampions'),
+    ('magicDamageDealtToChampions', STATS_FIELD, 'magicDamageDealtToChampions'),
+    ('physicalDamageDealtToChampions', STATS_FIELD, 'physicalDamageDealtToChampions'),
+    ('trueDamageDealtToChampions', STATS_FIELD, 'trueDamageDealtToChampions'),
+    ('totalHeal', STATS_FIELD, 'totalHeal'),
+    ('totalUnitsHealed', STATS_FIELD, 'totalUnitsHealed'),
+    ('damageSelfMitigated', STATS_FIELD, 'damageSelfMitigated'),
+    ('damageDealtToObjectives', STATS_FIELD, 'damageDealtToObjectives'),
+    ('damageDealtToTurrets', STATS_FIELD, 'damageDealtToTurrets'),
+    ('visionScore', STATS_FIELD, 'visionScore'),
+    ('timeCCingOthers', STATS_FIELD, 'timeCCingOthers'),
+    ('totalDamageTaken', STATS_FIELD, 'totalDamageTaken'),
+    ('magicalDamageTaken', STATS_FIELD, 'magicalDamageTaken'),
+    ('physicalDamageTaken', STATS_FIELD, 'physicalDamageTaken'),
+    ('trueDamageTaken', STATS_FIELD, 'trueDamageTaken'),
+    ('goldEarned', STATS_FIELD, 'goldEarned'),
+    ('goldSpent', STATS_FIELD, 'goldSpent'),
+    ('turretKills', STATS_FIELD, 'turretKills'),
+    ('inhibitorKills', STATS_FIELD, 'inhibitorKills'),
+    ('totalMinionsKilled', STATS_FIELD, 'totalMinionsKilled'),
+    ('neutralMinionsKilled', STATS_FIELD, 'neutralMinionsKilled'),
+    ('totalTimeCrowdControlDealt', STATS_FIELD, 'totalTimeCrowdControlDealt'),
+    ('champLevel', STATS_FIELD, 'champLevel'),
+    ('visionWardsBoughtInGame', STATS_FIELD, 'visionWardsBoughtInGame'),
+    ('sightWardsBoughtInGame', STATS_FIELD, 'sightWardsBoughtInGame'),
+    ('firstBloodKill', STATS_FIELD, 'firstBloodKill'),
+    ('firstBloodAssist', STATS_FIELD, 'firstBloodAssist'),
+    ('firstTowerKill', STATS_FIELD, 'firstTowerKill'),
+    ('firstTowerAssist', STATS_FIELD, 'firstTowerAssist'),
+    ('firstInhibitorKill', STATS_FIELD, 'firstInhibitorKill'),
+    ('firstInhibitorAssist', STATS_FIELD, 'firstInhibitorAssist'),
+    ('creepsPerMinDelta_id', COMPUTED, None),
+    ('xpPerMinDelta_id', COMPUTED, None),
+    ('goldPerMinDelta_id', COMPUTED, None),
+    ('csDiffPerMinDelta_id', COMPUTED, None),
+    ('xpDiffPerMinDelta_id', COMPUTED, None),
+    ('damageTakenPerMinDelta_id', COMPUTED, None),
+    ('damageTakenDiffPerMinDelta_id', COMPUTED, None),
 )
+MATCH_PARTICIPANTS_COLUMNS = tuple(column for (column, source, field) in MATCH_PARTICIPANTS_COLUMN_MAPPING)
+# Parameterized so executemany can send every participant of a batch as one multi-row statement
+MATCH_PARTICIPANTS_INSERT_STMT = 'INSERT INTO match_participants ({}) VALUES ({})'.format(
+    ', '.join(MATCH_PARTICIPANTS_COLUMNS), ', '.join(['%s'] * len(MATCH_PARTICIPANTS_COLUMNS)))
+MATCH_PARTICIPANTS_INSERT_STMT += get_upsert_clause(MATCH_PARTICIPANTS_INSERT_STMT)
 MATCH_TIMELINES_INSERT_STMT = (
-    'INSERT INTO match_timelines_stats (interval_0_10, interval_10_20, interval_20_30, interval_30_end) '
-    'VALUES (%s, %s, %s, %s)'
+    'INSERT INTO match_timelines_stats (match_timeline_id, interval_0_10, interval_10_20, interval_20_30, '
+    'interval_30_end) '
+    'VALUES (%s, %s, %s, %s, %s)'
+)
+MATCH_TIMELINES_INSERT_STMT += get_upsert_clause(MATCH_TIMELINES_INSERT_STMT)
+# Order matters. The index of each stat kind is part of its deterministic match_timeline_id
+TIMELINE_STAT_KINDS = ('creepsPerMinDeltas', 'xpPerMinDeltas', 'goldPerMinDeltas', 'csDiffPerMinDeltas',
+                       'xpDiffPerMinDeltas', 'damageTakenPerMinDeltas', 'damageTakenDiffPerMinDeltas')
+TIMELINE_INTERVALS = ('0-10', '10-20', '20-30', '30-end')
+# match_participants columns referencing the match_timelines_stats row of each stat kind
+TIMELINE_ID_COLUMNS = tuple(kind[:-len('s')] + '_id' for kind in TIMELINE_STAT_KINDS)
+# match_participant_timelines holds the whole timeline of a participant in one row, with a column per stat kind and
+# interval, e.g. goldPerMin_10_20. Ordered by stat kind, then interval
+MATCH_PARTICIPANT_TIMELINES_COLUMNS = ('match_id', 'match_participant_id') + tuple(
+    '{}_{}'.format(kind[:-len('Deltas')], interval.replace('-', '_'))
+    for kind in TIMELINE_STAT_KINDS for interval in TIMELINE_INTERVALS)
+MATCH_PARTICIPANT_TIMELINES_INSERT_STMT = 'INSERT INTO match_participant_timelines ({}) VALUES ({})'.format(
+    ', '.join(MATCH_PARTICIPANT_TIMELINES_COLUMNS), ', '.join(['%s'] * len(MATCH_PARTICIPANT_TIMELINES_COLUMNS)))
+MATCH_PARTICIPANT_TIMELINES_INSERT_STMT += get_upsert_clause(MATCH_PARTICIPANT_TIMELINES_INSERT_STMT)
+# 'rows' writes a match_timelines_stats row per stat kind referenced by the match_participants *_id columns, 'wide'
+# only writes match_participant_timelines and leaves those columns NULL, 'both' writes both
+TIMELINE_STORAGE = getattr(config, 'TIMELINE_STORAGE', 'both')
+STORE_TIMELINE_ROWS = TIMELINE_STORAGE in ('rows', 'both')
+STORE_WIDE_TIMELINES = TIMELINE_STORAGE in ('wide', 'both')
+# Tables of a match in the order their foreign keys require them to be loaded
+BULK_LOAD_TABLES = (
+    ('matches', get_insert_columns(MATCHES_INSERT_STMT)),
+    ('match_teams', get_insert_columns(MATCH_TEAMS_INSERT_STMT)),
+    ('match_timelines_stats', get_insert_columns(MATCH_TIMELINES_INSERT_STMT)),
+    ('match_participants', MATCH_PARTICIPANTS_COLUMNS),
+    ('match_participant_timelines', MATCH_PARTICIPANT_TIMELINES_COLUMNS),
 )
+# Columnar export of the match tables. If set, the backlog mode also exports every match it commits
+COLUMNAR_EXPORT_DIR = getattr(config, 'COLUMNAR_EXPORT_DIR', None)
+# Selects the rows of a match table along with the game version and region of their match, which partition the export
+EXPORT_SELECT_STMT = 'SELECT m.game_version, m.region, {0} FROM {1} AS t {2}'
+EXPORT_JOINS = {
+    'matches': 'JOIN matches AS m ON t.match_id = m.match_id',
+    'match_teams': 'JOIN matches AS m ON t.match_id = m.match_id',
+    # Timeline rows imported before migration 001 have AUTO_INCREMENT ids that do not contain their match id, so they
+    # are found through the participants referencing them
+    'match_timelines_stats': 'JOIN match_participants AS p ON t.match_timeline_id IN ({}) '
+                             'JOIN matches AS m ON m.match_id = p.match_id'.format(
+                                 ', '.join('p.' + column for column in TIMELINE_ID_COLUMNS)),
+    'match_participants': 'JOIN matches AS m ON t.match_id = m.match_id',
+    'match_participant_timelines': 'JOIN matches AS m ON t.match_id = m.match_id',
+}
+EXPORT_FETCH_SIZE = 10000
+# Keep the champion, item and summoner spell rollups up to date as matches are inserted. See rollups.py
+MAINTAIN_ROLLUPS = getattr(config, 'MAINTAIN_ROLLUPS', True)
+rollups = Rollups(MATCH_PARTICIPANTS_COLUMNS)
+# Default budget of the backlog mode when no limit is passed in and there is no Lambda deadline
+DEFAULT_BACKLOG_MAX_MESSAGES = 20
+# Matches per insert when replaying the archive
+REPLAY_BATCH_SIZE = 100
+# Most matches loaded by one LOAD DATA in bulk mode
+BULK_LOAD_FLUSH_MATCHES = 5000
+# Receives after the first one of a bulk load window only wait this long, so the window is loaded as soon as every
+# message group of a FIFO queue is in flight
+BULK_LOAD_WINDOW_WAIT_SECONDS = 1
+# Stop pulling new batches once less than this is left before the Lambda deadline
+DEADLINE_RESERVE_MS = 30000
+# AWS limit on messages per receive/send/delete batch
+SQS_BATCH_SIZE = 10
+# Receives long-poll for up to this many seconds when no message can be received right away. SQS allows at most 20
+SQS_WAIT_TIME_SECONDS = getattr(config, 'SQS_WAIT_TIME_SECONDS', 20)
+# Messages are only deleted after their match is committed. Until then their visibility timeout keeps being extended
+VISIBILITY_TIMEOUT = 60
+VISIBILITY_EXTEND_INTERVAL = 20
+MAX_RECEIVE_COUNT = 5
+# Backlog pipeline: matches buffered between stages, threads per stage and matches per DB transaction
+PIPELINE_QUEUE_DEPTH = getattr(config, 'PIPELINE_QUEUE_DEPTH', 50)
+PIPELINE_FETCH_WORKERS = getattr(config, 'PIPELINE_FETCH_WORKERS', 10)
+PIPELINE_PARSE_WORKERS = getattr(config, 'PIPELINE_PARSE_WORKERS', 2)
+PIPELINE_WRITE_BATCH_SIZE = getattr(config, 'PIPELINE_WRITE_BATCH_SIZE', 50)
+
+# Created once per container. Worker threads share them, so each is created under its lock
+riot_client = None
+riot_client_lock = threading.Lock()
+sqs_client = None
+sqs_client_lock = threading.Lock()
+visited_index = None
+visited_index_lock = threading.Lock()
+match_archive = None
+match_archive_lock = threading.Lock()
 
 
 def lambda_handler(event, context):
-    initialize(event)
+    try:
+        initialize(event, context)
+    finally:
+        metrics.flush({'mode': event.get('state') or 'single'})
     return {
         'statusCode': 200
     }
 
 
-def initialize(params: Dict):
-    if params.get('state') == 'backlog':
-        process_backlog_matches()
+# params['state']: 'backlog' to only import queued matches, 'batch' to traverse many matches per invocation,
+#   'replay' to rebuild the DB from the archived matches without any network calls,
+#   anything else to traverse a single match
+# params['region']: Only crawl a single region. Otherwise every region in REGION_PREFIXES is crawled in parallel
+# params['max_messages'], params['max_seconds']: Optional budget of the 'backlog' and 'batch' modes
+# params['bulk']: 'backlog' and 'replay' load matches with LOAD DATA LOCAL INFILE instead of INSERTs
+# params['disable_foreign_key_checks']: Turn off foreign key checks while bulk loading
+# params['state'] 'export': Write the matches to Parquet files in params['directory'] or COLUMNAR_EXPORT_DIR, read from
+#   the DB, or from the match archive if params['source'] is 'archive'. params['patches'] limits the export to some
+#   patches, e.g. ['10.4', '10.5']. Partitions exported from the DB replace the files they had
+# params['state'] 'rebuild_rollups': Recompute the rollup tables from match_participants, e.g. after a bulk load or to
+#   backfill them. params['patches'] limits the rebuild to some patches
+def initialize(params: Dict, context=None):
+    regions = (params['region'],) if params.get('region') else REGION_PREFIXES
+    budget = WorkBudget(context, params.get('max_messages'), params.get('max_seconds'))
+    bulk = bool(params.get('bulk'))
+    disable_foreign_key_checks = bool(params.get('disable_foreign_key_checks'))
+    if params.get('state') == 'backlog' and bulk:
+        process_queues_in_parallel(process_backlog_matches_bulk, regions, budget, disable_foreign_key_checks)
+    elif params.get('state') == 'backlog':
+        if budget.is_unlimited():
+            budget = WorkBudget(context, DEFAULT_BACKLOG_MAX_MESSAGES)
+        process_queues_in_parallel(process_backlog_matches, regions, budget)
+    elif params.get('state') == 'batch':
+        process_queues_in_parallel(process_match_breadth_traversal_batches, regions, budget)
+    elif params.get('state') == 'replay' and bulk:
+        replay_archived_matches_bulk(regions, disable_foreign_key_checks)
+    elif params.get('state') == 'replay':
+        replay_archived_matches(regions)
+    elif params.get('state') == 'export':
+        export_matches(params.get('directory') or COLUMNAR_EXPORT_DIR, regions, params.get('source') or 'db',
+                       params.get('patches'))
+    elif params.get('state') == 'rebuild_rollups':
+        rebuild_rollups(params.get('patches'))
     else:
-        process_match_breadth_traversal()
+        process_queues_in_parallel(process_match_breadth_traversal, regions)
+
+
+# Limits how much work a single invocation does, by number of messages, wall time, and the Lambda deadline.
+# Shared by all workers of an invocation
+class WorkBudget:
+    def __init__(self, context=None, max_messages: int = None, max_seconds: float = None):
+        self.context = context
+        self.max_messages = max_messages
+        self.deadline = time.monotonic() + max_seconds if max_seconds else None
+        self.messages_processed = 0
+        self.lock = threading.Lock()
+
+    def is_unlimited(self) -> bool:
+        return self.context is None and self.max_messages is None and self.deadline is None
+
+    def is_exhausted(self) -> bool:
+        if self.max_messages is not None and self.messages_processed >= self.max_messages:
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return True
+        if self.context is not None and self.context.get_remaining_time_in_millis() < DEADLINE_RESERVE_MS:
+            return True
+        return False
+
+    # Number of messages the next receive may ask for
+    def next_batch_size(self) -> int:
+        if self.max_messages is None:
+            return SQS_BATCH_SIZE
+        with self.lock:
+            return max(0, min(SQS_BATCH_SIZE, self.max_messages - self.messages_processed))
+
+    def consume(self, num_messages: int):
+        with self.lock:
+            self.messages_processed += num_messages
+
+    # Longest a receive may long-poll, or wait for in-flight messages, without running past the deadlines
+    def get_wait_seconds(self, max_wait_seconds: int = None) -> int:
+        remaining = [SQS_WAIT_TIME_SECONDS if max_wait_seconds is None else max_wait_seconds]
+        if self.deadline is not None:
+            remaining.append(self.deadline - time.monotonic())
+        if self.context is not None:
+            remaining.append((self.context.get_remaining_time_in_millis() - DEADLINE_RESERVE_MS) / 1000)
+        return max(0, int(min(remaining)))
+
+
+# Run one worker per distinct match queue. Each worker gets its own DB connection. Rate limits are already
+# budgeted per region by the shared Riot API client
+def process_queues_in_parallel(worker: Callable, regions: Sequence[str], *args):
+    queue_urls = sorted(set(get_queue_url(region) for region in regions))
+    if len(queue_urls) == 1:
+        worker(queue_urls[0], *args)
+        return
+    with ThreadPoolExecutor(max_workers=len(queue_urls)) as executor:
+        for future in [executor.submit(worker, queue_url, *args) for queue_url in queue_urls]:
+            future.result()
 
 
 # Gather match data by doing a BFS
-# 1. Receive one message from SQS Match Queue with match_id
+# 1. Receive one message from SQS Match Queue with region and match_id
 # 2. Send get request to match Riot Games API with match_id
 # 3. Insert match data into DB
 # 4. Loop through summoner accounts within match
-# 5. For each summoner account, if not previously visited, add their match list to SQS Match Queue
-def process_match_breadth_traversal():
-    print('Traversing through matches and summoner accounts...')
+# 5. For each summoner account, if not previously visited, add their match list to SQS Match Queue of their region
+def process_match_breadth_traversal(queue_url: str = AWS_SQS_URL):
+    logger.info('Traversing through matches and summoner accounts...')
     client = connect_to_sqs()
-    messages = receive_match_messages(client, 1)
+    messages = receive_match_messages(client, 1, queue_url)
     # Read first message
     if not messages:
-        print('No match ids could be received. Exiting...')
+        logger.info('No match ids could be received. Exiting...')
         return
-    match_id = messages[0].get('Body')
+    connection = get_connection()
+    try:
+        import_match_messages(connection, client, queue_url, messages, traverse=True)
+    finally:
+        connection.close()
+    logger.info('Completed all operations. Exiting...')
 
-    # Get match data for match_id from riot games API
-    match = get(RIOT_GET_MATCH_URL.format('na1', match_id))
-    if not match:
-        print('No matches could be retrieved from Riot API. Exiting...')
-        return
 
-    connection = mysql.connector.connect(**db_config)
-    # Loop through summoner accounts within match
-    accountIdByParticipantId = {}
-    if match.get('participantIdentities'):
-        for participant in match.get('participantIdentities'):
-            send_matchlist_message_from_account(connection, client, participant['player'])
-            # Fail fast if there are no participant or account ids
-            accountIdByParticipantId[participant['participantId']] = participant['player']['currentAccountId']
+# Same BFS as process_match_breadth_traversal, but keep pulling batches of messages until the budget is used up.
+# The matches of a batch and the match lists of all their participants are fetched concurrently
+def process_match_breadth_traversal_batches(queue_url: str, budget: WorkBudget):
+    logger.info('Traversing through batches of matches and summoner accounts...')
+    client = connect_to_sqs()
+    connection = get_connection()
+    try:
+        while not budget.is_exhausted():
+            batch_size = budget.next_batch_size()
+            if batch_size == 0:
+                break
+            messages = receive_match_messages(client, batch_size, queue_url)
+            if not messages:
+                break
+            budget.consume(len(messages))
+            import_match_messages(connection, client, queue_url, messages, traverse=True)
+    finally:
+        connection.close()
+    logger.info('Processed %s messages. Exiting...', budget.messages_processed)
+
+
+# Import queued matches without traversing their participants, until the budget is used up. Fetching, building rows
+# and writing run as separate pipeline stages, so Riot API, CPU and DB latency overlap. Receiving blocks while the
+# stages are full.
+# A FIFO queue hides every message group that has messages in flight, so once the pipeline holds messages of every
+# group a receive comes back empty although the queue is not. The queue only counts as empty once a receive comes
+# back empty while the pipeline held no messages. Until then empty receives wait for messages to leave the pipeline
+def process_backlog_matches(queue_url: str = AWS_SQS_URL, budget: WorkBudget = None):
+    logger.info('Processing backlog matches...')
+    budget = budget or WorkBudget(max_messages=DEFAULT_BACKLOG_MAX_MESSAGES)
+    client = connect_to_sqs()
+    connection = get_connection()
+    exporter = ColumnarExport(COLUMNAR_EXPORT_DIR, BULK_LOAD_TABLES) if COLUMNAR_EXPORT_DIR else None
+    try:
+        with VisibilityExtender(client, queue_url, []) as extender:
+            pipeline = build_backlog_pipeline(connection, client, queue_url, extender, exporter)
+            pipeline.start()
+            try:
+                while not budget.is_exhausted():
+                    batch_size = budget.next_batch_size()
+                    if batch_size == 0:
+                        break
+                    num_in_flight = len(extender)
+                    messages = receive_match_messages(client, batch_size, queue_url, budget.get_wait_seconds())
+                    if not messages:
+                        if not num_in_flight:
+                            break
+                        extender.wait_for_removal(budget.get_wait_seconds())
+                        continue
+                    extender.add(messages)
+                    budget.consume(len(messages))
+                    for message in messages:
+                        pipeline.put(message)
+            finally:
+                pipeline.close()
+            pipeline.log_stats()
+    finally:
+        connection.close()
+        if exporter is not None:
+            exporter.close()
+    logger.info('Processed %s messages. Exiting...', budget.messages_processed)
+
+
+# fetch -> parse -> write pipeline of the backlog mode. Only the write stage uses the DB connection. Messages stop
+# being extended once they are deleted or dropped by a stage, including when a stage raises, so dropped messages are
+# retried after their visibility timeout runs out
+# @param exporter If set, an export stage after the write stage exports the rows of every committed match
+def build_backlog_pipeline(connection, sqs_client, queue_url: str, extender,
+                           exporter: ColumnarExport = None) -> Pipeline:
+    def fetch(message: Dict):
+        try:
+            match = read_match(*parse_match_message(message.get('Body')))
+        except Exception:
+            extender.remove([message])
+            raise
+        if not match:
+            logger.warning('Match %s could not be retrieved from Riot API', message.get('Body'))
+            extender.remove([message])
+            return None
+        return message, match
+
+    def parse(fetched: Tuple[Dict, Dict]):
+        (message, match) = fetched
+        try:
+            accountIdByParticipantId = get_account_ids_by_participant_id(match)
+            rows = build_match_rows(match, accountIdByParticipantId)
+        except (KeyError, TypeError, ValueError) as err:
+            logger.warning('Malformed match with id: %s. Skipping...: %s', match.get('gameId'), str(err))
+            extender.remove([message])
+            return None
+        except Exception:
+            extender.remove([message])
+            raise
+        return message, (match, accountIdByParticipantId, rows)
+
+    def write(parsed: List[Tuple[Dict, Tuple]]):
+        try:
+            failed_match_ids = set(insert_match_rows_into_db(connection, [match_rows for (message, match_rows)
+                                                                          in parsed]))
+            delete_match_messages(sqs_client, queue_url, [message for (message, (match, accounts, rows)) in parsed
+                                                          if match.get('gameId') not in failed_match_ids])
+        finally:
+            extender.remove([message for (message, match_rows) in parsed])
+        if exporter is not None:
+            return [rows for (message, (match, accounts, rows)) in parsed
+                    if match.get('gameId') not in failed_match_ids]
+
+    def export(committed: List[Tuple]):
+        export_match_rows(exporter, committed)
+
+    pipeline = Pipeline(PIPELINE_QUEUE_DEPTH) \
+        .add_stage('fetch', fetch, PIPELINE_FETCH_WORKERS) \
+        .add_stage('parse', parse, PIPELINE_PARSE_WORKERS) \
+        .add_stage('write', write, 1, PIPELINE_WRITE_BATCH_SIZE)
+    if exporter is not None:
+        pipeline.add_stage('export', export, 1, PIPELINE_WRITE_BATCH_SIZE)
+    return pipeline
+
+
+# Fetch and insert the matches of a batch of messages. Messages are only deleted from the queue once their match is
+# committed, so a failed fetch or insert is retried after the visibility timeout runs out
+# @param traverse If True, also queue the match lists of every participant not visited before
+def import_match_messages(connection, sqs_client, queue_url: str, messages: Sequence[Dict], traverse: bool):
+    with VisibilityExtender(sqs_client, queue_url, messages):
+        match_keys = [parse_match_message(message.get('Body')) for message in messages]
+        if traverse:
+            # Matches can also be seeded into the queue by hand, so make sure these are never queued again
+            get_visited_index(connection).mark_visited(
+                MATCHES, (format_match_message(region, match_id) for (region, match_id) in match_keys))
+        # Get match data for all match_ids from riot games API concurrently
+        matches = get_many([RIOT_GET_MATCH_URL.format(region, match_id) for (region, match_id) in match_keys])
+        fetched = [(message, match) for (message, match) in zip(messages, matches) if match]
+        if len(fetched) < len(messages):
+            logger.warning('%s matches could not be retrieved from Riot API', len(messages) - len(fetched))
+        if traverse:
+            send_matchlist_messages_from_accounts(connection, sqs_client,
+                                                  [account for (message, match) in fetched
+                                                   for account in get_accounts(match)])
+            get_visited_index(connection).flush()
+
+        # Insert match data into DB
+        failed_match_ids = set(insert_batched_matches_into_db(
+            connection, [(match, get_account_ids_by_participant_id(match)) for (message, match) in fetched]))
+    delete_match_messages(sqs_client, queue_url,
+                          [message for (message, match) in fetched if match.get('gameId') not in failed_match_ids])
 
-    # Insert match data into DB
-    insert_single_match_into_db(connection, match, accountIdByParticipantId)
-    print('Completed all operations. Exiting...')
-    connection.close()
 
+# Re-insert every archived match of the given regions. Nothing is requested from Riot or SQS
+def replay_archived_matches(regions: Sequence[str] = REGION_PREFIXES):
+    archive = get_match_archive()
+    if archive is None:
+        logger.info('No match archive is configured. Exiting...')
+        return
+    logger.info('Replaying archived matches...')
+    connection = get_connection()
+    batch = []
+    num_matches = 0
+    num_failed = 0
+    try:
+        for (region, match_id, match) in archive.stream(ARCHIVED_MATCH):
+            if region not in regions:
+                continue
+            batch.append((match, get_account_ids_by_participant_id(match)))
+            if len(batch) >= REPLAY_BATCH_SIZE:
+                num_failed += len(insert_batched_matches_into_db(connection, batch))
+                num_matches += len(batch)
+                batch.clear()
+        if batch:
+            num_failed += len(insert_batched_matches_into_db(connection, batch))
+            num_matches += len(batch)
+    finally:
+        connection.close()
+    logger.info('Replayed %s archived matches (%s failed). Exiting...', num_matches, num_failed)
 
-# Process matches 20 at a time
-def process_backlog_matches():
-    print('Processing backlog matches...')
+
+# Import queued matches with LOAD DATA LOCAL INFILE, one receive window at a time. The matches of a window are spooled
+# to files and loaded in one transaction, and its messages are deleted once the load is committed. A window ends when a
+# receive comes back empty, which on a FIFO queue happens once every message group has messages in the window, or after
+# BULK_LOAD_FLUSH_MATCHES matches. So messages are only held in flight for one window
+# Bulk loads do not maintain the rollups. Rebuild them afterwards with state 'rebuild_rollups'
+def process_backlog_matches_bulk(queue_url: str, budget: WorkBudget, disable_foreign_key_checks: bool = False):
+    logger.info('Bulk loading backlog matches...')
     client = connect_to_sqs()
-    connection = mysql.connector.connect(**db_config)
-    for i in range(2):
-        messages = receive_match_messages(client, 10)
-        match_ids = [message.get('Body') for message in messages]
-        for match_id in match_ids:
-            # Get match data for match_id from riot games API
-            match = get(RIOT_GET_MATCH_URL.format('na1', match_id))
-
-            # Loop through summoner accounts within match
-            # Populate the account_id column
-            accountIdByParticipantId = {}
-            if match.get('participantIdentities'):
-                for participant in match.get('participantIdentities'):
-                    # Fail fast if there are no participant or account ids
-                    accountIdByParticipantId[participant['participantId']] = participant['player']['currentAccountId']
-
-            # Insert match data into DB
-            insert_single_match_into_db(connection, match, accountIdByParticipantId)
+    connection = get_bulk_load_connection()
+    try:
+        while not budget.is_exhausted():
+            spool = BulkLoadSpool(BULK_LOAD_TABLES)
+            staged_messages = []
+            num_received = 0
+            loaded = False
+            try:
+                with VisibilityExtender(client, queue_url, []) as extender:
+                    while len(staged_messages) < BULK_LOAD_FLUSH_MATCHES and not budget.is_exhausted():
+                        batch_size = budget.next_batch_size()
+                        if batch_size == 0:
+                            break
+                        # Only the first receive of a window long-polls
+                        wait_seconds = budget.get_wait_seconds(BULK_LOAD_WINDOW_WAIT_SECONDS if num_received else None)
+                        messages = receive_match_messages(client, batch_size, queue_url, wait_seconds)
+                        if not messages:
+                            break
+                        num_received += len(messages)
+                        extender.add(messages)
+                        budget.consume(len(messages))
+                        match_keys = [parse_match_message(message.get('Body')) for message in messages]
+                        matches = get_many([RIOT_GET_MATCH_URL.format(region, match_id)
+                                            for (region, match_id) in match_keys])
+                        staged_match_ids = set(spool_matches(spool, [match for match in matches if match]))
+                        staged = [message for (message, match) in zip(messages, matches)
+                                  if match and match.get('gameId') in staged_match_ids]
+                        staged_messages.extend(staged)
+                        # Messages of matches that could not be fetched or built are retried after their timeout
+                        extender.remove([message for message in messages if message not in staged])
+                    loaded = bool(staged_messages) and spool.load(connection, disable_foreign_key_checks)
+            finally:
+                spool.close()
+            if loaded:
+                delete_match_messages(client, queue_url, staged_messages)
+            elif staged_messages:
+                logger.warning('Could not load %s matches. Their messages are retried', len(staged_messages))
+            if not num_received:
+                break
+    finally:
+        connection.close()
+    logger.info('Processed %s messages. Exiting...', budget.messages_processed)
+
+
+# Re-load every archived match of the given regions with LOAD DATA LOCAL INFILE. Nothing is requested from Riot
+# The rollups are not maintained, rebuild them afterwards with state 'rebuild_rollups'
+def replay_archived_matches_bulk(regions: Sequence[str] = REGION_PREFIXES, disable_foreign_key_checks: bool = False):
+    archive = get_match_archive()
+    if archive is None:
+        logger.info('No match archive is configured. Exiting...')
+        return
+    logger.info('Bulk loading archived matches...')
+    connection = get_bulk_load_connection()
+    num_matches = 0
+    num_failed = 0
+    try:
+        batch = []
+        for (region, match_id, match) in archive.stream(ARCHIVED_MATCH):
+            if region not in regions:
+                continue
+            batch.append(match)
+            if len(batch) >= BULK_LOAD_FLUSH_MATCHES:
+                (num_loaded, num_not_loaded) = bulk_load_matches(connection, batch, disable_foreign_key_checks)
+                num_matches += num_loaded
+                num_failed += num_not_loaded
+                batch.clear()
+        if batch:
+            (num_loaded, num_not_loaded) = bulk_load_matches(connection, batch, disable_foreign_key_checks)
+            num_matches += num_loaded
+            num_failed += num_not_loaded
+    finally:
+        connection.close()
+    logger.info('Bulk loaded %s archived matches (%s failed). Exiting...', num_matches, num_failed)
+
+
+# Spool and load a batch of matches in one transaction. Return (loaded, failed) match counts. Malformed matches and
+# every match of a load that was rolled back count as failed
+def bulk_load_matches(connection, matches: Sequence[Dict], disable_foreign_key_checks: bool = False) -> Tuple[int, int]:
+    spool = BulkLoadSpool(BULK_LOAD_TABLES)
+    try:
+        num_spooled = len(spool_matches(spool, matches))
+        if num_spooled and spool.load(connection, disable_foreign_key_checks):
+            return num_spooled, len(matches) - num_spooled
+        return 0, len(matches)
+    finally:
+        spool.close()
+
+
+# Write the rows of every valid match to the spool files. Return the ids of the matches that were spooled
+def spool_matches(spool: BulkLoadSpool, matches: Sequence[Dict]) -> List:
+    spooled_match_ids = []
+    for match in matches:
+        try:
+            (match_values, match_team_values, match_timeline_values, participant_values,
+             participant_timeline_values) = build_match_rows(match, get_account_ids_by_participant_id(match))
+        except (KeyError, TypeError, ValueError) as err:
+            logger.warning('Malformed match with id: %s. Skipping...: %s', match.get('gameId'), str(err))
+            continue
+        spool.add_rows('matches', (match_values,))
+        spool.add_rows('match_teams', match_team_values)
+        spool.add_rows('match_timelines_stats', match_timeline_values)
+        spool.add_rows('match_participants', participant_values)
+        spool.add_rows('match_participant_timelines', participant_timeline_values)
+        spooled_match_ids.append(match.get('gameId'))
+    return spooled_match_ids
+
+
+# Recompute the rollup tables from the matches in the DB, e.g. after a bulk load
+def rebuild_rollups(patches: Sequence[str] = None):
+    connection = get_connection()
+    try:
+        if rollups.rebuild(connection, patches):
+            logger.info('Rebuilt rollup tables')
+    finally:
+        connection.close()
+
+
+# Write the match tables to Parquet files partitioned by patch and region
+# @param source 'db' to export the imported matches, 'archive' to build the rows of the archived matches without a DB
+# @param patches Only export these patches, e.g. ['10.4']. Every patch if None
+def export_matches(directory: str, regions: Sequence[str] = REGION_PREFIXES, source: str = 'db',
+                   patches: Sequence[str] = None):
+    if not directory:
+        logger.info('No export directory is configured. Exiting...')
+        return
+    logger.info('Exporting matches from %s to %s...', source, directory)
+    if source == 'archive':
+        archive = get_match_archive()
+        if archive is None:
+            logger.info('No match archive is configured. Exiting...')
+            return
+        with ColumnarExport(directory, BULK_LOAD_TABLES) as exporter:
+            for (region, match_id, match) in archive.stream(ARCHIVED_MATCH):
+                if region not in regions or (patches and get_patch(match.get('gameVersion')) not in patches):
+                    continue
+                try:
+                    rows = build_match_rows(match, get_account_ids_by_participant_id(match))
+                except (KeyError, TypeError, ValueError) as err:
+                    logger.warning('Malformed match with id: %s. Skipping...: %s', match.get('gameId'), str(err))
+                    continue
+                export_match_rows(exporter, [rows])
+        return
+    connection = get_connection()
+    try:
+        with ColumnarExport(directory, BULK_LOAD_TABLES, overwrite=True) as exporter:
+            for (table, columns) in BULK_LOAD_TABLES:
+                export_table_from_db(connection, exporter, table, columns, regions, patches)
+    finally:
+        connection.close()
+
+
+# Stream the rows of a match table out of the DB into the export, EXPORT_FETCH_SIZE rows at a time
+def export_table_from_db(connection, exporter: ColumnarExport, table: str, columns: Sequence[str],
+                         regions: Sequence[str], patches: Sequence[str] = None):
+    logger.info('Exporting %s table...', table)
+    stmt = EXPORT_SELECT_STMT.format(', '.join('t.' + column for column in columns), table, EXPORT_JOINS[table])
+    stmt += ' WHERE m.region IN ({})'.format(', '.join(['%s'] * len(regions)))
+    params = list(regions)
+    if patches:
+        stmt += ' AND ({})'.format(' OR '.join(['m.game_version LIKE %s'] * len(patches)))
+        params += [patch + '.%' for patch in patches]
+    cursor = connection.cursor()
+    try:
+        cursor.execute(stmt, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            partitions: Dict[Tuple[str, str], List[Tuple]] = {}
+            for row in rows:
+                partitions.setdefault((get_patch(row[0]), row[1]), []).append(row[2:])
+            for ((patch, region), partition_rows) in partitions.items():
+                exporter.add_rows(table, patch, region, partition_rows)
+    finally:
+        cursor.close()
+
+
+# Add the rows of matches to the export, partitioned by the patch and region of their match
+# @param match_rows build_match_rows results
+def export_match_rows(exporter: ColumnarExport, match_rows: Sequence[Tuple]):
+    for (match_values, match_team_values, match_timeline_values, participant_values,
+         participant_timeline_values) in match_rows:
+        # matches rows start with (match_id, region, game_creation, game_duration, season_id, game_version)
+        (patch, region) = (get_patch(match_values[5]), match_values[1])
+        exporter.add_rows('matches', patch, region, [match_values])
+        exporter.add_rows('match_teams', patch, region, match_team_values)
+        exporter.add_rows('match_timelines_stats', patch, region, match_timeline_values)
+        exporter.add_rows('match_participants', patch, region, participant_values)
+        exporter.add_rows('match_participant_timelines', patch, region, participant_timeline_values)
+
+
+# Populate the account_id column. Missing account ids are rejected when the match is inserted
+def get_account_ids_by_participant_id(match: Dict) -> Dict:
+    return dict((participant.get('participantId'), (participant.get('player') or {}).get('currentAccountId'))
+                for participant in match.get('participantIdentities', []))
+
+
+# Player of every participant, plus the participant's highestAchievedSeasonTier and the gameVersion of the match for
+# scoring the account's matches
+def get_accounts(match: Dict) -> List[Dict]:
+    tiers = dict((participant.get('participantId'), participant.get('highestAchievedSeasonTier'))
+                 for participant in match.get('participants', []))
+    return [dict(participant['player'], highestAchievedSeasonTier=tiers.get(participant.get('participantId')),
+                 gameVersion=match.get('gameVersion'))
+            for participant in match.get('participantIdentities', []) if participant.get('player')]
 
 
 # numMessages must be <= 10 due to AWS restrictions
-def receive_match_messages(sqs_client, numMessages):
+# Messages stay in the queue until they are passed to delete_match_messages
+# @param wait_seconds Long-poll for up to this many seconds if no message can be received right away
+def receive_match_messages(sqs_client, numMessages, queue_url: str = AWS_SQS_URL, wait_seconds: int = 0):
     if sqs_client is None:
         return
-    messages = sqs_client.receive_message(
-        QueueUrl=AWS_SQS_URL,
-        MaxNumberOfMessages=numMessages
-    )
-    if not messages.get('Messages'):
-        print('SQS message queue is empty.')
-        return None
-    # Need to delete the message(s) after receiving it from queue
+    while True:
+        with metrics.timer('sqs.receive'):
+            messages = sqs_client.receive_message(
+                QueueUrl=queue_url,
+                MaxNumberOfMessages=numMessages,
+                VisibilityTimeout=VISIBILITY_TIMEOUT,
+                WaitTimeSeconds=wait_seconds,
+                AttributeNames=['ApproximateReceiveCount']
+            )
+        if not messages.get('Messages'):
+            logger.info('SQS message queue is empty.', extra=SAMPLED)
+            return None
+        metrics.increment('sqs.received', len(messages['Messages']))
+        logger.info('Successfully received %s message(s) from queue', len(messages['Messages']), extra=SAMPLED)
+        # Poison messages keep failing. Route them to the dead-letter queue, or drop them if there is none, instead of
+        # retrying them forever
+        poison_messages = [message for message in messages['Messages']
+                           if int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1)) > MAX_RECEIVE_COUNT]
+        if not poison_messages:
+            return messages['Messages']
+        if AWS_SQS_DEAD_LETTER_URL is None:
+            metrics.increment('sqs.dropped', len(poison_messages))
+            logger.warning('Dropping %s message(s) that failed more than %s times: %s', len(poison_messages),
+                           MAX_RECEIVE_COUNT, [message.get('Body') for message in poison_messages])
+            delete_match_messages(sqs_client, queue_url, poison_messages)
+        else:
+            send_to_dead_letter_queue(sqs_client, queue_url, poison_messages)
+        # A receive of only poison messages does not mean the queue is empty, so receive again
+        messages = [message for message in messages['Messages'] if message not in poison_messages]
+        if messages:
+            return messages
+
+
+# Acknowledge messages whose matches were committed
+def delete_match_messages(sqs_client, queue_url: str, messages: Sequence[Dict]):
+    if sqs_client is None or not messages:
+        return
     entries = [{'Id': message.get('MessageId'), 'ReceiptHandle': message.get('ReceiptHandle')}
-               for message in messages['Messages']]
-    sqs_client.delete_message_batch(
-        QueueUrl=AWS_SQS_URL,
+               for message in messages]
+    for i in range(0, len(entries), SQS_BATCH_SIZE):
+        with metrics.timer('sqs.delete'):
+            sqs_client.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=entries[i:i + SQS_BATCH_SIZE]
+            )
+    metrics.increment('sqs.deleted', len(entries))
+    logger.info('Deleted %s message(s) from queue', len(entries), extra=SAMPLED)
+
+
+# Only messages the dead-letter queue accepted are deleted. The others are received again and retried later
+def send_to_dead_letter_queue(sqs_client, queue_url: str, messages: Sequence[Dict]):
+    logger.warning('Moving %s message(s) to the dead-letter queue: %s', len(messages),
+                   [message.get('Body') for message in messages])
+    entries = []
+    for message in messages:
+        entry = {'Id': message.get('MessageId'), 'MessageBody': message.get('Body')}
+        # Standard queues reject message group ids. FIFO queues need a deduplication id unless content-based
+        # deduplication is enabled, and the id of the source message is unique
+        if AWS_SQS_DEAD_LETTER_URL.endswith('.fifo'):
+            entry['MessageGroupId'] = get_message_group_id(parse_match_message(message.get('Body'))[1],
+                                                           MATCH_QUEUE_MESSAGE_GROUPS)
+            entry['MessageDeduplicationId'] = message.get('MessageId')
+        entries.append(entry)
+    response = sqs_client.send_message_batch(
+        QueueUrl=AWS_SQS_DEAD_LETTER_URL,
         Entries=entries
     )
-    print('Successfully received message(s) and deleted from queue')
-    return messages['Messages']
+    if response.get('Failed'):
+        metrics.increment('sqs.dead_letter_failed', len(response['Failed']))
+        logger.warning('Could not move %s message(s) to the dead-letter queue: %s', len(response['Failed']),
+                       response['Failed'])
+    sent_ids = set(entry.get('Id') for entry in response.get('Successful', []))
+    metrics.increment('sqs.dead_lettered', len(sent_ids))
+    delete_match_messages(sqs_client, queue_url, [message for message in messages
+                                                  if message.get('MessageId') in sent_ids])
+
+
+# Keep extending the visibility timeout of in-flight messages until they are acknowledged, so slow batches are not
+# redelivered to another worker while they are still being processed
+class VisibilityExtender:
+    def __init__(self, sqs_client, queue_url: str, messages: Sequence[Dict]):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self.entries = []
+        self.lock = threading.Lock()
+        # Notified whenever messages are removed
+        self.removed = threading.Condition(self.lock)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.add(messages)
+
+    def __enter__(self):
+        if self.sqs_client is not None:
+            self.thread.start()
+        return self
+
+    # Start extending the visibility of more messages
+    def add(self, messages: Sequence[Dict]):
+        with self.lock:
+            self.entries.extend({'Id': message.get('MessageId'), 'ReceiptHandle': message.get('ReceiptHandle'),
+                                 'VisibilityTimeout': VISIBILITY_TIMEOUT}
+                                for message in messages)
+
+    # Stop extending the visibility of messages that were deleted or should be retried
+    def remove(self, messages: Sequence[Dict]):
+        receipt_handles = set(message.get('ReceiptHandle') for message in messages)
+        with self.lock:
+            self.entries = [entry for entry in self.entries if entry['ReceiptHandle'] not in receipt_handles]
+            self.removed.notify_all()
+
+    # Number of messages still being extended
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+    # Block until messages are removed or the timeout runs out
+    def wait_for_removal(self, timeout: float):
+        with self.lock:
+            if self.entries:
+                self.removed.wait(timeout)
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
 
+    def run(self):
+        while not self.stopped.wait(VISIBILITY_EXTEND_INTERVAL):
+            with self.lock:
+                entries = list(self.entries)
+            for i in range(0, len(entries), SQS_BATCH_SIZE):
+                try:
+                    self.sqs_client.change_message_visibility_batch(QueueUrl=self.queue_url,
+                                                                    Entries=entries[i:i + SQS_BATCH_SIZE])
+                except ClientError as err:
+                    logger.warning('Exception encountered extending SQS message visibility: %s', str(err))
 
-def read_match(match_id: str):
-    get(RIOT_GET_MATCH_URL.format('na1', match_id))
+
+def read_match(region: str, match_id: str):
+    return get(RIOT_GET_MATCH_URL.format(region, match_id))
+
+
+# Platform ids returned by the Riot API (e.g. 'NA1', 'EUW1') are the upper case region prefixes
+def get_region(platform_id: str) -> str:
+    return platform_id.lower() if platform_id else DEFAULT_REGION
+
+
+def get_queue_url(region: str) -> str:
+    return AWS_SQS_URL_BY_REGION.get(region, AWS_SQS_URL)
+
+
+def format_match_message(region: str, match_id) -> str:
+    return '{}{}{}'.format(region, MATCH_MESSAGE_SEPARATOR, match_id)
+
+
+# Return (region, match_id) tuple from an SQS message body
+def parse_match_message(body: str) -> Tuple[str, str]:
+    if MATCH_MESSAGE_SEPARATOR not in body:
+        return DEFAULT_REGION, body
+    region, match_id = body.split(MATCH_MESSAGE_SEPARATOR, 1)
+    return region, match_id
 
 
 # Insert single match row into matches table
+# Return True if successful. None if not.
 def insert_single_match_into_db(connection, match: Dict, accountIdByParticipantId: Dict):
     if not match:
         return None
     cursor = connection.cursor()
+    match_id = match.get('gameId')
+    started_at = time.perf_counter()
     try:
-        match_id = match.get('gameId')
-        print('Inserting match id={} into matches table...'.format(match_id))
+        logger.info('Inserting match id=%s into matches table...', match_id, extra=SAMPLED)
+        existing_regions = rollups.get_existing_match_regions(cursor, [match_id])
+        match_values = get_match_values(match)
+        if is_region_conflict(existing_regions, match_values):
+            connection.rollback()
+            metrics.increment('db.region_conflicts')
+            logger.warning('Match id=%s of region %s is already stored for region %s. Skipping...', match_id,
+                           match_values[1], existing_regions[match_id])
+            return None
+        # Matches inserted before, e.g. by a redelivered message, are already counted in the rollups
+        is_new_match = MAINTAIN_ROLLUPS and match_id not in existing_regions
 
         # Insert into matches table
-        match_values = (match_id, match.get('platformId'), match.get('gameCreation'),  # No MS Precision
-                        match.get('gameDuration'), match.get('seasonId'), match.get('gameVersion'))
         cursor.execute(MATCHES_INSERT_STMT, match_values)
 
         # Insert into match_teams table
-        if match.get('teams'):
-            match_team_values = [(
-                team.get('teamId'), match_id, team.get('win'), team.get('firstBlood'), team.get('firstTower'),
-                team.get('firstInhibitor'), team.get('firstBaron'), team.get('firstDragon'),
-                team.get('firstRiftHerald'), team.get('towerKills'), team.get('inhibitorKills'),
-                team.get('baronKills'), team.get('dragonKills'), team.get('riftHeraldKills')
-            ) for team in match['teams']]
+        match_team_values = get_match_team_values(match)
+        if match_team_values:
             cursor.executemany(MATCH_TEAMS_INSERT_STMT, match_team_values)
 
         # Insert into match_timelines and match_participants table
-        for participant in match.get('participants', []):
-            participant_value_dict = {}
-            # Insert into match_timelines table
-            if participant.get('timeline'):
-                # For each timeline stat for this particular participant
-                for (key, value) in participant.get('timeline').items():
-                    if (key in ('creepsPerMinDeltas', 'xpPerMinDeltas', 'goldPerMinDeltas', 'csDiffPerMinDeltas',
-                                'xpDiffPerMinDeltas', 'damageTakenPerMinDeltas', 'damageTakenDiffPerMinDeltas')):
-                        match_timeline_values = (
-                            value.get('0-10'), value.get('10-20'), value.get('20-30'), value.get('30-end')
-                        )
-                        cursor.execute(MATCH_TIMELINES_INSERT_STMT, match_timeline_values)
-                        # Set foreign key of match_participants table
-                        participant_value_dict[key[:-1] + '_id'] = cursor.lastrowid
-            set_participant_values(participant_value_dict, participant)  # Mutate participant_value_dict
-            participant_value_dict['match_id'] = match_id
-            # Since we're directly formatting the insert statement string, we need to add quotes for strings
-            participant_value_dict['account_id'] = "'" + accountIdByParticipantId.get(
-                participant.get('participantId')) + "'"
-            cursor.execute(MATCH_PARTICIPANTS_INSERT_STMT.format(**participant_value_dict))
+        match_timeline_values = []
+        participant_values = [
+            get_participant_values(match_id, participant, accountIdByParticipantId, match_timeline_values)
+            for participant in match.get('participants', [])
+        ]
+        if match_timeline_values:
+            cursor.executemany(MATCH_TIMELINES_INSERT_STMT, match_timeline_values)
+        if participant_values:
+            cursor.executemany(MATCH_PARTICIPANTS_INSERT_STMT, participant_values)
+        participant_timeline_values = get_participant_timeline_values(match)
+        if participant_timeline_values:
+            cursor.executemany(MATCH_PARTICIPANT_TIMELINES_INSERT_STMT, participant_timeline_values)
+        if is_new_match:
+            rollups.add_matches(cursor, [(match_values, participant_values)])
         connection.commit()
+        return True
     except mysql.connector.Error as err:
-        print('Exception encountered when attempting to insert match with id: {}. Skipping...: '
-              .format(match_id), str(err))
+        connection.rollback()
+        metrics.error('db.insert_match', err)
+        logger.warning('Exception encountered when attempting to insert match with id: %s. Skipping...: %s',
+                       match_id, str(err))
         return None
     finally:
         cursor.close()
+        metrics.observe('db.insert_match.latency_ms', (time.perf_counter() - started_at) * 1000)
+        metrics.increment('db.insert_match.count')
 
 
-def insert_batched_matches_into_db(matches: Sequence):
-    # insert into mysql db
-    return
+# Insert many matches at once, writing each table with multi-row statements inside a single transaction
+# @param matches Sequence of (match, accountIdByParticipantId) tuples
+# Return list of match ids that could not be inserted
+def insert_batched_matches_into_db(connection, matches: Sequence[Tuple[Dict, Dict]]) -> List:
+    failed_match_ids = []
+    match_rows = []
+    # Build rows up front so a malformed match is isolated before touching the DB
+    for (match, accountIdByParticipantId) in matches:
+        if not match:
+            continue
+        try:
+            match_rows.append((match, accountIdByParticipantId, build_match_rows(match, accountIdByParticipantId)))
+        except (KeyError, TypeError, ValueError) as err:
+            logger.warning('Malformed match with id: %s. Skipping...: %s', match.get('gameId'), str(err))
+            failed_match_ids.append(match.get('gameId'))
+    failed_match_ids.extend(insert_match_rows_into_db(connection, match_rows))
+    if failed_match_ids:
+        logger.warning('Could not insert matches with ids: %s', failed_match_ids)
+    return failed_match_ids
 
 
-def send_matchlist_message_from_account(connection, sqs_client, account: Dict):
-    account_id = account.get('currentAccountId')
-    print('Grabbing match lists of summoner account id={}...'.format(account_id))
+# Return the (matches row, match_teams rows, match_timelines_stats rows, match_participants rows,
+# match_participant_timelines rows) of a match. Raises KeyError, TypeError or ValueError if the match is malformed
+def build_match_rows(match: Dict, accountIdByParticipantId: Dict) -> Tuple[Tuple, List, List, List, List]:
+    check_participant_accounts(match, accountIdByParticipantId)
+    match_values = get_match_values(match)
+    match_team_values = get_match_team_values(match)
+    match_timeline_values = []
+    participant_values = [
+        get_participant_values(match.get('gameId'), participant, accountIdByParticipantId, match_timeline_values)
+        for participant in match.get('participants', [])
+    ]
+    return (match_values, match_team_values, match_timeline_values, participant_values,
+            get_participant_timeline_values(match))
+
+
+# Write the rows of many matches with multi-row statements inside a single transaction
+# @param match_rows Sequence of (match, accountIdByParticipantId, build_match_rows result) tuples
+# Return list of match ids that could not be inserted
+def insert_match_rows_into_db(connection, match_rows: Sequence[Tuple[Dict, Dict, Tuple]]) -> List:
+    if not match_rows:
+        return []
+    # A match received twice in one batch is written and counted in the rollups once, with its last rows
+    match_rows = list(dict((rows[0][0], (match, accounts, rows)) for (match, accounts, rows) in match_rows).values())
+    logger.info('Inserting batch of %s matches into matches table...', len(match_rows), extra=SAMPLED)
+    failed_match_ids = []
     cursor = connection.cursor()
-    # Attempt to insert account. If account_id not unique, it will fail
+    started_at = time.perf_counter()
     try:
-        account_values = (account_id, account.get('summonerName'), account.get('summonerId'),
-                          account.get('currentPlatformId'))
-        cursor.execute(ACCOUNTS_INSERT_STMT, account_values)
-        match_list = get(RIOT_GET_MATCHLIST_URL.format('na1', account_id))
-        batch_container = []
-        for match in match_list.get('matches', []):
-            batch_container.append(match.get('gameId'))
-            if len(batch_container) >= 10:
-                send_matches_to_sqs(sqs_client, batch_container)
-                batch_container.clear()
-        # Send the rest that are left over
-        if len(batch_container) > 0:
-            send_matches_to_sqs(sqs_client, batch_container)
+        existing_regions = rollups.get_existing_match_regions(cursor, [rows[0][0] for (match, accounts, rows)
+                                                                       in match_rows])
+        conflicting_match_ids = [rows[0][0] for (match, accounts, rows) in match_rows
+                                 if is_region_conflict(existing_regions, rows[0])]
+        if conflicting_match_ids:
+            metrics.increment('db.region_conflicts', len(conflicting_match_ids))
+            logger.warning('Matches with ids: %s are already stored for another region. Skipping...',
+                           conflicting_match_ids)
+            failed_match_ids.extend(conflicting_match_ids)
+            match_rows = [(match, accounts, rows) for (match, accounts, rows) in match_rows
+                          if rows[0][0] not in conflicting_match_ids]
+            if not match_rows:
+                connection.rollback()
+                return failed_match_ids
+        # mysql.connector rewrites executemany on INSERT statements into a single multi-row INSERT
+        cursor.executemany(MATCHES_INSERT_STMT, [rows[0] for (match, accounts, rows) in match_rows])
+        match_team_values = [row for (match, accounts, rows) in match_rows for row in rows[1]]
+        if match_team_values:
+            cursor.executemany(MATCH_TEAMS_INSERT_STMT, match_team_values)
+        # Timeline rows must exist before the participant rows referencing them
+        match_timeline_values = [row for (match, accounts, rows) in match_rows for row in rows[2]]
+        if match_timeline_values:
+            cursor.executemany(MATCH_TIMELINES_INSERT_STMT, match_timeline_values)
+        participant_values = [row for (match, accounts, rows) in match_rows for row in rows[3]]
+        if participant_values:
+            cursor.executemany(MATCH_PARTICIPANTS_INSERT_STMT, participant_values)
+        participant_timeline_values = [row for (match, accounts, rows) in match_rows for row in rows[4]]
+        if participant_timeline_values:
+            cursor.executemany(MATCH_PARTICIPANT_TIMELINES_INSERT_STMT, participant_timeline_values)
+        # Matches inserted before, e.g. by a redelivered message, are already counted in the rollups
+        if MAINTAIN_ROLLUPS:
+            rollups.add_matches(cursor, [(rows[0], rows[3]) for (match, accounts, rows) in match_rows
+                                         if rows[0][0] not in existing_regions])
         connection.commit()
-    except mysql.connector.IntegrityError as err:
-        print('This summoner account, id: {}, has most likely already been added. Skipping...: '
-              .format(account_id), str(err))
+        metrics.observe('db.insert_batch.latency_ms', (time.perf_counter() - started_at) * 1000)
+        metrics.increment('db.insert_batch.matches', len(match_rows))
+        metrics.increment('db.insert_batch.rows', len(match_rows) + len(match_team_values) +
+                          len(match_timeline_values) + len(participant_values) + len(participant_timeline_values))
+    except mysql.connector.Error as err:
+        connection.rollback()
+        metrics.error('db.insert_batch', err)
+        logger.warning('Exception encountered when inserting batch of matches (change rolled back). '
+                       'Falling back to inserting matches one at a time...: %s', str(err))
+        # Isolate the bad match(es) without losing the rest of the batch
+        for (match, accountIdByParticipantId, rows) in match_rows:
+            if not insert_single_match_into_db(connection, match, accountIdByParticipantId):
+                failed_match_ids.append(match.get('gameId'))
     finally:
         cursor.close()
+    return failed_match_ids
 
 
-# Send get request to url and return json
-def get(url: str):
-    try:
-        print('Reading response and parsing json file from {}'.format(url))
-        jsonResponse = requests.get(url, timeout=(2, 5), headers={'X-Riot-Token': RIOT_GAMES_API_KEY}).json()
-        # Unsuccessful status code
-        status = jsonResponse.get('status')
-        # For Riot Games API in particular, there will be no status field for successful 200 responses
-        if status and not status.get('status_code') == 200:
-            print('Unsuccessful response status code {}: {}'
-                  .format(status.get('status_code'), status.get('message')))
-            return None
+# True if the id of the matches row is already stored for another region. Rows imported before regions were lower
+# cased hold the platform id
+# @param existing_regions match_id -> stored region, from Rollups.get_existing_match_regions
+def is_region_conflict(existing_regions: Dict, match_values: Tuple) -> bool:
+    return match_values[0] in existing_regions and get_region(existing_regions[match_values[0]]) != match_values[1]
+
+
+def get_match_values(match: Dict) -> Tuple:
+    return (match['gameId'], get_region(match.get('platformId')), match.get('gameCreation'),  # No MS Precision
+            match.get('gameDuration'), match.get('seasonId'), match.get('gameVersion'))
+
+
+def get_match_team_values(match: Dict) -> List[Tuple]:
+    return [(
+        team.get('teamId'), match.get('gameId'), team.get('win'), team.get('firstBlood'), team.get('firstTower'),
+        team.get('firstInhibitor'), team.get('firstBaron'), team.get('firstDragon'),
+        team.get('firstRiftHerald'), team.get('towerKills'), team.get('inhibitorKills'),
+        team.get('baronKills'), team.get('dragonKills'), team.get('riftHeraldKills')
+    ) for team in match.get('teams', [])]
+
+
+# Timeline ids are derived from (match, participant, stat kind) instead of AUTO_INCREMENT so timeline and
+# participant rows can be built without a round trip per row. Participant ids are 1-10, so ids never overlap
+def get_match_timeline_id(match_id, participant_id: int, stat_kind_index: int) -> int:
+    return int(match_id) * 1000 + participant_id * 10 + stat_kind_index
+
+
+# Fail fast if any participant is missing an account id
+def check_participant_accounts(match: Dict, accountIdByParticipantId: Dict):
+    for participant in match.get('participants', []):
+        if not accountIdByParticipantId.get(participant.get('participantId')):
+            raise ValueError('No account id for participant id={}'.format(participant.get('participantId')))
+
+
+# Compile the column mapping into a function returning a participant's row as a tuple. Consecutive columns with the
+# same source are read with a single map() over the bound dict.get, so no per-column Python code runs per row
+def compile_participant_extractor(column_mapping: Sequence[Tuple]) -> Callable:
+    # Group consecutive columns by source into (source, fields or computed value slice) runs
+    runs = []
+    num_computed = 0
+    for (column, source, field) in column_mapping:
+        if not runs or runs[-1][0] != source:
+            runs.append((source, []))
+        if source == COMPUTED:
+            runs[-1][1].append(num_computed)
+            num_computed += 1
         else:
-            return jsonResponse
-    except Exception as err:
-        print('Exception encountered in response from Riot Games API or when serializing into JSON: ', str(err))
-        traceback.print_tb(err.__traceback__)
-        return None
+            runs[-1][1].append(field)
+    getters = []
+    for (source, fields) in runs:
+        if source == COMPUTED:
+            getters.append((source, slice(fields[0], fields[-1] + 1)))
+        else:
+            getters.append((source, tuple(fields)))
+
+    # @param computed Values of the COMPUTED columns in column order
+    def extract(participant: Dict, stats: Dict, computed: Tuple) -> Tuple:
+        row = ()
+        for (source, fields) in getters:
+            if source == PARTICIPANT_FIELD:
+                row += tuple(map(participant.get, fields))
+            elif source == STATS_FIELD:
+                row += tuple(map(stats.get, fields))
+            else:
+                row += computed[fields]
+        return row
+    return extract
+
+
+extract_participant_values = compile_participant_extractor(MATCH_PARTICIPANTS_COLUMN_MAPPING)
 
 
+# Return the values of a participant's match_participants row, ordered like MATCH_PARTICIPANTS_COLUMNS
+# @param match_timeline_values List that the participant's match_timelines_stats rows are appended to
+def get_participant_values(match_id, participant: Dict, accountIdByParticipantId: Dict,
+                           match_timeline_values: List) -> Tuple:
+    participant_id = participant.get('participantId')
+    timeline = participant.get('timeline') or {}
+    match_timeline_ids = []
+    # For each timeline stat for this particular participant
+    for (index, key) in enumerate(TIMELINE_STAT_KINDS):
+        value = timeline.get(key)
+        if value is None or not STORE_TIMELINE_ROWS:
+            match_timeline_ids.append(None)
+            continue
+        match_timeline_id = get_match_timeline_id(match_id, participant_id, index)
+        match_timeline_values.append((
+            match_timeline_id, value.get('0-10'), value.get('10-20'), value.get('20-30'), value.get('30-end')
+        ))
+        # Set foreign key of match_participants table
+        match_timeline_ids.append(match_timeline_id)
+    computed = (match_id, accountIdByParticipantId.get(participant_id)) + tuple(match_timeline_ids)
+    return extract_participant_values(participant, participant.get('stats') or {}, computed)
+
+
+# Return the match_participant_timelines row of every participant, ordered like MATCH_PARTICIPANT_TIMELINES_COLUMNS.
+# Missing stat kinds and intervals are NULL
+def get_participant_timeline_values(match: Dict) -> List[Tuple]:
+    if not STORE_WIDE_TIMELINES:
+        return []
+    match_id = match.get('gameId')
+    return [
+        (match_id, participant.get('participantId')) + tuple(itertools.chain.from_iterable(
+            map((timeline.get(kind) or {}).get, TIMELINE_INTERVALS) for kind in TIMELINE_STAT_KINDS))
+        for (participant, timeline) in ((participant, participant.get('timeline') or {})
+                                        for participant in match.get('participants', []))
+    ]
+
+
+# Insert the accounts and send the match ids each account played since its crawl cursor to the SQS queue of its
+# region, highest scored first. Accounts are only crawled again once MATCHLIST_RECRAWL_SECONDS have passed, and
+# accounts below MIN_CRAWL_TIER are not crawled at all. Match lists are paged concurrently
+def send_matchlist_messages_from_accounts(connection, sqs_client, accounts: Sequence[Dict]):
+    index = get_visited_index(connection)
+    regions_by_account_id = {}
+    # Highest tier and patch each account was seen with in this batch
+    tiers_by_account_id = {}
+    patches_by_account_id = {}
+    account_values = []
+    for account in accounts:
+        account_id = account.get('currentAccountId')
+        if account_id is None:
+            continue
+        tier = account.get('highestAchievedSeasonTier')
+        if account_id not in tiers_by_account_id or get_tier_score(tier) > get_tier_score(
+                tiers_by_account_id[account_id]):
+            tiers_by_account_id[account_id] = tier
+        patches_by_account_id[account_id] = get_latest_patch(
+            (patches_by_account_id.get(account_id), get_patch(account.get('gameVersion'))))
+        if account_id in regions_by_account_id:
+            continue
+        region = get_region(account.get('currentPlatformId'))
+        regions_by_account_id[account_id] = region
+        # Skip the DB write for accounts that are already in the accounts table
+        if index.filter_unvisited(ACCOUNTS, (account_id,)):
+            account_values.append((account_id, account.get('summonerName'), account.get('summonerId'), region))
+    # Accounts are only marked as visited once their insert is committed
+    new_account_ids = [values[0] for values in account_values]
+    if not regions_by_account_id:
+        return
+    cursor = connection.cursor()
+    if account_values:
+        cursor.executemany(ACCOUNTS_INSERT_STMT, account_values)
+    cursor.execute(ACCOUNT_CURSORS_SELECT_STMT.format(', '.join(['%s'] * len(regions_by_account_id))),
+                   tuple(regions_by_account_id))
+    crawl_cursors = dict((account_id, (last_match_timestamp, matchlist_end_index, matchlist_crawled_at))
+                         for (account_id, last_match_timestamp, matchlist_end_index, matchlist_crawled_at) in cursor)
+    cursor.close()
+
+    now = int(time.time() * 1000)
+    due_accounts = []
+    for (account_id, region) in regions_by_account_id.items():
+        (last_match_timestamp, matchlist_end_index, matchlist_crawled_at) = crawl_cursors.get(account_id,
+                                                                                              (None, None, None))
+        if not is_crawled_tier(tiers_by_account_id[account_id], MIN_CRAWL_TIER):
+            continue
+        if matchlist_crawled_at is None or now - matchlist_crawled_at >= MATCHLIST_RECRAWL_SECONDS * 1000:
+            due_accounts.append((region, account_id, last_match_timestamp, matchlist_end_index))
+    logger.info('Grabbing match lists of %s of %s summoner accounts...', len(due_accounts),
+                len(regions_by_account_id), extra=SAMPLED)
+    if not due_accounts:
+        connection.commit()
+        index.mark_visited(ACCOUNTS, new_account_ids)
+        return
+    with ThreadPoolExecutor(max_workers=min(MATCHLIST_WORKERS, len(due_accounts))) as executor:
+        crawls = list(executor.map(lambda account: crawl_matchlist(*account), due_accounts))
+
+    current_patch = get_latest_patch(patches_by_account_id.values())
+    candidates_by_region = {}
+    cursor_values = []
+    for ((region, account_id, last_match_timestamp, matchlist_end_index), (matches, new_cursor)) in \
+            zip(due_accounts, crawls):
+        if new_cursor is None:
+            continue
+        cursor_values.append(new_cursor + (now, account_id))
+        tier = tiers_by_account_id[account_id]
+        patch = patches_by_account_id[account_id]
+        candidates_by_region.setdefault(region, []).extend(
+            (score_candidate(tier, match.get('timestamp'), patch, current_patch, now / 1000), match.get('gameId'))
+            for match in matches)
+    for (region, candidates) in candidates_by_region.items():
+        # A match found through several accounts keeps its best score. Only queue matches that were not already
+        # queued from another batch
+        candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+        scores_by_match = {}
+        for (score, match_id) in candidates:
+            scores_by_match.setdefault(format_match_message(region, match_id), (score, match_id))
+        candidates = [scores_by_match[key] for key in index.filter_unvisited(MATCHES, scores_by_match)]
+        # SQS batches hold at most 10 messages. Matches are only marked as visited once they were queued
+        for i in range(0, len(candidates), 10):
+            sent = send_matches_to_sqs(sqs_client, region, [match_id for (score, match_id) in candidates[i:i + 10]],
+                                       [score for (score, match_id) in candidates[i:i + 10]])
+            index.mark_visited(MATCHES, (format_match_message(region, match_id) for match_id in sent))
+    # Cursors are committed after their matches were queued, so an interrupted crawl is picked up again
+    if cursor_values:
+        cursor = connection.cursor()
+        cursor.executemany(ACCOUNT_CURSORS_UPDATE_STMT, cursor_values)
+        cursor.close()
+    connection.commit()
+    index.mark_visited(ACCOUNTS, new_account_ids)
+
+
+# Crawl the games an account played since its cursor, then continue paging its older history where the last crawl
+# stopped. Return the matches found and the new (last_match_timestamp, matchlist_end_index) cursor, or None for the
+# cursor if the first request failed
+# @param last_match_timestamp Creation time of the newest game already crawled. None if never crawled
+# @param matchlist_end_index Number of games, counted from the newest at the time of the last crawl, whose history
+#   was already paged. None once the whole history was paged
+def crawl_matchlist(region: str, account_id: str, last_match_timestamp, matchlist_end_index) -> Tuple[List, Tuple]:
+    pages_left = MAX_MATCHLIST_PAGES
+    matches = []
+    new_games = 0
+    if last_match_timestamp is not None:
+        for match_list in stream_matchlist(region, account_id, begin_time=last_match_timestamp + 1,
+                                           max_pages=pages_left):
+            pages_left -= 1
+            # totalGames of a beginTime window only counts the games inside the window
+            new_games = max(new_games, match_list.get('totalGames', 0))
+            matches.extend(match for match in match_list.get('matches', [])
+                           if match.get('timestamp', 0) > last_match_timestamp)
+        new_games = max(new_games, len(matches))
+        if pages_left == MAX_MATCHLIST_PAGES:
+            # No games since the last crawl. Riot answers an empty window with 404
+            pages_left -= 1
+    if last_match_timestamp is None or matchlist_end_index is not None:
+        # The games played since the last crawl pushed the older history further down the list
+        begin_index = (matchlist_end_index or 0) + new_games
+        last_page = None
+        if pages_left > 0:
+            for match_list in stream_matchlist(region, account_id, begin_index=begin_index, max_pages=pages_left):
+                last_page = match_list
+                matches.extend(match_list.get('matches', []))
+            if last_page is None and last_match_timestamp is None:
+                return matches, None
+            # Riot also answers a range past the end of the history with 404
+            matchlist_end_index = None if last_page is None or is_last_matchlist_page(last_page) \
+                else last_page.get('endIndex')
+        else:
+            matchlist_end_index = begin_index
+    timestamps = [match.get('timestamp', 0) for match in matches]
+    if last_match_timestamp is not None:
+        timestamps.append(last_match_timestamp)
+    return matches, (max(timestamps, default=0), matchlist_end_index)
+
+
+# Generator of the match list pages of an account, newest games first. Stops at the last page, after max_pages or
+# when a request fails
+# @param begin_time Only games created at or after this time in epoch milliseconds
+def stream_matchlist(region: str, account_id: str, begin_index: int = 0, begin_time: int = None,
+                     max_pages: int = MAX_MATCHLIST_PAGES) -> Iterator[Dict]:
+    for page in range(max_pages):
+        url = RIOT_GET_MATCHLIST_URL.format(region, account_id) + \
+              RIOT_MATCHLIST_PAGE_PARAMS.format(begin_index, begin_index + MATCHLIST_PAGE_SIZE)
+        if begin_time is not None:
+            url += RIOT_MATCHLIST_BEGIN_TIME_PARAM.format(begin_time)
+        match_list = get(url)
+        if not match_list:
+            return
+        yield match_list
+        if is_last_matchlist_page(match_list):
+            return
+        begin_index = match_list.get('endIndex', begin_index + MATCHLIST_PAGE_SIZE)
+
+
+def is_last_matchlist_page(match_list: Dict) -> bool:
+    return len(match_list.get('matches', [])) < MATCHLIST_PAGE_SIZE or \
+        match_list.get('endIndex', 0) >= match_list.get('totalGames', 0)
+
+
+# Send get request to url and return json. Matches are served from the archive if they were fetched before
+def get(url: str):
+    return get_many([url])[0]
+
+
+# Send get requests to all urls concurrently and return their json in the same order. Only urls that are not
+# archived are requested. Every new response is archived
+def get_many(urls: Sequence[str]) -> List:
+    if not urls:
+        return []
+    archive = get_match_archive()
+    if archive is None:
+        return get_riot_client().get_many(urls)
+    archive_keys = [get_archive_key(url) for url in urls]
+    # Match lists keep growing, so they are archived but always requested again
+    responses = [archive.get(*key) if key and key[0] == ARCHIVED_MATCH else None for key in archive_keys]
+    missing = [i for (i, response) in enumerate(responses) if response is None]
+    if len(missing) < len(urls):
+        metrics.increment('archive.hits', len(urls) - len(missing))
+        logger.info('Read %s responses from the match archive', len(urls) - len(missing), extra=SAMPLED)
+    for (i, response) in zip(missing, get_riot_client().get_many([urls[i] for i in missing])):
+        responses[i] = response
+        if response and archive_keys[i]:
+            (kind, region, key_id) = archive_keys[i]
+            archive.put(kind, region, key_id, response, replace=(kind == ARCHIVED_MATCHLIST))
+    return responses
+
+
+# Return the (kind, region, id) archive key of a match or match list url, or None for any other url
+def get_archive_key(url: str):
+    region, method = get_region_and_method(url)
+    parts = urlsplit(url)
+    key_id = parts.path.rsplit('/', 1)[1]
+    if method == get_region_and_method(RIOT_GET_MATCH_URL)[1]:
+        return ARCHIVED_MATCH, region, key_id
+    if method == get_region_and_method(RIOT_GET_MATCHLIST_URL)[1]:
+        # Every page and time window of a match list is archived separately
+        return ARCHIVED_MATCHLIST, region, key_id + '?' + parts.query
+    return None
+
+
+# The archive index is loaded once per container
+def get_match_archive() -> MatchArchive:
+    global match_archive
+    with match_archive_lock:
+        if match_archive is None and MATCH_ARCHIVE_DIR:
+            match_archive = MatchArchive(MATCH_ARCHIVE_DIR)
+        return match_archive
+
+
+# The client keeps its connection pool and rate limit budgets across calls
+def get_riot_client() -> RiotApiClient:
+    global riot_client
+    with riot_client_lock:
+        if riot_client is None:
+            riot_client = RiotApiClient()
+        return riot_client
+
+
+# The visited index is loaded from local disk once per container. If there is no index on disk yet, it is seeded
+# with the accounts and matches already in the DB
+def get_visited_index(connection) -> VisitedIndex:
+    global visited_index
+    with visited_index_lock:
+        if visited_index is None:
+            index = VisitedIndex()
+            cursor = connection.cursor()
+            if index.is_new(ACCOUNTS):
+                logger.info('Seeding visited accounts index from DB...')
+                cursor.execute('SELECT account_id FROM accounts')
+                index.mark_visited(ACCOUNTS, (account_id for (account_id,) in cursor))
+            if index.is_new(MATCHES):
+                logger.info('Seeding visited matches index from DB...')
+                # Rows imported before regions were lower cased hold the platform id, e.g. 'NA1'
+                cursor.execute('SELECT region, match_id FROM matches')
+                index.mark_visited(MATCHES, (format_match_message(get_region(region), match_id)
+                                             for (region, match_id) in cursor))
+            cursor.close()
+            visited_index = index
+        return visited_index
+
+
+# The client is created once per container and shared by all workers. boto3 clients are thread safe
 def connect_to_sqs():
-    try:
-        # Connect to aws sqs api
-        sqs_client = boto3.client(
-            'sqs',
-            aws_access_key_id=AWS_ACCESS_KEY,
-            aws_secret_access_key=AWS_SECRET_KEY,
-            region_name=AWS_REGION_NAME,
-        )
-        return sqs_client
-    except ClientError as err:
-        print('Exception encountered accessing AWS SQS: ', str(err))
-        traceback.print_tb(err.__traceback__)
-        return None
+    global sqs_client
+    with sqs_client_lock:
+        if sqs_client is not None:
+            return sqs_client
+        if CRAWL_FRONTIER == 'local':
+            logger.info('Using local in-memory crawl frontier instead of SQS')
+            sqs_client = LocalFrontier()
+            return sqs_client
+        try:
+            # Connect to aws sqs api
+            sqs_client = boto3.client(
+                'sqs',
+                aws_access_key_id=AWS_ACCESS_KEY,
+                aws_secret_access_key=AWS_SECRET_KEY,
+                region_name=AWS_REGION_NAME,
+                endpoint_url=AWS_SQS_ENDPOINT_URL,
+            )
+            return sqs_client
+        except ClientError as err:
+            logger.warning('Exception encountered accessing AWS SQS: %s', str(err), exc_info=True)
+            return None
 
 
-# Send batches of matches to AWS SQS Match Queue
-def send_matches_to_sqs(sqs_client, matchIds):
+# Send batches of matches to AWS SQS Match Queue. Return the match ids that were sent
+# @param scores Crawl frontier score of each match. Sent as the Priority message attribute
+def send_matches_to_sqs(sqs_client, region: str, matchIds, scores: Sequence[float] = None) -> List:
     if sqs_client is None:
-        return
+        return []
     messages = [
         {
             'Id': str(matchId),
-            'MessageBody': str(matchId),
-            'MessageGroupId': '1'
+            'MessageBody': format_match_message(region, matchId),
+            'MessageGroupId': get_message_group_id(matchId, MATCH_QUEUE_MESSAGE_GROUPS),
+            'MessageAttributes': get_priority_attribute(score)
         }
-        for matchId in matchIds
+        for (matchId, score) in zip(matchIds, scores or [0.0] * len(matchIds))
     ]
     # Send message to SQS
-    response = sqs_client.send_message_batch(
-        QueueUrl=AWS_SQS_URL,
-        Entries=messages,
-    )
-    print('Sent {} messages with to SQS'.format(len(messages)))
-    # print(response)
-
-
-def set_participant_values(values: Dict, participant_data: Dict):
-    values['match_participant_id'] = participant_data.get('participantId')
-    values['match_team_id'] = participant_data.get('teamId')
-    values['champion_id'] = participant_data.get('championId')
-    values['spell1_id'] = participant_data.get('spell1Id')
-    values['spell2_id'] = participant_data.get('spell2Id')
-    values['win'] = participant_data.get('stats', {}).get('win', 'null')
-    values['item0_id'] = participant_data.get('stats', {}).get('item0', 'null')
-    values['item1_id'] = participant_data.get('stats', {}).get('item1', 'null')
-    values['item2_id'] = participant_data.get('stats', {}).get('item2', 'null')
-    values['item3_id'] = participant_data.get('stats', {}).get('item3', 'null')
-    values['item4_id'] = participant_data.get('stats', {}).get('item4', 'null')
-    values['item5_id'] = participant_data.get('stats', {}).get('item5', 'null')
-    values['item6_id'] = participant_data.get('stats', {}).get('item6', 'null')
-    values['kills'] = participant_data.get('stats', {}).get('kills', 'null')
-    values['deaths'] = participant_data.get('stats', {}).get('deaths', 'null')
-    values['assists'] = participant_data.get('stats', {}).get('assists', 'null')
-    values['largestKillingSpree'] = participant_data.get('stats', {}).get('largestKillingSpree', 'null')
-    values['largestMultiKill'] = participant_data.get('stats', {}).get('largestMultiKill', 'null')
-    values['killingSprees'] = participant_data.get('stats', {}).get('killingSprees', 'null')
-    values['longestTimeSpentLiving'] = participant_data.get('stats', {}).get('longestTimeSpentLiving', 'null')
-    values['doubleKills'] = participant_data.get('stats', {}).get('doubleKills', 'null')
-    values['tripleKills'] = participant_data.get('stats', {}).get('tripleKills', 'null')
-    values['quadraKills'] = participant_data.get('stats', {}).get('quadraKills', 'null')
-    values['pentaKills'] = participant_data.get('stats', {}).get('pentaKills', 'null')
-    values['unrealKills'] = participant_data.get('stats', {}).get('unrealKills', 'null')
-    values['totalDamageDealt'] = participant_data.get('stats', {}).get('totalDamageDealt', 'null')
-    values['magicDamageDealt'] = participant_data.get('stats', {}).get('magicDamageDealt', 'null')
-    values['physicalDamageDealt'] = participant_data.get('stats', {}).get('physicalDamageDealt', 'null')
-    values['trueDamageDealt'] = participant_data.get('stats', {}).get('trueDamageDealt', 'null')
-    values['largestCriticalStrike'] = participant_data.get('stats', {}).get('largestCriticalStrike', 'null')
-    values['totalDamageDealtToChampions'] = participant_data.get('stats', {}).get('totalDamageDealtToChampions', 'null')
-    values['magicDamageDealtToChampions'] = participant_data.get('stats', {}).get('magicDamageDealtToChampions', 'null')
-    values['physicalDamageDealtToChampions'] = participant_data.get('stats', {}).get('physicalDamageDealtToChampions',
-                                                                                     'null')
-    values['trueDamageDealtToChampions'] = participant_data.get('stats', {}).get('trueDamageDealtToChampions', 'null')
-    values['totalHeal'] = participant_data.get('stats', {}).get('totalHeal', 'null')
-    values['totalUnitsHealed'] = participant_data.get('stats', {}).get('totalUnitsHealed', 'null')
-    values['damageSelfMitigated'] = participant_data.get('stats', {}).get('damageSelfMitigated', 'null')
-    values['damageDealtToObjectives'] = participant_data.get('stats', {}).get('damageDealtToObjectives', 'null')
-    values['damageDealtToTurrets'] = participant_data.get('stats', {}).get('damageDealtToTurrets', 'null')
-    values['visionScore'] = participant_data.get('stats', {}).get('visionScore', 'null')
-    values['timeCCingOthers'] = participant_data.get('stats', {}).get('timeCCingOthers', 'null')
-    values['totalDamageTaken'] = participant_data.get('stats', {}).get('totalDamageTaken', 'null')
-    values['magicalDamageTaken'] = participant_data.get('stats', {}).get('magicalDamageTaken', 'null')
-    values['physicalDamageTaken'] = participant_data.get('stats', {}).get('physicalDamageTaken', 'null')
-    values['trueDamageTaken'] = participant_data.get('stats', {}).get('trueDamageTaken', 'null')
-    values['goldEarned'] = participant_data.get('stats', {}).get('goldEarned', 'null')
-    values['goldSpent'] = participant_data.get('stats', {}).get('goldSpent', 'null')
-    values['turretKills'] = participant_data.get('stats', {}).get('turretKills', 'null')
-    values['inhibitorKills'] = participant_data.get('stats', {}).get('inhibitorKills', 'null')
-    values['totalMinionsKilled'] = participant_data.get('stats', {}).get('totalMinionsKilled', 'null')
-    values['neutralMinionsKilled'] = participant_data.get('stats', {}).get('neutralMinionsKilled', 'null')
-    values['totalTimeCrowdControlDealt'] = participant_data.get('stats', {}).get('totalTimeCrowdControlDealt', 'null')
-    values['champLevel'] = participant_data.get('stats', {}).get('champLevel', 'null')
-    values['visionWardsBoughtInGame'] = participant_data.get('stats', {}).get('visionWardsBoughtInGame', 'null')
-    values['sightWardsBoughtInGame'] = participant_data.get('stats', {}).get('sightWardsBoughtInGame', 'null')
-    values['firstBloodKill'] = participant_data.get('stats', {}).get('firstBloodKill', 'null')
-    values['firstBloodAssist'] = participant_data.get('stats', {}).get('firstBloodAssist', 'null')
-    values['firstTowerKill'] = participant_data.get('stats', {}).get('firstTowerKill', 'null')
-    values['firstTowerAssist'] = participant_data.get('stats', {}).get('firstTowerAssist', 'null')
-    values['firstInhibitorKill'] = participant_data.get('stats', {}).get('firstInhibitorKill', 'null')
-    values['firstInhibitorAssist'] = participant_data.get('stats', {}).get('firstInhibitorAssist', 'null')
-    # Optional values
-    # Since we're directly formatting the insert statement string, we need to add quotes for strings
-    values['highest_achieved_season_tier'] = "'" + participant_data.get('highestAchievedSeasonTier', 'null') + "'"
-    values['creepsPerMinDelta_id'] = 'null'
-    values['xpPerMinDelta_id'] = 'null'
-    values['goldPerMinDelta_id'] = 'null'
-    values['csDiffPerMinDelta_id'] = 'null'
-    values['xpDiffPerMinDelta_id'] = 'null'
-    values['damageTakenPerMinDelta_id'] = 'null'
-    values['damageTakenDiffPerMinDelta_id'] = 'null'
+    with metrics.timer('sqs.send'):
+        response = sqs_client.send_message_batch(
+            QueueUrl=get_queue_url(region),
+            Entries=messages,
+        )
+    metrics.increment('sqs.sent', len(messages) - len(response.get('Failed', [])))
+    if response.get('Failed'):
+        metrics.increment('sqs.send_failed', len(response['Failed']))
+        logger.warning('Could not send %s messages to SQS: %s', len(response['Failed']), response['Failed'])
+    logger.info('Sent %s messages to SQS', len(messages), extra=SAMPLED)
+    failed_ids = set(entry.get('Id') for entry in response.get('Failed', []))
+    return [matchId for matchId in matchIds if str(matchId) not in failed_ids]
+
 
 if __name__ == '__main__':
-    initialize({'state': 'backlog'})
+    try:
+        initialize({'state': 'backlog'})
+    finally:
+        metrics.flush({'mode': 'backlog'})
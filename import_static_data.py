@@ -1,20 +1,47 @@
-from config import db_config, DB_TYPE
+import config
+from concurrent.futures import ThreadPoolExecutor
+from config import DB_TYPE
+from db_connections import get_connection
+from decimal import Decimal
+import hashlib
 import json
+import re
+from metrics import metrics
 import mysql.connector
+import os
 import requests
 import sys
 import tarfile
+import threading
 import traceback
-from typing import Callable, Dict, Sequence
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
 
 # Import static data such as items, champions, and summoner spells
 
 DATA_DRAGON_URL_HTTP = 'https://ddragon.leagueoflegends.com/cdn/dragontail-%s.tgz'
+# Every released version, newest first
+DATA_DRAGON_VERSIONS_URL = 'https://ddragon.leagueoflegends.com/api/versions.json'
+# Local copy of the versions manifest to resolve the patch from instead, e.g. for tests
+DATA_DRAGON_VERSIONS_FILE = getattr(config, 'DATA_DRAGON_VERSIONS_FILE', None)
+# Downloaded tarballs are kept here by patch, next to the sha256 of the completed download
+DATA_DRAGON_CACHE_DIR = getattr(config, 'DATA_DRAGON_CACHE_DIR', 'data/cache')
+CACHE_FILENAME = 'dragontail-%s.tgz'
+PATCH_VERSION_PATTERN = re.compile(r'^\d+\.\d+\.\d+$')
 LOCAL_FILENAME = 'data/data_dragon.tgz'
 CHAMPION_JSON_PATH = 'data/%s/data/en_US/champion.json'
 ITEM_JSON_PATH = 'data/%s/data/en_US/item.json'
 SUMMONER_JSON_PATH = 'data/%s/data/en_US/summoner.json'
+# Path of every json file the importer needs inside the tarball, e.g. 10.4.1/data/en_US/champion.json
+TAR_MEMBER_PATHS = {
+    'champion_json': CHAMPION_JSON_PATH[len('data/'):],
+    'item_json': ITEM_JSON_PATH[len('data/'):],
+    'summoner_json': SUMMONER_JSON_PATH[len('data/'):],
+}
 CHUNK_SIZE = 8192
+READ_TIMEOUT = 30
+DOWNLOAD_ATTEMPTS = 3
+# Patches downloaded, parsed and turned into rows at the same time by --patches
+STATIC_IMPORT_WORKERS = getattr(config, 'STATIC_IMPORT_WORKERS', 4)
 
 # insert statements
 CHAMPIONS_INSERT_STMT = (
@@ -23,22 +50,24 @@ CHAMPIONS_INSERT_STMT = (
     "resource_type, stat_hp, stat_hpperlevel, stat_mp, stat_mpperlevel, stat_movespeed, stat_armor,"
     "stat_armorperlevel, stat_spellblock, stat_spellblockperlevel, stat_attackrange, stat_hpregen,"
     "stat_hpregenperlevel, stat_mpregen, stat_mpregenperlevel, stat_crit, stat_critperlevel, stat_attackdamage,"
-    "stat_attackdamageperlevel, stat_attackspeedperlevel, stat_attackspeed, is_active ) "
+    "stat_attackdamageperlevel, stat_attackspeedperlevel, stat_attackspeed, is_active, row_hash ) "
     "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, "
-    "%s, %s, %s, %s, %s, %s, %s);"
+    "%s, %s, %s, %s, %s, %s, %s, %s);"
 )
 ITEMS_INSERT_STMT = (
     "INSERT IGNORE INTO items "
     "(item_id, name, description, gold_base, gold_total, purchaseable, active_in_srmap, depth,"
-    "patch_ver, is_active) "
-    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+    "patch_ver, is_active, row_hash) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
 )
 SUMMONERS_INSERT_STMT = (
     "INSERT IGNORE INTO summoner_spells "
-    "(ss_id, name, description, cooldown, patch_ver, is_active) "
-    "VALUES (%s, %s, %s, %s, %s, %s)"
+    "(ss_id, name, description, cooldown, patch_ver, is_active, row_hash) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s)"
 )
-PROPERTIES_INSERT_STMT = "INSERT INTO {} (name) VALUES (%s);"
+PROPERTIES_INSERT_STMT = "INSERT IGNORE INTO {} (name) VALUES (%s);"
+PROPERTIES_SELECT_STMT = "SELECT {0}_id, name FROM {1}"
+PROPERTIES_SELECT_BY_NAME_STMT = "SELECT {0}_id, name FROM {1} WHERE name IN ({2})"
 ENTITIES_TAGS_INSERT_STMT = (
     "INSERT IGNORE INTO {0}_tag_map "
     "({0}_id, tag_id, patch_ver, is_active) "
@@ -54,64 +83,323 @@ ITEMS_ITEMS_INSERT_STMT = (
     "(component_id, result_id, patch_ver, is_active) "
     "VALUES (%s, %s, %s, %s)"
 )
+DEACTIVATE_STMT = "UPDATE {0} SET is_active = FALSE, patch_ver = %s WHERE {1}"
+# Columns that change with every patch without the data changing
+VERSION_COLUMNS = ('patch_ver', 'is_active', 'row_hash')
+# FLOAT(6,3) columns come back rounded
+FLOAT_TOLERANCE = 0.0005
 
+# property table -> name -> id of every tag and stat seen so far. Ids never change once a name is inserted, so the map
+# is loaded once per process and kept across patches
+property_ids_cache: Dict[str, Dict[str, int]] = {}
+property_ids_lock = threading.Lock()
 
-def initialize_static_tables():
+
+# @param patch_version Patch to import. Resolved by get_patch_version if None
+def initialize_static_tables(patch_version: str = None):
     print('Initializing static data tables...')
-    global patch_version
-    patch_version = get_patch_manual()
-    if '--no-request' not in sys.argv:
-        success = get_data_dragon_tarfile(patch_version)  # Load file. File will be accessible at LOCAL_FILENAME
-        if not success or not tarfile.is_tarfile(LOCAL_FILENAME):
-            print('No tables were initialized. Exiting...')
-            return
-        with tarfile.open(LOCAL_FILENAME) as tar:
-            print('Extracting data from tarfile...')
-            tar.extractall(path='./data')
+    patch_version = patch_version or get_patch_version()
+    if patch_version is None:
+        print('No patch version could be resolved. Exiting...')
+        return
+    data = load_static_data(patch_version)
+    if data is None:
+        print('No tables were initialized. Exiting...')
+        return
+    try:
+        insert_initial_data_into_db(data, patch_version)
+    finally:
+        metrics.flush({'mode': 'static'})
+    print('Operations finished. Exiting...')
+
+
+# Bring the static tables up to date with a new patch in a single transaction. Only new and changed rows are written,
+# and rows missing from the new patch are kept but marked inactive
+def update_static_tables(patch_version: str = None):
+    print('Updating static data tables...')
+    patch_version = patch_version or get_patch_version()
+    if patch_version is None:
+        print('No patch version could be resolved. Exiting...')
+        return
+    data = load_static_data(patch_version)
+    if data is None:
+        print('No tables were updated. Exiting...')
+        return
+    connection = get_connection()
+    try:
+        update_static_data_in_db(connection, build_static_rows(data, patch_version))
+    finally:
+        connection.close()
+        metrics.flush({'mode': 'static_update'})
+    print('Operations finished. Exiting...')
+
+
+# Bring the static tables through a list of patches, oldest first, e.g. to backfill the history of a season.
+# Downloading, parsing and building the rows of every patch runs on a pool of workers, while this thread is the single
+# writer that applies the patches one transaction each, in order, as soon as they are ready. Every patch is applied like
+# --update, so a row ends up with the last patch it changed in and rows removed by a patch are marked inactive
+# Return the patches that could not be imported
+def import_static_patches(patch_versions: Sequence[str], workers: int = STATIC_IMPORT_WORKERS) -> List[str]:
+    patch_versions = sorted(set(patch_versions), key=get_patch_version_key)
+    if not patch_versions:
+        print('No patch versions to import. Exiting...')
+        return []
+    print('Importing {} patches from {} to {} with {} workers...'.format(
+        len(patch_versions), patch_versions[0], patch_versions[-1], workers))
+    failed_patch_versions = []
+    connection = get_connection()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(patch_versions)))) as executor:
+            # map hands out the results in patch order, while the workers keep loading the patches after them
+            for (patch_version, static_rows) in zip(patch_versions, executor.map(load_static_rows, patch_versions)):
+                if static_rows is None or not update_static_data_in_db(connection, static_rows):
+                    failed_patch_versions.append(patch_version)
+                    continue
+                metrics.increment('static.patches')
+    finally:
+        connection.close()
+        metrics.flush({'mode': 'static_backfill'})
+    if failed_patch_versions:
+        print('Patches that could not be imported: {}'.format(', '.join(failed_patch_versions)))
+    print('Operations finished. Exiting...')
+    return failed_patch_versions
+
+
+# Load a patch and build its rows, or return None if it could not be loaded
+def load_static_rows(patch_version: str) -> Optional[Dict]:
+    with metrics.timer('static.load_patch'):
+        data = load_static_data(patch_version)
+        if data is None:
+            print('Patch {} could not be loaded'.format(patch_version))
+            return None
+        return build_static_rows(data, patch_version)
+
+
+# Return the champion, item and summoner json of a patch, or None if they could not be loaded
+# --no-request: read the cached tarball of the patch or the one already at LOCAL_FILENAME, or the files already
+#   extracted into ./data
+# --stream: read the json files straight from the download without writing the tarball to disk
+def load_static_data(patch_version: str) -> Optional[Dict]:
+    if '--stream' in sys.argv:
+        return stream_data_dragon_json(patch_version)
+    if '--no-request' in sys.argv:
+        path = get_cached_tarfile(patch_version) or LOCAL_FILENAME
+    else:
+        path = get_data_dragon_tarfile(patch_version)
+        if path is None:
+            return None
+    if os.path.exists(path):
+        with open(path, 'rb') as file:
+            return read_json_from_tarfile(file, patch_version)
     data = {}
     data['champion_json'] = read_json_file(CHAMPION_JSON_PATH % patch_version)
     data['item_json'] = read_json_file(ITEM_JSON_PATH % patch_version)
     data['summoner_json'] = read_json_file(SUMMONER_JSON_PATH % patch_version)
-    insert_initial_data_into_db(data)
-    print('Operations finished. Exiting...')
+    if not all(data.values()):
+        return None
+    return data
 
 
-# TODO: Implement this
-def update_static_tables():
-    print('Updating static data tables...')
-    return None
+# --patch X.Y.Z imports that patch, --manual asks for it, and otherwise the newest patch of the versions manifest is
+# imported, so the import can run unattended
+def get_patch_version() -> Optional[str]:
+    for (i, arg) in enumerate(sys.argv):
+        if arg == '--patch' and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if arg.startswith('--patch='):
+            return arg[len('--patch='):]
+    if '--manual' in sys.argv:
+        return get_patch_manual()
+    return get_latest_patch_version(get_data_dragon_versions())
 
 
 def get_patch_manual():
     return input('Please enter desired patch version in X.Y.Z format.\n X=season, Y=major version, Z=minor version\n')
 
 
-# Return True if successful. False if not.
-def get_data_dragon_tarfile(patch_version):
+# Return the versions manifest, or None if it could not be loaded
+def get_data_dragon_versions() -> Optional[List[str]]:
+    try:
+        if DATA_DRAGON_VERSIONS_FILE:
+            print('Reading versions manifest: %s' % DATA_DRAGON_VERSIONS_FILE)
+            with open(DATA_DRAGON_VERSIONS_FILE, encoding='utf8') as file:
+                return json.load(file)
+        print('Retrieving versions manifest from Riot Games API: %s...' % DATA_DRAGON_VERSIONS_URL)
+        response = requests.get(DATA_DRAGON_VERSIONS_URL, timeout=(3, READ_TIMEOUT))
+        response.raise_for_status()
+        return response.json()
+    except (OSError, ValueError, requests.RequestException) as err:
+        print('Exception encountered when retrieving Riot Data Dragon versions: ', str(err))
+        return None
+
+
+# Newest X.Y.Z version of the manifest. Old manifests also hold entries such as lolpatch_7.20, which are skipped
+def get_latest_patch_version(versions: Optional[List[str]]) -> Optional[str]:
+    patch_versions = [version for version in versions or () if PATCH_VERSION_PATTERN.match(str(version))]
+    if not patch_versions:
+        return None
+    patch_version = max(patch_versions, key=get_patch_version_key)
+    print('Latest patch version: %s' % patch_version)
+    return patch_version
+
+
+def get_patch_version_key(patch_version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in patch_version.split('.'))
+
+
+# Patches given after --patches, e.g. --patches 10.1.1 10.2.1 or --patches 10.1.1-10.25.1. A range holds every patch of
+# the versions manifest between its ends, inclusive
+def get_patch_versions(args: Sequence[str]) -> List[str]:
+    patch_versions = []
+    versions = None
+    for arg in args:
+        if '-' not in arg:
+            patch_versions.append(arg)
+            continue
+        (first, last) = arg.split('-', 1)
+        if versions is None:
+            versions = [version for version in get_data_dragon_versions() or ()
+                        if PATCH_VERSION_PATTERN.match(str(version))]
+        patch_versions += [version for version in versions
+                           if get_patch_version_key(first) <= get_patch_version_key(version)
+                           <= get_patch_version_key(last)]
+    return patch_versions
+
+
+# Arguments after flag up to the next flag
+def get_flag_args(flag: str) -> List[str]:
+    if flag not in sys.argv:
+        return []
+    args = sys.argv[sys.argv.index(flag) + 1:]
+    return args[:next((i for (i, arg) in enumerate(args) if arg.startswith('--')), len(args))]
+
+
+def get_cache_path(patch_version: str) -> str:
+    return os.path.join(DATA_DRAGON_CACHE_DIR, CACHE_FILENAME % patch_version)
+
+
+def get_file_checksum(path: str) -> str:
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE * 128), b''):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+# Return the path of the cached tarball of a patch, or None if it is not cached. A cached tarball that does not match
+# the checksum recorded when it was downloaded is removed
+def get_cached_tarfile(patch_version: str) -> Optional[str]:
+    path = get_cache_path(patch_version)
+    if not os.path.exists(path) or not os.path.exists(path + '.sha256'):
+        return None
+    with open(path + '.sha256', encoding='utf8') as file:
+        expected_checksum = file.read().strip()
+    if get_file_checksum(path) != expected_checksum:
+        print('Cached tar file does not match its checksum, removing it: %s' % path)
+        os.remove(path)
+        os.remove(path + '.sha256')
+        return None
+    return path
+
+
+# Return the path of the tarball of a patch, downloading it into the cache unless it is already there, or None if it
+# could not be downloaded. An interrupted download is kept as <path>.part and resumed by the next attempt or run with
+# an HTTP Range request. Data Dragon never changes the tarball of a released patch, so the parts always match
+def get_data_dragon_tarfile(patch_version: str) -> Optional[str]:
+    path = get_cached_tarfile(patch_version)
+    if path is not None:
+        print('Using cached tar file: %s' % path)
+        metrics.increment('static.download.cache_hits')
+        return path
+    path = get_cache_path(patch_version)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
     url = DATA_DRAGON_URL_HTTP % patch_version
     print('Retrieving tar file from Riot Games API: %s...' % url)
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            with metrics.timer('static.download'):
+                download_file(url, path + '.part')
+            break
+        except (OSError, requests.RequestException) as err:
+            print('Exception encountered when retrieving Riot Data Dragon tar file: ', str(err))
+    else:
+        return None
+    if not tarfile.is_tarfile(path + '.part'):
+        print('Downloaded file is not a tar file: %s' % url)
+        os.remove(path + '.part')
+        return None
+    with open(path + '.sha256', 'w', encoding='utf8') as file:
+        file.write(get_file_checksum(path + '.part'))
+    os.replace(path + '.part', path)
+    return path
+
+
+# Download url into path, continuing after whatever path already holds
+def download_file(url: str, path: str):
+    length_written = os.path.getsize(path) if os.path.exists(path) else 0
+    headers = {'Range': 'bytes=%d-' % length_written} if length_written else {}
+    with requests.get(url, headers=headers, timeout=(3, READ_TIMEOUT), stream=True) as response:
+        if response.status_code == 416:
+            # The part already holds the whole file
+            return
+        response.raise_for_status()  # raise an exception if status not OK
+        if response.status_code != 206:
+            # The server ignored the Range header and sends the whole file
+            length_written = 0
+        elif length_written:
+            print('Resuming download at %d bytes' % length_written)
+        content_length = response.headers.get('content-length')
+        total_length = length_written + int(content_length) if content_length else None
+        with open(path, 'ab' if length_written else 'wb') as file:
+            # Iterate over chunks
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:  # filter out keep-alive new chunks
+                    file.write(chunk)
+                    length_written += len(chunk)
+                    metrics.increment('static.download.bytes', len(chunk))
+                    # If we have a content-length header, show progress bar
+                    if total_length and length_written % (CHUNK_SIZE * 8) == 0:
+                        sys.stdout.write("\r%d%%" % int(length_written / total_length * 100))
+                        sys.stdout.flush()
+    print()
+    if total_length is not None and length_written < total_length:
+        raise OSError('Download ended after %d of %d bytes' % (length_written, total_length))
+
+
+# Download the tarball and parse the json files the importer needs while it is being downloaded
+def stream_data_dragon_json(patch_version: str) -> Optional[Dict]:
+    url = DATA_DRAGON_URL_HTTP % patch_version
+    print('Streaming tar file from Riot Games API: %s...' % url)
     try:
-        with requests.get(url, timeout=(3, None), stream=True) as response:
-            response.raise_for_status()  # raise an exception if status not OK
-            total_length = float(response.headers.get('content-length'))
-            with open(LOCAL_FILENAME, "wb") as file:
-                # Iterate over chunks
-                length_written = 0
-                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-                    if chunk: # filter out keep-alive new chunks
-                        file.write(chunk)
-                        length_written += len(chunk)
-                        # If we have a content-length header, show progress bar
-                        if total_length is not None and length_written % (CHUNK_SIZE * 8) == 0:
-                            sys.stdout.write("\r%d%%" % int(length_written / total_length * 100))
-                            sys.stdout.flush()
-        print()
-        return True
+        with requests.get(url, timeout=(3, READ_TIMEOUT), stream=True) as response:
+            response.raise_for_status()
+            return read_json_from_tarfile(response.raw, patch_version)
+    except requests.RequestException as err:
+        print('Exception encountered when streaming Riot Data Dragon tar file: ', str(err))
+        return None
 
-    except Exception as err:
-        print('Exception encountered when retrieving Riot Data Dragon tar file: ', str(err))
-        traceback.print_tb(err.__traceback__)
-        return False
+
+# Parse only the members in TAR_MEMBER_PATHS out of a Data Dragon tarball, in memory. Images and other locales are
+# skipped without being written anywhere, and reading stops as soon as every file was found. The tarball is read
+# sequentially, so fileobj can be a download stream
+def read_json_from_tarfile(fileobj, patch_version: str) -> Optional[Dict]:
+    keys_by_path = dict((path % patch_version, key) for (key, path) in TAR_MEMBER_PATHS.items())
+    data = {}
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|gz') as tar:
+            for member in tar:
+                key = keys_by_path.get(os.path.normpath(member.name))
+                if key is None or not member.isfile():
+                    continue
+                print('Parsing json file from tarfile: %s' % member.name)
+                data[key] = json.load(tar.extractfile(member))['data']
+                if len(data) == len(keys_by_path):
+                    return data
+    except (tarfile.TarError, OSError, ValueError, KeyError) as err:
+        print('Exception encountered when reading json files from tar file: ', str(err))
+        return None
+    print('Tar file is missing: {}'.format([path for (path, key) in keys_by_path.items() if key not in data]))
+    return None
 
 
 def read_json_file(path):
@@ -125,88 +413,84 @@ def read_json_file(path):
         return None
 
 
-def insert_initial_data_into_db(json_dicts: Dict):
+def insert_initial_data_into_db(json_dicts: Dict, patch_version: str):
     print('Opening connection to %s database...' % DB_TYPE)
-    connection = mysql.connector.connect(**db_config)
-    insert_rows(connection, json_dicts['champion_json'], CHAMPIONS_INSERT_STMT, get_champion_values, 'champions')
-    insert_rows(connection, json_dicts['item_json'], ITEMS_INSERT_STMT, get_item_values, 'items')
-    insert_rows(connection, json_dicts['summoner_json'], SUMMONERS_INSERT_STMT, get_summoner_values, 'summoners')
-    associate_items_with_items(connection, json_dicts['item_json'])
-
-    tagsToId = property_search_and_insert(connection, (json_dicts['champion_json'], json_dicts['item_json']), 'tags')
-    associate_tags_with_entity(connection, tagsToId, json_dicts['champion_json'], 'champion', get_champion_id)
-    associate_tags_with_entity(connection, tagsToId, json_dicts['item_json'], 'item', get_item_id)
-    statsToId = property_search_and_insert(connection, (json_dicts['item_json'],), 'stats')
-    associate_stats_with_entity(connection, statsToId, json_dicts['item_json'], 'item', get_item_id)
-
-    connection.close()
+    connection = get_connection()
+    try:
+        insert_rows(connection, json_dicts['champion_json'], CHAMPIONS_INSERT_STMT, get_champion_values, 'champions',
+                    patch_version)
+        insert_rows(connection, json_dicts['item_json'], ITEMS_INSERT_STMT, get_item_values, 'items', patch_version)
+        insert_rows(connection, json_dicts['summoner_json'], SUMMONERS_INSERT_STMT, get_summoner_values, 'summoners',
+                    patch_version)
+        associate_items_with_items(connection, json_dicts['item_json'], patch_version)
+
+        tagsToId = property_search_and_insert(connection, (json_dicts['champion_json'], json_dicts['item_json']),
+                                              'tags')
+        associate_tags_with_entity(connection, tagsToId, json_dicts['champion_json'], 'champion', get_champion_id,
+                                   patch_version)
+        associate_tags_with_entity(connection, tagsToId, json_dicts['item_json'], 'item', get_item_id, patch_version)
+        statsToId = property_search_and_insert(connection, (json_dicts['item_json'],), 'stats')
+        associate_stats_with_entity(connection, statsToId, json_dicts['item_json'], 'item', get_item_id,
+                                    patch_version)
+    finally:
+        connection.close()
     print('Import finished. Closing connection...')
 
 
 # insert rows into each table
-def insert_rows(connection, data: Dict, insert_stmt: str, get_values: Callable, table_name: str):
+def insert_rows(connection, data: Dict, insert_stmt: str, get_values: Callable, table_name: str, patch_version: str):
     print('Inserting rows into {} table...'.format(table_name))
     cursor = connection.cursor()
-    all_values = [get_values(key, value) for (key, value) in data.items()]
+    all_values = get_hashed_rows(data, insert_stmt, get_values, patch_version)
     try:
-        cursor.executemany(insert_stmt, all_values)
-        connection.commit()
+        with metrics.timer('db.insert_rows.' + table_name):
+            cursor.executemany(insert_stmt, all_values)
+            connection.commit()
+        metrics.increment('db.insert_rows.{}.rows'.format(table_name), len(all_values))
     except mysql.connector.Error as err:
         print('Exception encountered when executing a DB transaction (change rolled back): ', str(err))
     cursor.close()
 
 
 # Search through a sequence of dictionaries to find uses of a specified property
-# and create a table with all the possible values of that property
+# and insert the values of that property the table does not have yet
 # @param seq_of_data Sequence of dictionaries representing entity data from Riot API
 # @param property_name Property associated with entity in many to many relationship. Also the name of the table
 #   the property values will be inserted into
 # Return dictionary of property values with ids
 def property_search_and_insert(connection, seq_of_data: Sequence, property_name: str) -> Dict:
     cursor = connection.cursor()
-    property_set = set()
-    # iterate over any entities containing the specified property. ex: champions, items
-    for data in seq_of_data:
-        for value in data.values():
-            # value.get(property) expected to return list of strings
-            if value.get(property_name):
-                for property in value.get(property_name):
-                    property_set.add(property)
-
-    # Grab the auto_increment value before attempting to insert
-    cursor.execute("SELECT AUTO_INCREMENT FROM information_schema.TABLES "
-                   "WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s", (db_config['database'], property_name))
-    counter = cursor.fetchone()[0]
-    # insert tag_set into tags table
-    print('Inserting rows into {} table...'.format(property_name))
-    property_values = [(property,) for property in property_set]
     try:
-        cursor.executemany(PROPERTIES_INSERT_STMT.format(property_name), property_values)
+        property_ids = get_property_ids(cursor, property_name, get_property_names(seq_of_data, property_name))
         connection.commit()
+        return property_ids
     except mysql.connector.Error as err:
+        connection.rollback()
+        clear_property_ids_cache()
         print('Could not insert into {0} table. Skipping insert {0} step...'.format(property_name), err)
         return {}
     finally:
         cursor.close()
 
-    property_dict = {}
-    # Possible bug if this for loop executes in different order than before for the same set
-    for property in property_set:
-        property_dict[property] = counter
-        counter += 1
-    return property_dict
 
+# Every value of a property used by the entities, e.g. every tag of every champion and item
+def get_property_names(seq_of_data: Sequence, property_name: str) -> List[str]:
+    property_set = set()
+    # iterate over any entities containing the specified property. ex: champions, items
+    for data in seq_of_data:
+        for value in data.values():
+            # value.get(property) expected to return a list of strings, or a dict keyed by them for stats
+            for property in value.get(property_name) or ():
+                property_set.add(property)
+    return sorted(property_set)
 
-def associate_tags_with_entity(connection, tags: Dict, data: Dict, table: str, get_id: Callable):
+
+def associate_tags_with_entity(connection, tags: Dict, data: Dict, table: str, get_id: Callable, patch_version: str):
     if not tags:
         return
     print('Inserting {}-tag associations...'.format(table))
     cursor = connection.cursor()
-    entity_tag_values = []
-    for (key, value) in data.items():
-        if value.get('tags'):
-            for tag in value.get('tags'):
-                entity_tag_values.append((get_id(key, value), tags[tag], patch_version, True))
+    entity_tag_values = get_entity_tag_values(tags, data, get_id, patch_version)
     try:
         cursor.executemany(ENTITIES_TAGS_INSERT_STMT.format(table), entity_tag_values)
         connection.commit()
@@ -215,16 +499,13 @@ def associate_tags_with_entity(connection, tags: Dict, data: Dict, table: str, g
     cursor.close()
 
 
-def associate_stats_with_entity(connection, stats: Dict, data: Dict, table: str, get_id: Callable):
+def associate_stats_with_entity(connection, stats: Dict, data: Dict, table: str, get_id: Callable,
+                                patch_version: str):
     if not stats:
         return
     print('Inserting {}-stat associations...'.format(table))
     cursor = connection.cursor()
-    entity_stat_values = []
-    for (key, value) in data.items():
-        if value.get('stats'):  # If this is not None, this should be a Dict
-            for (stat_k, stat_v) in value.get('stats').items():
-                entity_stat_values.append((get_id(key, value), stats[stat_k], stat_v, patch_version, True))
+    entity_stat_values = get_entity_stat_values(stats, data, get_id, patch_version)
     try:
         cursor.executemany(ENTITIES_STATS_INSERT_STMT.format(table), entity_stat_values)
         connection.commit()
@@ -233,14 +514,10 @@ def associate_stats_with_entity(connection, stats: Dict, data: Dict, table: str,
     cursor.close()
 
 
-def associate_items_with_items(connection, items: Dict):
+def associate_items_with_items(connection, items: Dict, patch_version: str):
     cursor = connection.cursor()
-    item_recipe_values = []
+    item_recipe_values = get_item_item_values(items, patch_version)
     print('Inserting item-item associations...')
-    for (key, value) in items.items():
-        if value.get('into'):
-            for result in value.get('into'):
-                item_recipe_values.append((key, result, patch_version, True))
     try:
         cursor.executemany(ITEMS_ITEMS_INSERT_STMT, item_recipe_values)
         connection.commit()
@@ -248,6 +525,175 @@ def associate_items_with_items(connection, items: Dict):
         print('Exception encountered when executing a DB transaction (change rolled back): ', str(err))
     cursor.close()
 
+
+def get_entity_tag_values(tags: Dict, data: Dict, get_id: Callable, patch_version: str) -> List[Tuple]:
+    return [(get_id(key, value), tags[tag], patch_version, True)
+            for (key, value) in data.items() for tag in (value.get('tags') or [])]
+
+
+def get_entity_stat_values(stats: Dict, data: Dict, get_id: Callable, patch_version: str) -> List[Tuple]:
+    # value.get('stats') should be a Dict if it is not None
+    return [(get_id(key, value), stats[stat_k], stat_v, patch_version, True)
+            for (key, value) in data.items() for (stat_k, stat_v) in (value.get('stats') or {}).items()]
+
+
+def get_item_item_values(items: Dict, patch_version: str) -> List[Tuple]:
+    return [(key, result, patch_version, True)
+            for (key, value) in items.items() for result in (value.get('into') or [])]
+
+
+# Every row of a patch that does not depend on the DB. The tag and stat associations need the ids of the tags and
+# stats, so only their names are collected here and the writer builds those rows
+def build_static_rows(json_dicts: Dict, patch_version: str) -> Dict:
+    champions, items = json_dicts['champion_json'], json_dicts['item_json']
+    return {
+        'patch_version': patch_version,
+        'champions': get_hashed_rows(champions, CHAMPIONS_INSERT_STMT, get_champion_values, patch_version),
+        'items': get_hashed_rows(items, ITEMS_INSERT_STMT, get_item_values, patch_version),
+        'summoner_spells': get_hashed_rows(json_dicts['summoner_json'], SUMMONERS_INSERT_STMT, get_summoner_values,
+                                           patch_version),
+        'item_item_map': get_item_item_values(items, patch_version),
+        'tags': get_property_names((champions, items), 'tags'),
+        'stats': get_property_names((items,), 'stats'),
+        'champion_json': champions,
+        'item_json': items,
+    }
+
+
+# Write the differences between the stored static data and a new patch in a single transaction
+# @param static_rows Rows of the patch built by build_static_rows
+# Return True if the patch was written
+def update_static_data_in_db(connection, static_rows: Dict) -> bool:
+    patch_version = static_rows['patch_version']
+    print('Diffing patch {} against stored static data...'.format(patch_version))
+    champions, items = static_rows['champion_json'], static_rows['item_json']
+    cursor = connection.cursor()
+    try:
+        update_table(cursor, 'champions', CHAMPIONS_INSERT_STMT, static_rows['champions'], ('champion_id',),
+                     patch_version, ('row_hash',))
+        update_table(cursor, 'items', ITEMS_INSERT_STMT, static_rows['items'], ('item_id',), patch_version,
+                     ('row_hash',))
+        update_table(cursor, 'summoner_spells', SUMMONERS_INSERT_STMT, static_rows['summoner_spells'], ('ss_id',),
+                     patch_version, ('row_hash',))
+        update_table(cursor, 'item_item_map', ITEMS_ITEMS_INSERT_STMT, static_rows['item_item_map'],
+                     ('component_id', 'result_id'), patch_version)
+
+        tagsToId = get_property_ids(cursor, 'tags', static_rows['tags'])
+        update_table(cursor, 'champion_tag_map', ENTITIES_TAGS_INSERT_STMT.format('champion'),
+                     get_entity_tag_values(tagsToId, champions, get_champion_id, patch_version),
+                     ('champion_id', 'tag_id'), patch_version)
+        update_table(cursor, 'item_tag_map', ENTITIES_TAGS_INSERT_STMT.format('item'),
+                     get_entity_tag_values(tagsToId, items, get_item_id, patch_version), ('item_id', 'tag_id'),
+                     patch_version)
+        statsToId = get_property_ids(cursor, 'stats', static_rows['stats'])
+        update_table(cursor, 'item_stat_map', ENTITIES_STATS_INSERT_STMT.format('item'),
+                     get_entity_stat_values(statsToId, items, get_item_id, patch_version), ('item_id', 'stat_id'),
+                     patch_version, ('value',))
+        with metrics.timer('db.update_static.commit'):
+            connection.commit()
+        return True
+    except mysql.connector.Error as err:
+        connection.rollback()
+        # Ids of names inserted by the rolled back transaction were cached
+        clear_property_ids_cache()
+        print('Exception encountered when updating static tables (change rolled back): ', str(err))
+        return False
+    finally:
+        cursor.close()
+
+
+# Upsert the rows that are new, changed or inactive, and deactivate the active rows missing from rows
+# @param key_columns Primary key of the table
+# @param compared_columns Columns compared against the stored row. If empty, only the key has to exist
+def update_table(cursor, table: str, insert_stmt: str, rows: Sequence[Tuple], key_columns: Sequence[str],
+                 patch_version: str, compared_columns: Sequence[str] = ()):
+    columns = get_insert_columns(insert_stmt)
+    key_indexes = [columns.index(column) for column in key_columns]
+    compared_indexes = [columns.index(column) for column in compared_columns]
+    cursor.execute('SELECT {}, is_active FROM {}'.format(', '.join(tuple(key_columns) + tuple(compared_columns)),
+                                                         table))
+    stored = dict((tuple(str(value) for value in row[:len(key_columns)]), row[len(key_columns):]) for row in cursor)
+
+    changed_rows = []
+    keys = set()
+    for row in rows:
+        key = tuple(str(row[i]) for i in key_indexes)
+        keys.add(key)
+        stored_row = stored.get(key)
+        if stored_row is None or not stored_row[-1] or \
+                not all(is_same_value(stored_value, row[i]) for (stored_value, i) in zip(stored_row, compared_indexes)):
+            changed_rows.append(row)
+    # The placeholder item 0 has no is_active flag and is never deactivated
+    removed_keys = [key for (key, stored_row) in stored.items() if stored_row[-1] and key not in keys]
+
+    if changed_rows:
+        cursor.executemany(get_upsert_stmt(insert_stmt), changed_rows)
+    if removed_keys:
+        cursor.executemany(DEACTIVATE_STMT.format(table, ' AND '.join('{} = %s'.format(column)
+                                                                       for column in key_columns)),
+                           [(patch_version,) + key for key in removed_keys])
+    print('{}: {} new or changed, {} deactivated, {} unchanged'.format(
+        table, len(changed_rows), len(removed_keys), len(rows) - len(changed_rows)))
+
+
+def is_same_value(stored_value, new_value) -> bool:
+    if isinstance(stored_value, (float, Decimal)) or isinstance(new_value, float):
+        try:
+            return abs(float(stored_value) - float(new_value)) < FLOAT_TOLERANCE
+        except (TypeError, ValueError):
+            return False
+    return str(stored_value) == str(new_value)
+
+
+# Return the name -> id map of a property table, inserting the names it does not have yet. The stored map is read
+# in one query the first time a table is used, and afterwards only the ids of new names are read back after they
+# were inserted. Names another importer inserted in the meantime are ignored by the insert and read back the same way
+def get_property_ids(cursor, property_name: str, names: Sequence[str]) -> Dict:
+    with property_ids_lock:
+        property_ids = property_ids_cache.get(property_name)
+        if property_ids is None:
+            cursor.execute(PROPERTIES_SELECT_STMT.format(property_name[:-1], property_name))
+            property_ids = dict((name, property_id) for (property_id, name) in cursor)
+            property_ids_cache[property_name] = property_ids
+        new_names = sorted(set(names) - set(property_ids))
+        if new_names:
+            print('Inserting {} new rows into {} table...'.format(len(new_names), property_name))
+            cursor.executemany(PROPERTIES_INSERT_STMT.format(property_name), [(name,) for name in new_names])
+            cursor.execute(PROPERTIES_SELECT_BY_NAME_STMT.format(property_name[:-1], property_name,
+                                                                 ', '.join(['%s'] * len(new_names))), new_names)
+            property_ids.update((name, property_id) for (property_id, name) in cursor)
+        return dict(property_ids)
+
+
+def clear_property_ids_cache():
+    with property_ids_lock:
+        property_ids_cache.clear()
+
+
+def get_insert_columns(insert_stmt: str) -> List[str]:
+    return [column.strip() for column in insert_stmt[insert_stmt.index('(') + 1:insert_stmt.index(')')].split(',')]
+
+
+# Turn an INSERT IGNORE statement into one that overwrites every column of existing rows. IGNORE is kept, so values
+# that do not fit their column are clamped with a warning like the initial import does, instead of failing the patch
+# in strict SQL mode
+def get_upsert_stmt(insert_stmt: str) -> str:
+    return insert_stmt.rstrip(';') + ' ON DUPLICATE KEY UPDATE ' + \
+        ', '.join('{0} = VALUES({0})'.format(column) for column in get_insert_columns(insert_stmt))
+
+
+# Rows of every entity with the hash of their data columns appended, for statements ending in row_hash
+def get_hashed_rows(data: Dict, insert_stmt: str, get_values: Callable, patch_version: str) -> List[Tuple]:
+    columns = get_insert_columns(insert_stmt)
+    return [add_row_hash(get_values(key, value, patch_version), columns) for (key, value) in data.items()]
+
+
+# The hash covers every column but the VERSION_COLUMNS, so a row only changes hash when its data changes
+def add_row_hash(row: Tuple, columns: Sequence[str]) -> Tuple:
+    data = tuple(value for (column, value) in zip(columns, row) if column not in VERSION_COLUMNS)
+    return row + (hashlib.md5(repr(data).encode('utf8')).hexdigest(),)
+
+
 def get_champion_id(key, value):
     return value.get('key')
 
@@ -256,7 +702,7 @@ def get_item_id(key, value):
     return key
 
 
-def get_champion_values(key: str, value: Dict):
+def get_champion_values(key: str, value: Dict, patch_version: str):
     return (get_champion_id(key, value),
             patch_version,
             value.get('name'),
@@ -289,7 +735,7 @@ def get_champion_values(key: str, value: Dict):
             value.get('stats', {}).get('attackspeed'), True)
 
 
-def get_item_values(key: str, value: Dict):
+def get_item_values(key: str, value: Dict, patch_version: str):
     return (get_item_id(key, value),
             value.get('name'),
             value.get('plaintext'),
@@ -303,7 +749,7 @@ def get_item_values(key: str, value: Dict):
             True)
 
 
-def get_summoner_values(key: str, value: Dict):
+def get_summoner_values(key: str, value: Dict, patch_version: str):
     return (value.get('key'),
             value.get('name'),
             value.get('description'),
@@ -313,4 +759,9 @@ def get_summoner_values(key: str, value: Dict):
 
 
 if __name__ == '__main__':
-    initialize_static_tables()
+    if '--patches' in sys.argv:
+        import_static_patches(get_patch_versions(get_flag_args('--patches')))
+    elif '--update' in sys.argv:
+        update_static_tables()
+    else:
+        initialize_static_tables()
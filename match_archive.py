@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+from metrics import logger
+import os
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+
+# Append-only archive of raw Riot API responses, so matches never have to be requested from Riot twice.
+# Responses are stored in segment files. Every record is its own gzip member holding one JSON line, so a single record
+# can be read back from its offset, and a whole segment can also be read with gzip.open as one JSONL file.
+# index.tsv maps every (kind, region, id) key to the segment, offset and length of its record, plus the sha256 of the
+# response so corrupted records can be detected.
+
+MATCH = 'match'
+MATCHLIST = 'matchlist'
+INDEX_FILENAME = 'index.tsv'
+SEGMENT_FILENAME = 'segment-%06d.jsonl.gz'
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class MatchArchive:
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.lock = threading.Lock()
+        # (kind, region, id) -> (segment number, offset, length, sha256)
+        self.index: Dict[Tuple[str, str, str], Tuple[int, int, int, str]] = {}
+        self.segment_number = 1
+        self.load_index()
+        self.index_file = open(os.path.join(directory, INDEX_FILENAME), 'a', encoding='utf8')
+        self.segment_file = None
+
+    def load_index(self):
+        path = os.path.join(self.directory, INDEX_FILENAME)
+        if not os.path.exists(path):
+            return
+        with open(path, encoding='utf8') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                # A partially written last line is ignored. Its record gets archived again on the next fetch
+                if len(fields) != 7:
+                    continue
+                (kind, region, key_id, segment_number, offset, length, digest) = fields
+                self.index[(kind, region, key_id)] = (int(segment_number), int(offset), int(length), digest)
+                self.segment_number = max(self.segment_number, int(segment_number))
+
+    def get_segment_path(self, segment_number: int) -> str:
+        return os.path.join(self.directory, SEGMENT_FILENAME % segment_number)
+
+    def __contains__(self, key: Tuple[str, str, str]) -> bool:
+        return key in self.index
+
+    # Return the archived response or None if it was never archived
+    def get(self, kind: str, region: str, key_id) -> Optional[Dict]:
+        location = self.index.get((kind, region, str(key_id)))
+        if location is None:
+            return None
+        (segment_number, offset, length, digest) = location
+        with open(self.get_segment_path(segment_number), 'rb') as file:
+            file.seek(offset)
+            line = gzip.decompress(file.read(length))
+        if hashlib.sha256(line).hexdigest() != digest:
+            logger.warning('Archived %s %s:%s is corrupted. Ignoring...', kind, region, key_id)
+            return None
+        return json.loads(line)['data']
+
+    # Append a response to the archive. Responses that are already archived are not written again
+    # @param replace Archive the response even if the key already exists, e.g. for match lists that grow over time
+    def put(self, kind: str, region: str, key_id, data: Dict, replace: bool = False):
+        key = (kind, region, str(key_id))
+        if key in self.index and not replace:
+            return
+        line = (json.dumps({'kind': kind, 'region': region, 'id': str(key_id), 'data': data},
+                           separators=(',', ':')) + '\n').encode('utf8')
+        record = gzip.compress(line)
+        digest = hashlib.sha256(line).hexdigest()
+        with self.lock:
+            if self.segment_file is None or self.segment_file.tell() + len(record) > SEGMENT_MAX_BYTES:
+                self.open_next_segment()
+            offset = self.segment_file.tell()
+            self.segment_file.write(record)
+            self.segment_file.flush()
+            # The index line is written last, so an interrupted put never points at a partial record
+            self.index_file.write('\t'.join((kind, region, str(key_id), str(self.segment_number), str(offset),
+                                             str(len(record)), digest)) + '\n')
+            self.index_file.flush()
+            self.index[key] = (self.segment_number, offset, len(record), digest)
+
+    # Append to the last segment if it has room left. Otherwise start a new one
+    def open_next_segment(self):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.segment_number += 1
+        elif os.path.exists(self.get_segment_path(self.segment_number)) and \
+                os.path.getsize(self.get_segment_path(self.segment_number)) >= SEGMENT_MAX_BYTES:
+            self.segment_number += 1
+        self.segment_file = open(self.get_segment_path(self.segment_number), 'ab')
+
+    # Stream every archived response of a kind as (region, id, data) tuples in the order they were archived.
+    # Records are read sequentially, one segment at a time
+    def stream(self, kind: str = MATCH) -> Iterator[Tuple[str, str, Dict]]:
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.flush()
+            locations = sorted((location, key) for (key, location) in self.index.items() if key[0] == kind)
+        file = None
+        current_segment = None
+        try:
+            for ((segment_number, offset, length, digest), (record_kind, region, key_id)) in locations:
+                if segment_number != current_segment:
+                    if file is not None:
+                        file.close()
+                    file = open(self.get_segment_path(segment_number), 'rb')
+                    current_segment = segment_number
+                file.seek(offset)
+                line = gzip.decompress(file.read(length))
+                if hashlib.sha256(line).hexdigest() != digest:
+                    logger.warning('Archived %s %s:%s is corrupted. Skipping...', kind, region, key_id)
+                    continue
+                yield region, key_id, json.loads(line)['data']
+        finally:
+            if file is not None:
+                file.close()
+
+    def close(self):
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+            self.index_file.close()
@@ -0,0 +1,171 @@
+import config
+import bisect
+from contextlib import contextmanager
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from typing import Dict, List
+
+# In-memory metrics of the importers and the shared logger
+# Hot paths only add to counters and latency histograms under a lock. Everything is written out once per invocation by
+# flush(), as a single JSON line or in CloudWatch Embedded Metric Format (EMF), so no I/O happens per request or row.
+# Per-request and per-row log lines are logged at INFO with extra=SAMPLED and only a LOG_SAMPLE_RATE fraction of them is
+# written. Warnings and errors are always written.
+
+# 'json' or 'emf'
+METRICS_FORMAT = getattr(config, 'METRICS_FORMAT', 'json')
+METRICS_NAMESPACE = getattr(config, 'METRICS_NAMESPACE', 'LeagueImporter')
+LOG_LEVEL = getattr(config, 'LOG_LEVEL', 'INFO')
+LOG_SAMPLE_RATE = getattr(config, 'LOG_SAMPLE_RATE', 0.01)
+SAMPLED = {'sampled': True}
+# Upper bounds of the latency histogram buckets in milliseconds. The last bucket holds everything slower
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+PERCENTILES = (50, 90, 99)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, sample_rate: float):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.sample_rate
+
+
+def get_logger() -> logging.Logger:
+    log = logging.getLogger('league_importer')
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(levelname)s %(message)s'))
+        handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+        log.addHandler(handler)
+        log.setLevel(LOG_LEVEL)
+        # The Lambda runtime already has a handler on the root logger
+        log.propagate = False
+    return log
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    # Upper bound of the bucket holding the percentile, capped at the largest value seen
+    def get_percentile(self, percentile: float) -> float:
+        rank = self.count * percentile / 100
+        seen = 0
+        for (i, count) in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return round(min(float(LATENCY_BUCKETS_MS[i]), self.max) if i < len(LATENCY_BUCKETS_MS)
+                             else self.max, 3)
+        return 0.0
+
+    def get_summary(self) -> Dict:
+        summary = {'count': self.count, 'sum': round(self.sum, 3), 'min': round(self.min or 0.0, 3),
+                   'max': round(self.max or 0.0, 3)}
+        for percentile in PERCENTILES:
+            summary['p{}'.format(percentile)] = self.get_percentile(percentile)
+        return summary
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def increment(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    # Record a latency in milliseconds
+    def observe(self, name: str, value: float):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    # Count an error by its class, e.g. riot.get.errors.ConnectionError
+    def error(self, name: str, err: BaseException):
+        self.increment('{}.errors.{}'.format(name, type(err).__name__))
+
+    # Record the count, latency and exception class of the wrapped block as <name>.count, <name>.latency_ms and
+    # <name>.errors.<class>
+    @contextmanager
+    def timer(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        except Exception as err:
+            self.error(name, err)
+            raise
+        finally:
+            self.observe(name + '.latency_ms', (time.perf_counter() - started_at) * 1000)
+            self.increment(name + '.count')
+
+    def get_snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'counters': dict(sorted(self.counters.items())),
+                'histograms': dict((name, histogram.get_summary())
+                                   for (name, histogram) in sorted(self.histograms.items())),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    # Write all metrics gathered since the last flush as one line and start over
+    # @param dimensions Added to every metric, e.g. {'mode': 'backlog'}
+    def flush(self, dimensions: Dict[str, str] = None, metrics_format: str = METRICS_FORMAT):
+        snapshot = self.get_snapshot()
+        self.reset()
+        dimensions = dict(dimensions or {})
+        if metrics_format == 'emf':
+            print(json.dumps(get_emf_record(snapshot, dimensions), separators=(',', ':')))
+        else:
+            print(json.dumps(dict(dimensions, metrics=snapshot), separators=(',', ':')))
+
+
+# Counters become Count metrics, and every histogram becomes one Milliseconds metric per percentile plus its max
+def get_emf_record(snapshot: Dict, dimensions: Dict[str, str]) -> Dict:
+    record = dict(dimensions)
+    definitions: List[Dict] = []
+    for (name, value) in snapshot['counters'].items():
+        record[name] = value
+        definitions.append({'Name': name, 'Unit': 'Count'})
+    for (name, summary) in snapshot['histograms'].items():
+        for statistic in ['p{}'.format(percentile) for percentile in PERCENTILES] + ['max']:
+            record['{}.{}'.format(name, statistic)] = summary[statistic]
+            definitions.append({'Name': '{}.{}'.format(name, statistic), 'Unit': 'Milliseconds'})
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': METRICS_NAMESPACE,
+            'Dimensions': [sorted(dimensions)],
+            # EMF allows at most 100 metrics per directive
+            'Metrics': definitions[i:i + 100],
+        } for i in range(0, max(len(definitions), 1), 100)],
+    }
+    return record
+
+
+metrics = Metrics()
+logger = get_logger()
@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from metrics import logger
+from typing import Callable, Dict, List
+
+# Staged pipeline of worker threads connected by bounded queues
+# Every stage runs its function on its own pool of threads and hands the results to the next stage. A full queue
+# blocks the stage in front of it, so a slow DB writer holds back the fetchers instead of piling matches up in memory.
+# Each stage counts what went through it, so the stats show which stage is the bottleneck: a bottleneck stage has a
+# deep input queue and is busy most of the time, while the stages after it sit idle.
+
+DEFAULT_QUEUE_DEPTH = 50
+# Longest a batched stage waits for its batch to fill up before processing what it has
+BATCH_TIMEOUT = 1.0
+STOP = object()
+
+
+class Stage:
+    # @param function Called with one item, or with a list of up to batch_size items if batch_size is set. Its result
+    #   is passed on to the next stage, unless it is None. Results of a batched stage are passed on one by one
+    def __init__(self, name: str, function: Callable, workers: int = 1, queue_depth: int = DEFAULT_QUEUE_DEPTH,
+                 batch_size: int = None):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+        self.items_in = 0
+        self.items_out = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    def put(self, item):
+        self.queue.put(item)
+        with self.lock:
+            self.items_in += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    # Return the next batch of items, and whether the stage was told to stop
+    def get_items(self):
+        item = self.queue.get()
+        if item is STOP:
+            return [], True
+        if not self.batch_size:
+            return [item], False
+        items = [item]
+        deadline = time.monotonic() + BATCH_TIMEOUT
+        while len(items) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is STOP:
+                return items, True
+            items.append(item)
+        return items, False
+
+    def get_stats(self, elapsed: float) -> Dict:
+        with self.lock:
+            return {
+                'stage': self.name,
+                'workers': self.workers,
+                'items_in': self.items_in,
+                'items_out': self.items_out,
+                'errors': self.errors,
+                'items_per_second': round(self.items_in / elapsed, 2) if elapsed else 0.0,
+                'busy_fraction': round(self.busy_seconds / (elapsed * self.workers), 3) if elapsed else 0.0,
+                'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_queue_depth,
+            }
+
+
+class Pipeline:
+    def __init__(self, queue_depth: int = DEFAULT_QUEUE_DEPTH):
+        self.queue_depth = queue_depth
+        self.stages: List[Stage] = []
+        self.started_at = None
+        self.stopped_at = None
+
+    def add_stage(self, name: str, function: Callable, workers: int = 1, batch_size: int = None) -> 'Pipeline':
+        self.stages.append(Stage(name, function, workers, self.queue_depth, batch_size))
+        return self
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for (i, stage) in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            for worker in range(stage.workers):
+                thread = threading.Thread(target=self.run_worker, args=(stage, next_stage),
+                                          name='{}-{}'.format(stage.name, worker), daemon=True)
+                stage.threads.append(thread)
+                thread.start()
+
+    # Feed an item to the first stage. Blocks while the first stage's queue is full
+    def put(self, item):
+        self.stages[0].put(item)
+
+    # Let every stage finish the items it was given, in stage order, then stop its workers
+    def close(self):
+        for stage in self.stages:
+            for thread in stage.threads:
+                stage.queue.put(STOP)
+            for thread in stage.threads:
+                thread.join()
+        self.stopped_at = time.monotonic()
+
+    def run_worker(self, stage: Stage, next_stage: Stage):
+        while True:
+            (items, stopped) = stage.get_items()
+            if items:
+                started_at = time.monotonic()
+                results = []
+                try:
+                    if stage.batch_size:
+                        results = [result for result in (stage.function(items) or ()) if result is not None]
+                    else:
+                        result = stage.function(items[0])
+                        results = [result] if result is not None else []
+                except Exception as err:
+                    with stage.lock:
+                        stage.errors += len(items)
+                    logger.warning('Exception encountered in %s stage of pipeline: %s', stage.name, str(err),
+                                   exc_info=True)
+                with stage.lock:
+                    stage.busy_seconds += time.monotonic() - started_at
+                    stage.items_out += len(results)
+                if next_stage is not None:
+                    for result in results:
+                        next_stage.put(result)
+            if stopped:
+                return
+
+    def get_stats(self) -> List[Dict]:
+        if self.started_at is None:
+            return []
+        elapsed = (self.stopped_at or time.monotonic()) - self.started_at
+        return [stage.get_stats(elapsed) for stage in self.stages]
+
+    def log_stats(self):
+        for stats in self.get_stats():
+            logger.info('Pipeline stage {stage}: {items_in} in, {items_out} out, {errors} errors, '
+                        '{items_per_second}/s, {busy_fraction:.0%} busy, queue depth {queue_depth} '
+                        '(max {max_queue_depth})'.format(**stats))
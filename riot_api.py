@@ -0,0 +1,180 @@
+from config import RIOT_GAMES_API_KEY
+from concurrent.futures import ThreadPoolExecutor
+from metrics import logger, metrics, SAMPLED
+import requests
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+# Concurrent Riot Games API client
+# Every region has its own application rate limit, and every (region, method) pair has its own method rate limit.
+# Limits are read from the X-App-Rate-Limit and X-Method-Rate-Limit response headers, e.g. "20:1,100:120"
+# meaning 20 requests every 1 second and 100 requests every 120 seconds.
+
+# Development API key limits. Used until the first response tells us the real limits
+DEFAULT_APP_RATE_LIMIT = '20:1,100:120'
+DEFAULT_METHOD_RATE_LIMIT = '20:1,100:120'
+DEFAULT_RETRY_AFTER = 1
+MAX_RETRIES = 3
+MAX_WORKERS = 10
+CONNECT_TIMEOUT = 2
+READ_TIMEOUT = 5
+
+
+# Parse a rate limit header into a sequence of (count, seconds) windows
+def parse_rate_limit(header: str) -> Tuple[Tuple[int, int], ...]:
+    windows = []
+    for window in header.split(','):
+        count, seconds = window.split(':')
+        windows.append((int(count), int(seconds)))
+    return tuple(windows)
+
+
+class TokenBucket:
+    # One bucket per window. Each bucket holds up to count tokens and refills at count / seconds tokens per second
+    def __init__(self, limit_header: str):
+        self.lock = threading.Lock()
+        self.limit_header = None
+        self.windows = ()
+        self.tokens = []
+        self.blocked_until = 0.0
+        self.last_refill = time.monotonic()
+        self.update_limits(limit_header)
+
+    # @param count_header Matching X-*-Rate-Limit-Count header with the usage Riot has counted so far
+    def update_limits(self, limit_header: str, count_header: str = None):
+        try:
+            windows = parse_rate_limit(limit_header) if limit_header else None
+            counts = dict((seconds, count) for (count, seconds) in parse_rate_limit(count_header)) \
+                if count_header else {}
+        except ValueError:
+            logger.warning('Could not parse rate limit headers: %s %s', limit_header, count_header)
+            return
+        with self.lock:
+            if windows and limit_header != self.limit_header:
+                self.limit_header = limit_header
+                self.windows = windows
+                self.tokens = [float(count) for (count, seconds) in windows]
+                self.last_refill = time.monotonic()
+            # Never hold more tokens than Riot thinks we have left in a window
+            for (i, (count, seconds)) in enumerate(self.windows):
+                if seconds in counts:
+                    self.tokens[i] = min(self.tokens[i], float(count - counts[seconds]))
+
+    # Stop handing out tokens until the given number of seconds has passed. Used for 429 Retry-After
+    def block(self, seconds: float):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    # Return how long the caller needs to wait before a token is available. Consume the token if no wait is needed
+    def try_acquire(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            elapsed = now - self.last_refill
+            self.last_refill = now
+            wait = 0.0
+            for (i, (count, seconds)) in enumerate(self.windows):
+                self.tokens[i] = min(float(count), self.tokens[i] + elapsed * count / seconds)
+                if self.tokens[i] < 1:
+                    wait = max(wait, (1 - self.tokens[i]) * seconds / count)
+            if wait == 0.0:
+                for i in range(len(self.tokens)):
+                    self.tokens[i] -= 1
+            return wait
+
+    # Give back a token taken by try_acquire that ended up not being used
+    def release(self):
+        with self.lock:
+            for (i, (count, seconds)) in enumerate(self.windows):
+                self.tokens[i] = min(float(count), self.tokens[i] + 1)
+
+
+class RiotApiClient:
+    def __init__(self, api_key: str = RIOT_GAMES_API_KEY, max_workers: int = MAX_WORKERS):
+        self.session = requests.Session()
+        self.session.headers['X-Riot-Token'] = api_key
+        # Keep one pooled keep-alive connection per worker for each regional host
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.app_buckets: Dict[str, TokenBucket] = {}
+        self.method_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def get_buckets(self, region: str, method: str) -> Tuple[TokenBucket, TokenBucket]:
+        with self.lock:
+            if region not in self.app_buckets:
+                self.app_buckets[region] = TokenBucket(DEFAULT_APP_RATE_LIMIT)
+            if (region, method) not in self.method_buckets:
+                self.method_buckets[(region, method)] = TokenBucket(DEFAULT_METHOD_RATE_LIMIT)
+            return self.app_buckets[region], self.method_buckets[(region, method)]
+
+    # Block until both the app and the method rate limit allow another request
+    def wait_for_token(self, app_bucket: TokenBucket, method_bucket: TokenBucket):
+        while True:
+            wait = method_bucket.try_acquire()
+            if wait == 0.0:
+                wait = app_bucket.try_acquire()
+                if wait == 0.0:
+                    return
+                method_bucket.release()
+            metrics.increment('riot.rate_limit_wait_ms', wait * 1000)
+            time.sleep(wait)
+
+    # Send get request to url and return json. Return None if unsuccessful
+    def get(self, url: str) -> Optional[Dict]:
+        region, method = get_region_and_method(url)
+        app_bucket, method_bucket = self.get_buckets(region, method)
+        for attempt in range(MAX_RETRIES + 1):
+            self.wait_for_token(app_bucket, method_bucket)
+            try:
+                logger.info('Reading response and parsing json file from %s', url, extra=SAMPLED)
+                with metrics.timer('riot.get'):
+                    response = self.session.get(url, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+                metrics.increment('riot.get.bytes', len(response.content))
+                metrics.increment('riot.get.status.{}'.format(response.status_code))
+                app_bucket.update_limits(response.headers.get('X-App-Rate-Limit'),
+                                         response.headers.get('X-App-Rate-Limit-Count'))
+                method_bucket.update_limits(response.headers.get('X-Method-Rate-Limit'),
+                                            response.headers.get('X-Method-Rate-Limit-Count'))
+                if response.status_code == 429:
+                    retry_after = float(response.headers.get('Retry-After', DEFAULT_RETRY_AFTER))
+                    limit_type = response.headers.get('X-Rate-Limit-Type')
+                    logger.warning('Rate limited (%s) on %s. Retrying after %s seconds...', limit_type, url,
+                                   retry_after)
+                    metrics.increment('riot.rate_limited.{}'.format(limit_type))
+                    # Service rate limits are not tied to our key, so only this request backs off
+                    if limit_type == 'application':
+                        app_bucket.block(retry_after)
+                    elif limit_type == 'method':
+                        method_bucket.block(retry_after)
+                    else:
+                        time.sleep(retry_after)
+                    continue
+                if response.status_code != 200:
+                    status = response.json().get('status', {}) if response.content else {}
+                    logger.warning('Unsuccessful response status code %s: %s', response.status_code,
+                                   status.get('message'))
+                    return None
+                return response.json()
+            except Exception as err:
+                metrics.error('riot.response', err)
+                logger.warning('Exception encountered in response from Riot Games API or when serializing into '
+                               'JSON: %s', str(err), exc_info=True)
+                return None
+        metrics.increment('riot.retries_exhausted')
+        logger.warning('Giving up on %s after %s retries', url, MAX_RETRIES)
+        return None
+
+    # Send get requests to all urls concurrently. Results are returned in the same order as urls
+    def get_many(self, urls: Sequence[str]) -> List[Optional[Dict]]:
+        return list(self.executor.map(self.get, urls))
+
+
+# The region is the subdomain of the Riot API host. The method is the path without its trailing id
+def get_region_and_method(url: str) -> Tuple[str, str]:
+    parts = urlsplit(url)
+    return parts.netloc.split('.')[0], parts.path.rsplit('/', 1)[0]
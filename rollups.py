@@ -0,0 +1,168 @@
+from crawl_frontier import get_patch
+from metrics import logger
+import mysql.connector
+from typing import Dict, List, Sequence, Tuple
+
+# Rollup tables of match_participants for dashboards, keyed by champion, patch and tier
+# champion_stats_rollup: games, wins and summed stats of every champion
+# champion_item_rollup: how often each item was in each inventory slot of a champion, and how often it won
+# champion_spell_rollup: games and wins of every summoner spell pair of a champion, with spell1_id <= spell2_id
+# All counters are additive, so the importer adds the matches of every batch it inserts with
+# INSERT ... ON DUPLICATE KEY UPDATE in the same transaction, and only for matches that were not in the DB yet, so
+# messages delivered again are not counted twice. The existing matches are read with a locking read, so a consumer
+# inserting the same match at the same time waits for the other transaction, or deadlocks and retries, instead of
+# also seeing it as new. Bulk loads do not maintain the rollups. Run rebuild() after them.
+
+UNKNOWN_PATCH = 'unknown'
+# highest_achieved_season_tier of participants without one
+UNKNOWN_TIER = 'UNRANKED'
+ITEM_COLUMNS = ('item0_id', 'item1_id', 'item2_id', 'item3_id', 'item4_id', 'item5_id', 'item6_id')
+# Summed match_participants columns of champion_stats_rollup, as (rollup column, match_participants column)
+SUMMED_COLUMNS = (
+    ('kills', 'kills'),
+    ('deaths', 'deaths'),
+    ('assists', 'assists'),
+    ('gold_earned', 'goldEarned'),
+    ('minions_killed', 'totalMinionsKilled'),
+    ('damage_to_champions', 'totalDamageDealtToChampions'),
+    ('vision_score', 'visionScore'),
+)
+ROLLUP_KEY_COLUMNS = ('champion_id', 'patch', 'tier')
+ROLLUP_COLUMNS = {
+    'champion_stats_rollup': ROLLUP_KEY_COLUMNS + ('games', 'wins', 'game_duration') + tuple(
+        column for (column, source) in SUMMED_COLUMNS),
+    'champion_item_rollup': ROLLUP_KEY_COLUMNS + ('item_slot', 'item_id', 'games', 'wins'),
+    'champion_spell_rollup': ROLLUP_KEY_COLUMNS + ('spell1_id', 'spell2_id', 'games', 'wins'),
+}
+# Number of leading columns of each rollup that make up its primary key. The rest are counters
+ROLLUP_KEY_LENGTHS = {
+    'champion_stats_rollup': 3,
+    'champion_item_rollup': 5,
+    'champion_spell_rollup': 5,
+}
+EXISTING_MATCHES_SELECT_STMT = 'SELECT match_id, region FROM matches WHERE match_id IN ({0}) FOR UPDATE'
+ROLLUP_DELETE_STMT = 'DELETE FROM {0}'
+# patch and tier of a participant, in SQL. Missing and empty values are mapped like get_rollup_rows maps them, since
+# the patch and tier columns are NOT NULL
+PATCH_SQL = "COALESCE(NULLIF(SUBSTRING_INDEX(m.game_version, '.', 2), ''), '{}')".format(UNKNOWN_PATCH)
+TIER_SQL = "COALESCE(NULLIF(p.highest_achieved_season_tier, ''), '{}')".format(UNKNOWN_TIER)
+ROLLUP_REBUILD_STMTS = {
+    'champion_stats_rollup': (
+        'SELECT p.champion_id, {0}, {1}, COUNT(*), COALESCE(SUM(p.win), 0), COALESCE(SUM(m.game_duration), 0), '
+        + ', '.join('COALESCE(SUM(p.{}), 0)'.format(source) for (column, source) in SUMMED_COLUMNS) + ' '
+        'FROM match_participants AS p JOIN matches AS m ON m.match_id = p.match_id {2} '
+        'GROUP BY p.champion_id, {0}, {1}'
+    ),
+    'champion_item_rollup': (
+        'SELECT champion_id, patch, tier, item_slot, item_id, COUNT(*), COALESCE(SUM(win), 0) FROM ('
+        + ' UNION ALL '.join(
+            'SELECT p.champion_id, {{0}} AS patch, {{1}} AS tier, {0} AS item_slot, p.{1} AS item_id, p.win '
+            'FROM match_participants AS p JOIN matches AS m ON m.match_id = p.match_id {{2}}'.format(slot, column)
+            for (slot, column) in enumerate(ITEM_COLUMNS)) +
+        ') AS slots WHERE item_id IS NOT NULL AND item_id <> 0 '
+        'GROUP BY champion_id, patch, tier, item_slot, item_id'
+    ),
+    'champion_spell_rollup': (
+        'SELECT p.champion_id, {0}, {1}, LEAST(p.spell1_id, p.spell2_id), GREATEST(p.spell1_id, p.spell2_id), '
+        'COUNT(*), COALESCE(SUM(p.win), 0) '
+        'FROM match_participants AS p JOIN matches AS m ON m.match_id = p.match_id {2} '
+        'GROUP BY p.champion_id, {0}, {1}, LEAST(p.spell1_id, p.spell2_id), GREATEST(p.spell1_id, p.spell2_id)'
+    ),
+}
+
+
+def get_rollup_upsert_stmt(table: str) -> str:
+    columns = ROLLUP_COLUMNS[table]
+    return 'INSERT INTO {} ({}) VALUES ({}) ON DUPLICATE KEY UPDATE {}'.format(
+        table, ', '.join(columns), ', '.join(['%s'] * len(columns)),
+        ', '.join('{0} = {0} + VALUES({0})'.format(column) for column in columns[ROLLUP_KEY_LENGTHS[table]:]))
+
+
+class Rollups:
+    # @param participant_columns Columns of the match_participants rows passed to add_matches
+    def __init__(self, participant_columns: Sequence[str]):
+        index = {column: i for (i, column) in enumerate(participant_columns)}
+        self.champion_index = index['champion_id']
+        self.tier_index = index['highest_achieved_season_tier']
+        self.win_index = index['win']
+        self.spell_indexes = (index['spell1_id'], index['spell2_id'])
+        self.item_indexes = tuple(index[column] for column in ITEM_COLUMNS)
+        self.summed_indexes = tuple(index[source] for (column, source) in SUMMED_COLUMNS)
+        self.upsert_stmts = {table: get_rollup_upsert_stmt(table) for table in ROLLUP_COLUMNS}
+
+    # Return the match_id -> stored region of the matches that are already in the DB. Called before the matches are
+    # inserted, in the same transaction. The rows and the gaps of the missing ids stay locked until it ends. Ids are
+    # locked in order
+    def get_existing_match_regions(self, cursor, match_ids: Sequence) -> Dict:
+        if not match_ids:
+            return {}
+        match_ids = sorted(set(match_ids))
+        cursor.execute(EXISTING_MATCHES_SELECT_STMT.format(', '.join(['%s'] * len(match_ids))), match_ids)
+        return dict((match_id, region) for (match_id, region) in cursor)
+
+    # Add matches to the rollups. The caller commits
+    # @param match_rows (matches row, match_participants rows) of every match that is new to the DB
+    def add_matches(self, cursor, match_rows: Sequence[Tuple[Tuple, Sequence[Tuple]]]):
+        rollup_rows = self.get_rollup_rows(match_rows)
+        for (table, rows) in rollup_rows.items():
+            if rows:
+                cursor.executemany(self.upsert_stmts[table], rows)
+
+    # Sum up the counters of a batch of matches per rollup key, so every key is upserted once per batch
+    def get_rollup_rows(self, match_rows: Sequence[Tuple[Tuple, Sequence[Tuple]]]) -> Dict[str, List[Tuple]]:
+        counters: Dict[str, Dict[Tuple, List]] = {table: {} for table in ROLLUP_COLUMNS}
+        for (match_values, participant_values) in match_rows:
+            # matches rows start with (match_id, region, game_creation, game_duration, season_id, game_version)
+            patch = get_patch(match_values[5]) or UNKNOWN_PATCH
+            game_duration = match_values[3] or 0
+            for row in participant_values:
+                key = (row[self.champion_index], patch, row[self.tier_index] or UNKNOWN_TIER)
+                win = 1 if row[self.win_index] else 0
+                add_counters(counters['champion_stats_rollup'], key,
+                             (1, win, game_duration) + tuple(row[i] or 0 for i in self.summed_indexes))
+                for (slot, i) in enumerate(self.item_indexes):
+                    if row[i]:
+                        add_counters(counters['champion_item_rollup'], key + (slot, row[i]), (1, win))
+                spells = sorted(row[i] for i in self.spell_indexes)
+                add_counters(counters['champion_spell_rollup'], key + tuple(spells), (1, win))
+        return {table: [key + tuple(values) for (key, values) in table_counters.items()]
+                for (table, table_counters) in counters.items()}
+
+    # Recompute the rollups from match_participants, e.g. after a bulk load or to backfill them, in one transaction
+    # @param patches Only rebuild these patches, e.g. ['10.4']. Every patch if None
+    def rebuild(self, connection, patches: Sequence[str] = None) -> bool:
+        cursor = connection.cursor()
+        try:
+            for (table, select_stmt) in ROLLUP_REBUILD_STMTS.items():
+                logger.info('Rebuilding %s table...', table)
+                delete_stmt = ROLLUP_DELETE_STMT.format(table)
+                where = ''
+                params = []
+                if patches:
+                    placeholders = ', '.join(['%s'] * len(patches))
+                    delete_stmt += ' WHERE patch IN ({})'.format(placeholders)
+                    where = 'WHERE {} IN ({})'.format(PATCH_SQL, placeholders)
+                    params = list(patches)
+                cursor.execute(delete_stmt, params)
+                # The item rollup repeats the patch filter in every slot of its union
+                num_filters = len(ITEM_COLUMNS) if table == 'champion_item_rollup' else 1
+                cursor.execute('INSERT INTO {} ({}) '.format(table, ', '.join(ROLLUP_COLUMNS[table])) +
+                               select_stmt.format(PATCH_SQL, TIER_SQL, where), params * num_filters)
+            connection.commit()
+            return True
+        except mysql.connector.Error as err:
+            connection.rollback()
+            logger.warning('Exception encountered when rebuilding rollup tables (change rolled back): %s', str(err),
+                           exc_info=True)
+            return False
+        finally:
+            cursor.close()
+
+
+def add_counters(table_counters: Dict[Tuple, List], key: Tuple, values: Tuple):
+    counters = table_counters.get(key)
+    if counters is None:
+        table_counters[key] = list(values)
+    else:
+        for (i, value) in enumerate(values):
+            counters[i] += value
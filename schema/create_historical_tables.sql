@@ -3,6 +3,9 @@ CREATE TABLE IF NOT EXISTS accounts (
     summoner_name VARCHAR(64),
     summoner_id VARCHAR(64),
     region VARCHAR(5),
+    last_match_timestamp BIGINT,
+    matchlist_end_index INT,
+    matchlist_crawled_at BIGINT,
     primary key(account_id)
 );
 
@@ -38,8 +41,9 @@ CREATE TABLE IF NOT EXISTS match_teams (
 		REFERENCES matches(match_id)
 );
 
+# match_timeline_id is assigned by the importer: match_id * 1000 + participant_id * 10 + stat kind index
 CREATE TABLE IF NOT EXISTS match_timelines_stats (
-	match_timeline_id INT AUTO_INCREMENT,
+	match_timeline_id BIGINT NOT NULL,
     interval_0_10 FLOAT(7, 3),
     interval_10_20 FLOAT(7, 3),
     interval_20_30 FLOAT(7, 3),
@@ -112,13 +116,13 @@ CREATE TABLE IF NOT EXISTS match_participants (
 	firstTowerAssist BOOLEAN,
 	firstInhibitorKill BOOLEAN,
 	firstInhibitorAssist BOOLEAN,
-    creepsPerMinDelta_id INT,
-    xpPerMinDelta_id INT,
-    goldPerMinDelta_id INT, 
-    csDiffPerMinDelta_id INT, 
-    xpDiffPerMinDelta_id INT, 
-    damageTakenPerMinDelta_id INT, 
-    damageTakenDiffPerMinDelta_id INT,
+    creepsPerMinDelta_id BIGINT,
+    xpPerMinDelta_id BIGINT,
+    goldPerMinDelta_id BIGINT, 
+    csDiffPerMinDelta_id BIGINT, 
+    xpDiffPerMinDelta_id BIGINT, 
+    damageTakenPerMinDelta_id BIGINT, 
+    damageTakenDiffPerMinDelta_id BIGINT,
 	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     PRIMARY KEY (match_id, match_participant_id),
 	FOREIGN KEY	(match_id) 
@@ -160,3 +164,83 @@ CREATE TABLE IF NOT EXISTS match_participants (
 );
 CREATE INDEX acct_index ON match_participants(account_id);
 
+# One row per participant holding its whole timeline: every per-minute delta as <stat kind>_<interval>. Replaces the
+# seven joins into match_timelines_stats with a single primary key lookup
+CREATE TABLE IF NOT EXISTS match_participant_timelines (
+    match_id BIGINT NOT NULL,
+    match_participant_id TINYINT NOT NULL,
+    creepsPerMin_0_10 FLOAT(7, 3),
+    creepsPerMin_10_20 FLOAT(7, 3),
+    creepsPerMin_20_30 FLOAT(7, 3),
+    creepsPerMin_30_end FLOAT(7, 3),
+    xpPerMin_0_10 FLOAT(7, 3),
+    xpPerMin_10_20 FLOAT(7, 3),
+    xpPerMin_20_30 FLOAT(7, 3),
+    xpPerMin_30_end FLOAT(7, 3),
+    goldPerMin_0_10 FLOAT(7, 3),
+    goldPerMin_10_20 FLOAT(7, 3),
+    goldPerMin_20_30 FLOAT(7, 3),
+    goldPerMin_30_end FLOAT(7, 3),
+    csDiffPerMin_0_10 FLOAT(7, 3),
+    csDiffPerMin_10_20 FLOAT(7, 3),
+    csDiffPerMin_20_30 FLOAT(7, 3),
+    csDiffPerMin_30_end FLOAT(7, 3),
+    xpDiffPerMin_0_10 FLOAT(7, 3),
+    xpDiffPerMin_10_20 FLOAT(7, 3),
+    xpDiffPerMin_20_30 FLOAT(7, 3),
+    xpDiffPerMin_30_end FLOAT(7, 3),
+    damageTakenPerMin_0_10 FLOAT(7, 3),
+    damageTakenPerMin_10_20 FLOAT(7, 3),
+    damageTakenPerMin_20_30 FLOAT(7, 3),
+    damageTakenPerMin_30_end FLOAT(7, 3),
+    damageTakenDiffPerMin_0_10 FLOAT(7, 3),
+    damageTakenDiffPerMin_10_20 FLOAT(7, 3),
+    damageTakenDiffPerMin_20_30 FLOAT(7, 3),
+    damageTakenDiffPerMin_30_end FLOAT(7, 3),
+    PRIMARY KEY (match_id, match_participant_id),
+    FOREIGN KEY (match_id, match_participant_id)
+        REFERENCES match_participants(match_id, match_participant_id)
+);
+
+# Rollups of match_participants by champion, patch (major.minor) and highest_achieved_season_tier ('UNRANKED' if none),
+# maintained by the importer as it inserts matches. Every column after the primary key is an additive counter
+CREATE TABLE IF NOT EXISTS champion_stats_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    game_duration BIGINT NOT NULL,
+    kills BIGINT NOT NULL,
+    deaths BIGINT NOT NULL,
+    assists BIGINT NOT NULL,
+    gold_earned BIGINT NOT NULL,
+    minions_killed BIGINT NOT NULL,
+    damage_to_champions BIGINT NOT NULL,
+    vision_score BIGINT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier)
+);
+
+# Games and wins of every item in every inventory slot (0-5, 6 is the trinket) of a champion
+CREATE TABLE IF NOT EXISTS champion_item_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    item_slot TINYINT NOT NULL,
+    item_id INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier, item_slot, item_id)
+);
+
+# Games and wins of every summoner spell pair of a champion. The pair is ordered, spell1_id <= spell2_id
+CREATE TABLE IF NOT EXISTS champion_spell_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    spell1_id INT NOT NULL,
+    spell2_id INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier, spell1_id, spell2_id)
+);
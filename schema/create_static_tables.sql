@@ -3,7 +3,7 @@ CREATE TABLE IF NOT EXISTS champions (
     patch_ver VARCHAR(10),
     name VARCHAR(20),
     title VARCHAR(50),
-    blurb VARCHAR(255),
+    blurb TEXT,
     info_attack TINYINT,
     info_defense TINYINT,
     info_magic TINYINT,
@@ -13,12 +13,12 @@ CREATE TABLE IF NOT EXISTS champions (
     stat_hpperlevel FLOAT(5,3), 
     stat_mp FLOAT(6,3),
     stat_mpperlevel FLOAT(5,3),
-    stat_movespeed TINYINT,
+    stat_movespeed SMALLINT,
     stat_armor FLOAT(4,2),
     stat_armorperlevel FLOAT(4,2),
     stat_spellblock FLOAT(5,3),
     stat_spellblockperlevel FLOAT(5,3),
-    stat_attackrange TINYINT,
+    stat_attackrange SMALLINT,
     stat_hpregen FLOAT(5,3),
     stat_hpregenperlevel FLOAT(5,3),
     stat_mpregen FLOAT(5,3),
@@ -32,6 +32,7 @@ CREATE TABLE IF NOT EXISTS champions (
 	created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
 	last_updated TIMESTAMP NOT NULL ON UPDATE CURRENT_TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     is_active BOOLEAN,
+    row_hash CHAR(32),
     PRIMARY KEY (champion_id)
 );
 
@@ -48,6 +49,7 @@ CREATE TABLE IF NOT EXISTS items (
 	last_updated TIMESTAMP NOT NULL ON UPDATE CURRENT_TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     patch_ver VARCHAR(10),
     is_active BOOLEAN,
+    row_hash CHAR(32),
     PRIMARY KEY (item_id)
 );
 INSERT IGNORE INTO items (item_id, name) VALUES (0, 'None');
@@ -68,7 +70,7 @@ CREATE TABLE IF NOT EXISTS item_item_map (
 
 CREATE TABLE IF NOT EXISTS stats (
     stat_id INT AUTO_INCREMENT,
-    name VARCHAR(125),
+    name VARCHAR(125) UNIQUE,
     PRIMARY KEY (stat_id)
 );
 
@@ -125,8 +127,9 @@ CREATE TABLE IF NOT EXISTS summoner_spells (
     ss_id INT UNIQUE NOT NULL,
     name VARCHAR(20),
     description VARCHAR(255),
-    cooldown TINYINT,
+    cooldown SMALLINT,
 	patch_ver VARCHAR(10),
     is_active BOOLEAN,
+    row_hash CHAR(32),
     PRIMARY KEY (ss_id)
 );
\ No newline at end of file
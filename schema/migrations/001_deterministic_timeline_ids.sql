@@ -0,0 +1,18 @@
+# Timeline ids are no longer AUTO_INCREMENT. The importer derives them from
+# match_id * 1000 + participant_id * 10 + stat kind index, which requires BIGINT.
+# Existing rows keep their ids. Derived ids are always larger than the old AUTO_INCREMENT values.
+SET FOREIGN_KEY_CHECKS = 0;
+
+ALTER TABLE match_timelines_stats
+    MODIFY match_timeline_id BIGINT NOT NULL;
+
+ALTER TABLE match_participants
+    MODIFY creepsPerMinDelta_id BIGINT,
+    MODIFY xpPerMinDelta_id BIGINT,
+    MODIFY goldPerMinDelta_id BIGINT,
+    MODIFY csDiffPerMinDelta_id BIGINT,
+    MODIFY xpDiffPerMinDelta_id BIGINT,
+    MODIFY damageTakenPerMinDelta_id BIGINT,
+    MODIFY damageTakenDiffPerMinDelta_id BIGINT;
+
+SET FOREIGN_KEY_CHECKS = 1;
@@ -0,0 +1,8 @@
+# Per-account match list crawl cursors. All times are epoch milliseconds.
+# last_match_timestamp: creation time of the newest game already crawled. NULL if the account was never crawled.
+# matchlist_end_index: how far the older history was paged. NULL once the whole history was paged.
+# Accounts added before this migration have no cursor and get crawled again the next time they are seen.
+ALTER TABLE accounts
+    ADD COLUMN last_match_timestamp BIGINT,
+    ADD COLUMN matchlist_end_index INT,
+    ADD COLUMN matchlist_crawled_at BIGINT;
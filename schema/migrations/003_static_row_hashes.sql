@@ -0,0 +1,20 @@
+# Hash of the data columns of every champion, item and summoner spell row. `import_static_data.py --update` compares it
+# against the new patch to write only rows that changed. Rows without a hash are rewritten on the next update.
+ALTER TABLE champions
+    ADD COLUMN row_hash CHAR(32);
+
+ALTER TABLE items
+    ADD COLUMN row_hash CHAR(32);
+
+ALTER TABLE summoner_spells
+    ADD COLUMN row_hash CHAR(32);
+
+# Columns too narrow for some champions and spells, e.g. a movespeed of 345, an attack range of 650, the 300 second
+# cooldown of Flash or a blurb longer than 255 characters. Their clamped values are rewritten with the rows above.
+ALTER TABLE champions
+    MODIFY COLUMN blurb TEXT,
+    MODIFY COLUMN stat_movespeed SMALLINT,
+    MODIFY COLUMN stat_attackrange SMALLINT;
+
+ALTER TABLE summoner_spells
+    MODIFY COLUMN cooldown SMALLINT;
@@ -0,0 +1,26 @@
+# Earlier static imports inserted every stat again on each run and guessed their ids from AUTO_INCREMENT. Point
+# item_stat_map at the first row of every stat name, drop the duplicate stats and make the name unique, so the importer
+# can look stats up by name like tags.
+CREATE TEMPORARY TABLE first_stats AS
+    SELECT name, MIN(stat_id) AS stat_id FROM stats GROUP BY name;
+
+UPDATE IGNORE item_stat_map
+    JOIN stats ON stats.stat_id = item_stat_map.stat_id
+    JOIN first_stats ON first_stats.name = stats.name
+SET item_stat_map.stat_id = first_stats.stat_id
+WHERE item_stat_map.stat_id <> first_stats.stat_id;
+
+# Associations left behind because the item already had one with the first row
+DELETE item_stat_map FROM item_stat_map
+    JOIN stats ON stats.stat_id = item_stat_map.stat_id
+    JOIN first_stats ON first_stats.name = stats.name
+WHERE item_stat_map.stat_id <> first_stats.stat_id;
+
+DELETE stats FROM stats
+    JOIN first_stats ON first_stats.name = stats.name
+WHERE stats.stat_id <> first_stats.stat_id;
+
+DROP TEMPORARY TABLE first_stats;
+
+ALTER TABLE stats
+    ADD UNIQUE (name);
@@ -0,0 +1,55 @@
+# Wide per-participant timelines, see create_historical_tables.sql. Existing timelines are copied over from
+# match_timelines_stats. Set TIMELINE_STORAGE = 'wide' in config.py to stop writing match_timelines_stats rows.
+CREATE TABLE IF NOT EXISTS match_participant_timelines (
+    match_id BIGINT NOT NULL,
+    match_participant_id TINYINT NOT NULL,
+    creepsPerMin_0_10 FLOAT(7, 3),
+    creepsPerMin_10_20 FLOAT(7, 3),
+    creepsPerMin_20_30 FLOAT(7, 3),
+    creepsPerMin_30_end FLOAT(7, 3),
+    xpPerMin_0_10 FLOAT(7, 3),
+    xpPerMin_10_20 FLOAT(7, 3),
+    xpPerMin_20_30 FLOAT(7, 3),
+    xpPerMin_30_end FLOAT(7, 3),
+    goldPerMin_0_10 FLOAT(7, 3),
+    goldPerMin_10_20 FLOAT(7, 3),
+    goldPerMin_20_30 FLOAT(7, 3),
+    goldPerMin_30_end FLOAT(7, 3),
+    csDiffPerMin_0_10 FLOAT(7, 3),
+    csDiffPerMin_10_20 FLOAT(7, 3),
+    csDiffPerMin_20_30 FLOAT(7, 3),
+    csDiffPerMin_30_end FLOAT(7, 3),
+    xpDiffPerMin_0_10 FLOAT(7, 3),
+    xpDiffPerMin_10_20 FLOAT(7, 3),
+    xpDiffPerMin_20_30 FLOAT(7, 3),
+    xpDiffPerMin_30_end FLOAT(7, 3),
+    damageTakenPerMin_0_10 FLOAT(7, 3),
+    damageTakenPerMin_10_20 FLOAT(7, 3),
+    damageTakenPerMin_20_30 FLOAT(7, 3),
+    damageTakenPerMin_30_end FLOAT(7, 3),
+    damageTakenDiffPerMin_0_10 FLOAT(7, 3),
+    damageTakenDiffPerMin_10_20 FLOAT(7, 3),
+    damageTakenDiffPerMin_20_30 FLOAT(7, 3),
+    damageTakenDiffPerMin_30_end FLOAT(7, 3),
+    PRIMARY KEY (match_id, match_participant_id),
+    FOREIGN KEY (match_id, match_participant_id)
+        REFERENCES match_participants(match_id, match_participant_id)
+);
+
+INSERT IGNORE INTO match_participant_timelines
+SELECT p.match_id, p.match_participant_id,
+    t0.interval_0_10, t0.interval_10_20, t0.interval_20_30, t0.interval_30_end,
+    t1.interval_0_10, t1.interval_10_20, t1.interval_20_30, t1.interval_30_end,
+    t2.interval_0_10, t2.interval_10_20, t2.interval_20_30, t2.interval_30_end,
+    t3.interval_0_10, t3.interval_10_20, t3.interval_20_30, t3.interval_30_end,
+    t4.interval_0_10, t4.interval_10_20, t4.interval_20_30, t4.interval_30_end,
+    t5.interval_0_10, t5.interval_10_20, t5.interval_20_30, t5.interval_30_end,
+    t6.interval_0_10, t6.interval_10_20, t6.interval_20_30, t6.interval_30_end
+FROM match_participants AS p
+    LEFT JOIN match_timelines_stats AS t0 ON t0.match_timeline_id = p.creepsPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t1 ON t1.match_timeline_id = p.xpPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t2 ON t2.match_timeline_id = p.goldPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t3 ON t3.match_timeline_id = p.csDiffPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t4 ON t4.match_timeline_id = p.xpDiffPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t5 ON t5.match_timeline_id = p.damageTakenPerMinDelta_id
+    LEFT JOIN match_timelines_stats AS t6 ON t6.match_timeline_id = p.damageTakenDiffPerMinDelta_id;
@@ -0,0 +1,42 @@
+# Champion, item and summoner spell rollups, see create_historical_tables.sql. The importer keeps them up to date from
+# now on. Fill them with the matches already in the DB by running import_historical_data with state 'rebuild_rollups'.
+CREATE TABLE IF NOT EXISTS champion_stats_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    game_duration BIGINT NOT NULL,
+    kills BIGINT NOT NULL,
+    deaths BIGINT NOT NULL,
+    assists BIGINT NOT NULL,
+    gold_earned BIGINT NOT NULL,
+    minions_killed BIGINT NOT NULL,
+    damage_to_champions BIGINT NOT NULL,
+    vision_score BIGINT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier)
+);
+
+# Games and wins of every item in every inventory slot (0-5, 6 is the trinket) of a champion
+CREATE TABLE IF NOT EXISTS champion_item_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    item_slot TINYINT NOT NULL,
+    item_id INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier, item_slot, item_id)
+);
+
+# Games and wins of every summoner spell pair of a champion. The pair is ordered, spell1_id <= spell2_id
+CREATE TABLE IF NOT EXISTS champion_spell_rollup (
+    champion_id INT NOT NULL,
+    patch VARCHAR(8) NOT NULL,
+    tier VARCHAR(16) NOT NULL,
+    spell1_id INT NOT NULL,
+    spell2_id INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    PRIMARY KEY (patch, champion_id, tier, spell1_id, spell2_id)
+);
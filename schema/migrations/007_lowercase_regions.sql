@@ -0,0 +1,6 @@
+# Regions used to be stored as the upper case platform id of the Riot API, e.g. 'NA1'. The importer now stores the
+# lower case region prefix, e.g. 'na1', so lower case the existing rows to keep one region value per region, e.g. in
+# the region partitions of the Parquet export.
+UPDATE matches SET region = LOWER(region) WHERE BINARY region <> LOWER(region);
+
+UPDATE accounts SET region = LOWER(region) WHERE BINARY region <> LOWER(region);
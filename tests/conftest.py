@@ -0,0 +1,21 @@
+import os
+import sys
+import types
+
+# The importers read their settings from config.py, which is not part of the repository. Tests run against a minimal
+# config unless a real one is importable. Everything else the tests need is in requirements.txt
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType('config')
+    config.AWS_ACCESS_KEY = 'test'
+    config.AWS_SECRET_KEY = 'test'
+    config.AWS_SQS_URL = 'https://sqs.us-east-1.amazonaws.com/000000000000/matches.fifo'
+    config.AWS_REGION_NAME = 'us-east-1'
+    config.RIOT_GAMES_API_KEY = 'test'
+    config.DB_TYPE = 'mysql'
+    config.db_config = {}
+    config.CRAWL_FRONTIER = 'local'
+    config.MATCH_ARCHIVE_DIR = None
+    sys.modules['config'] = config
@@ -0,0 +1,237 @@
+import threading
+import time
+
+from crawl_frontier import LocalFrontier, get_message_group_id
+import import_historical_data as importer
+
+QUEUE_URL = importer.get_queue_url('na1')
+NUM_MATCHES = 64
+
+
+class FakeConnection:
+    def close(self):
+        pass
+
+
+def send_matches(frontier: LocalFrontier, match_ids):
+    for i in range(0, len(match_ids), importer.SQS_BATCH_SIZE):
+        importer.send_matches_to_sqs(frontier, 'na1', match_ids[i:i + importer.SQS_BATCH_SIZE])
+
+
+def test_local_frontier_hides_message_groups_with_messages_in_flight():
+    frontier = LocalFrontier()
+    # Two matches of the same message group and one of another
+    match_ids = [match_id for match_id in range(1000) if get_message_group_id(match_id) == '0'][:2] + \
+        [match_id for match_id in range(1000) if get_message_group_id(match_id) == '1'][:1]
+    frontier.send_message_batch(QUEUE_URL, [
+        {'Id': str(match_id), 'MessageBody': 'na1:{}'.format(match_id),
+         'MessageGroupId': get_message_group_id(match_id)}
+        for match_id in match_ids])
+
+    first = frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=1)['Messages']
+    assert [message['Body'] for message in first] == ['na1:{}'.format(match_ids[0])]
+    # Group 0 has a message in flight, so only the message of group 1 can be received
+    second = frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10)['Messages']
+    assert [message['Body'] for message in second] == ['na1:{}'.format(match_ids[2])]
+    assert frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10) == {}
+
+    frontier.delete_message_batch(QueueUrl=QUEUE_URL, Entries=[
+        {'Id': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle']} for message in first])
+    third = frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10)['Messages']
+    assert [message['Body'] for message in third] == ['na1:{}'.format(match_ids[1])]
+
+
+def test_local_frontier_long_poll_returns_once_a_group_is_released():
+    frontier = LocalFrontier()
+    match_ids = [match_id for match_id in range(1000) if get_message_group_id(match_id) == '0'][:2]
+    send_matches(frontier, match_ids)
+    first = frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=1)['Messages']
+
+    def delete_first():
+        time.sleep(0.2)
+        frontier.delete_message_batch(QueueUrl=QUEUE_URL, Entries=[
+            {'Id': first[0]['MessageId'], 'ReceiptHandle': first[0]['ReceiptHandle']}])
+
+    threading.Thread(target=delete_first).start()
+    started_at = time.monotonic()
+    second = frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10, WaitTimeSeconds=5)['Messages']
+    assert len(second) == 1
+    assert time.monotonic() - started_at < 2
+
+
+# Every message group of the FIFO queue is in flight after a few receives, while the pipeline still holds their
+# messages. The backlog mode has to keep receiving until the whole queue is imported instead of stopping there
+def test_backlog_imports_every_match_while_message_groups_are_in_flight(monkeypatch):
+    frontier = LocalFrontier()
+    match_ids = list(range(1, NUM_MATCHES + 1))
+    send_matches(frontier, match_ids)
+    inserted_match_ids = []
+
+    def read_match(region, match_id):
+        time.sleep(0.02)
+        return {'gameId': int(match_id)}
+
+    def insert_match_rows_into_db(connection, match_rows):
+        inserted_match_ids.extend(match.get('gameId') for (match, accounts, rows) in match_rows)
+        return []
+
+    monkeypatch.setattr(importer, 'connect_to_sqs', lambda: frontier)
+    monkeypatch.setattr(importer, 'get_connection', FakeConnection)
+    monkeypatch.setattr(importer, 'read_match', read_match)
+    monkeypatch.setattr(importer, 'build_match_rows', lambda match, accounts: ())
+    monkeypatch.setattr(importer, 'insert_match_rows_into_db', insert_match_rows_into_db)
+    monkeypatch.setattr(importer, 'COLUMNAR_EXPORT_DIR', None)
+    monkeypatch.setattr(importer, 'PIPELINE_WRITE_BATCH_SIZE', 10)
+    monkeypatch.setattr(importer, 'SQS_WAIT_TIME_SECONDS', 1)
+
+    importer.process_backlog_matches(QUEUE_URL, importer.WorkBudget(max_messages=NUM_MATCHES * 2))
+
+    assert sorted(inserted_match_ids) == match_ids
+    assert frontier.get_queue_length(QUEUE_URL) == 0
+    assert frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10) == {}
+
+
+# Staged messages stay in flight until their load commits, so after a few receives every message group is held by the
+# spool. The bulk mode has to load that window and carry on instead of treating the queue as empty
+def test_bulk_backlog_loads_every_match_while_message_groups_are_in_flight(monkeypatch):
+    frontier = LocalFrontier()
+    match_ids = list(range(1, NUM_MATCHES + 1))
+    send_matches(frontier, match_ids)
+    loads = []
+
+    class FakeSpool:
+        def __init__(self, tables):
+            self.match_ids = []
+
+        def load(self, connection, disable_foreign_key_checks=False):
+            loads.append(self.match_ids)
+            return True
+
+        def close(self):
+            pass
+
+    def spool_matches(spool, matches):
+        spool.match_ids.extend(match.get('gameId') for match in matches)
+        return [match.get('gameId') for match in matches]
+
+    monkeypatch.setattr(importer, 'connect_to_sqs', lambda: frontier)
+    monkeypatch.setattr(importer, 'get_bulk_load_connection', FakeConnection)
+    monkeypatch.setattr(importer, 'BulkLoadSpool', FakeSpool)
+    monkeypatch.setattr(importer, 'get_many', lambda urls: [{'gameId': int(url.rsplit('/', 1)[1])} for url in urls])
+    monkeypatch.setattr(importer, 'spool_matches', spool_matches)
+    monkeypatch.setattr(importer, 'SQS_WAIT_TIME_SECONDS', 1)
+    monkeypatch.setattr(importer, 'BULK_LOAD_WINDOW_WAIT_SECONDS', 0)
+
+    importer.process_backlog_matches_bulk(QUEUE_URL, importer.WorkBudget(max_messages=NUM_MATCHES * 2))
+
+    assert sorted(match_id for load in loads for match_id in load) == match_ids
+    # Every receive window is loaded on its own
+    assert len(loads) > 1
+    assert frontier.get_queue_length(QUEUE_URL) == 0
+    assert frontier.receive_message(QueueUrl=QUEUE_URL, MaxNumberOfMessages=10) == {}
+
+
+class FakeSqsClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.deleted = []
+
+    def receive_message(self, **kwargs):
+        return self.responses.pop(0) if self.responses else {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self.deleted.extend(entry['Id'] for entry in Entries)
+
+    # Rejects the first entry of every batch
+    def send_message_batch(self, QueueUrl, Entries):
+        self.sent_entries = Entries
+        return {'Successful': [{'Id': entry['Id']} for entry in Entries[1:]],
+                'Failed': [{'Id': Entries[0]['Id'], 'Code': 'InternalError'}]}
+
+
+def test_poison_messages_are_dropped_without_a_dead_letter_queue(monkeypatch):
+    monkeypatch.setattr(importer, 'AWS_SQS_DEAD_LETTER_URL', None)
+    poison_count = str(importer.MAX_RECEIVE_COUNT + 1)
+    client = FakeSqsClient([
+        {'Messages': [{'MessageId': '1', 'ReceiptHandle': 'r1', 'Body': 'na1:1',
+                       'Attributes': {'ApproximateReceiveCount': poison_count}}]},
+        {'Messages': [{'MessageId': '2', 'ReceiptHandle': 'r2', 'Body': 'na1:2',
+                       'Attributes': {'ApproximateReceiveCount': poison_count}},
+                      {'MessageId': '3', 'ReceiptHandle': 'r3', 'Body': 'na1:3',
+                       'Attributes': {'ApproximateReceiveCount': '1'}}]},
+    ])
+    # A receive of only poison messages is not mistaken for an empty queue
+    messages = importer.receive_match_messages(client, 10, QUEUE_URL)
+    assert [message['MessageId'] for message in messages] == ['3']
+    assert client.deleted == ['1', '2']
+    assert importer.receive_match_messages(client, 10, QUEUE_URL) is None
+
+
+# A message whose stage raises must stop being extended, or it stays invisible and the receive loop waits for it
+# until the deadline
+def test_backlog_releases_messages_whose_stage_raised(monkeypatch):
+    frontier = LocalFrontier()
+    match_ids = list(range(1, 11))
+    send_matches(frontier, match_ids)
+    inserted_match_ids = []
+
+    def read_match(region, match_id):
+        if int(match_id) == 3:
+            raise RuntimeError('connection reset')
+        if int(match_id) == 4:
+            return {'gameId': 4, 'participants': [{'participantId': 1}],
+                    'participantIdentities': [{'participantId': 1, 'player': None}]}
+        return {'gameId': int(match_id)}
+
+    def build_match_rows(match, accounts):
+        if match['gameId'] == 5:
+            raise RuntimeError('unexpected')
+        importer.check_participant_accounts(match, accounts)
+        return ()
+
+    def insert_match_rows_into_db(connection, match_rows):
+        inserted_match_ids.extend(match.get('gameId') for (match, accounts, rows) in match_rows)
+        return []
+
+    delete_match_messages = importer.delete_match_messages
+    deleted_bodies = []
+
+    def record_deleted_messages(sqs_client, queue_url, messages):
+        deleted_bodies.extend(message['Body'] for message in messages)
+        delete_match_messages(sqs_client, queue_url, messages)
+
+    monkeypatch.setattr(importer, 'connect_to_sqs', lambda: frontier)
+    monkeypatch.setattr(importer, 'get_connection', FakeConnection)
+    monkeypatch.setattr(importer, 'read_match', read_match)
+    monkeypatch.setattr(importer, 'build_match_rows', build_match_rows)
+    monkeypatch.setattr(importer, 'delete_match_messages', record_deleted_messages)
+    monkeypatch.setattr(importer, 'insert_match_rows_into_db', insert_match_rows_into_db)
+    monkeypatch.setattr(importer, 'COLUMNAR_EXPORT_DIR', None)
+    monkeypatch.setattr(importer, 'SQS_WAIT_TIME_SECONDS', 1)
+
+    started_at = time.monotonic()
+    importer.process_backlog_matches(QUEUE_URL, importer.WorkBudget(max_seconds=30))
+
+    assert time.monotonic() - started_at < 10
+    assert sorted(inserted_match_ids) == [1, 2, 6, 7, 8, 9, 10]
+    # The failed messages are left in the queue for another attempt
+    assert sorted(deleted_bodies) == sorted('na1:{}'.format(match_id) for match_id in inserted_match_ids)
+
+
+def test_only_messages_the_dead_letter_queue_accepted_are_deleted(monkeypatch):
+    messages = [{'MessageId': str(match_id), 'ReceiptHandle': 'r', 'Body': 'na1:{}'.format(match_id)}
+                for match_id in (1, 2, 3)]
+    monkeypatch.setattr(importer, 'AWS_SQS_DEAD_LETTER_URL', 'https://sqs/dead-letters')
+    client = FakeSqsClient([])
+    importer.send_to_dead_letter_queue(client, QUEUE_URL, messages)
+    assert client.deleted == ['2', '3']
+    # Standard queues reject message group ids
+    assert all(set(entry) == {'Id', 'MessageBody'} for entry in client.sent_entries)
+
+    monkeypatch.setattr(importer, 'AWS_SQS_DEAD_LETTER_URL', 'https://sqs/dead-letters.fifo')
+    client = FakeSqsClient([])
+    importer.send_to_dead_letter_queue(client, QUEUE_URL, messages)
+    assert client.deleted == ['2', '3']
+    assert [entry['MessageDeduplicationId'] for entry in client.sent_entries] == ['1', '2', '3']
+    assert [entry['MessageGroupId'] for entry in client.sent_entries] == [get_message_group_id(match_id)
+                                                                          for match_id in (1, 2, 3)]
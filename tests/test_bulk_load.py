@@ -0,0 +1,57 @@
+import mysql.connector
+import pytest
+
+from bulk_load import BulkLoadSpool
+
+TABLES = (('matches', ('match_id', 'region')),)
+
+
+# Connection that breaks during the LOAD DATA, so every later statement fails too
+class BrokenConnection:
+    def __init__(self, error):
+        self.error = error
+        self.broken = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, stmt, params=None):
+        if self.broken:
+            raise mysql.connector.errors.OperationalError('MySQL Connection not available')
+        if stmt.startswith('LOAD DATA'):
+            self.broken = True
+            raise self.error
+
+    def close(self):
+        if self.broken:
+            raise mysql.connector.errors.OperationalError('MySQL Connection not available')
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.execute('ROLLBACK')
+
+
+def spool_match(tmp_path) -> BulkLoadSpool:
+    spool = BulkLoadSpool(TABLES, str(tmp_path))
+    spool.add_rows('matches', [(1, 'na1')])
+    return spool
+
+
+def test_failed_load_on_a_broken_connection_is_reported(tmp_path):
+    spool = spool_match(tmp_path)
+    try:
+        connection = BrokenConnection(mysql.connector.errors.OperationalError('Lost connection'))
+        assert spool.load(connection, disable_foreign_key_checks=True) is False
+    finally:
+        spool.close()
+
+
+def test_restoring_the_checks_does_not_hide_the_error_of_the_load(tmp_path):
+    spool = spool_match(tmp_path)
+    try:
+        with pytest.raises(OSError, match='spool file missing'):
+            spool.load(BrokenConnection(OSError('spool file missing')), disable_foreign_key_checks=True)
+    finally:
+        spool.close()
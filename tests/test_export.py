@@ -0,0 +1,47 @@
+import import_historical_data as importer
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.statements = []
+
+    def execute(self, stmt, params=None):
+        self.statements.append((stmt, params))
+
+    def fetchmany(self, size):
+        (rows, self.rows) = (self.rows[:size], self.rows[size:])
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cursor = lambda: cursor
+
+
+class FakeExporter:
+    def __init__(self):
+        self.rows = {}
+
+    def add_rows(self, table, patch, region, rows):
+        self.rows.setdefault((table, patch, region), []).extend(rows)
+
+
+# Timeline rows imported before migration 001 have AUTO_INCREMENT ids, so their match is found through the
+# participants referencing them rather than from the id
+def test_timeline_rows_are_exported_through_the_participants_referencing_them():
+    cursor = FakeCursor([('10.4.311.1234', 'na1', 17, 1.0, 2.0, 3.0, None)])
+    exporter = FakeExporter()
+    importer.export_table_from_db(FakeConnection(cursor), exporter, 'match_timelines_stats',
+                                  ('match_timeline_id', 'interval_0_10', 'interval_10_20', 'interval_20_30',
+                                   'interval_30_end'), ('na1',), ['10.4'])
+
+    ((stmt, params),) = cursor.statements
+    assert 'DIV' not in stmt
+    assert 'JOIN match_participants AS p ON t.match_timeline_id IN (p.creepsPerMinDelta_id, ' in stmt
+    assert 'JOIN matches AS m ON m.match_id = p.match_id WHERE m.region IN (%s)' in stmt
+    assert params == ['na1', '10.4.%']
+    assert exporter.rows == {('match_timelines_stats', '10.4', 'na1'): [(17, 1.0, 2.0, 3.0, None)]}
@@ -0,0 +1,78 @@
+import os
+
+import import_historical_data as importer
+from match_archive import MatchArchive
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fixtures', 'match_archive')
+
+
+class FakeCursor:
+    def __init__(self, statements, stored_matches):
+        self.statements = statements
+        self.stored_matches = stored_matches
+
+    def execute(self, stmt, params=None):
+        self.statements.append((stmt, params))
+
+    def executemany(self, stmt, rows):
+        self.statements.append((stmt, list(rows)))
+
+    def __iter__(self):
+        return iter(self.stored_matches)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    # @param stored_matches (match_id, region) rows already in the matches table
+    def __init__(self, stored_matches=()):
+        self.statements = []
+        self.stored_matches = stored_matches
+
+    def cursor(self):
+        return FakeCursor(self.statements, self.stored_matches)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def get_fixture_match_rows():
+    (region, match_id, match) = next(MatchArchive(FIXTURES_DIR).stream(importer.ARCHIVED_MATCH))
+    accounts = importer.get_account_ids_by_participant_id(match)
+    return (match, accounts, importer.build_match_rows(match, accounts))
+
+
+def test_match_received_twice_in_a_batch_is_counted_once():
+    (match, accounts, rows) = get_fixture_match_rows()
+    connection = FakeConnection()
+    assert importer.insert_match_rows_into_db(connection, [(match, accounts, rows), (match, accounts, rows)]) == []
+
+    (select_stmt, select_params) = connection.statements[0]
+    assert select_stmt.endswith(' FOR UPDATE')
+    assert select_params == [match['gameId']]
+    inserted_matches = [params for (stmt, params) in connection.statements if stmt == importer.MATCHES_INSERT_STMT]
+    assert inserted_matches == [[rows[0]]]
+    stats_upsert_stmt = importer.rollups.upsert_stmts['champion_stats_rollup']
+    (stats_rows,) = [params for (stmt, params) in connection.statements if stmt == stats_upsert_stmt]
+    # games of every champion of the match
+    assert [row[3] for row in stats_rows] == [1] * len(match['participants'])
+
+
+def test_match_stored_for_another_region_is_refused():
+    (match, accounts, rows) = get_fixture_match_rows()
+    assert rows[0][1] == 'na1'
+    # Rows of the same region imported before regions were lower cased are the same match
+    connection = FakeConnection([(match['gameId'], 'NA1')])
+    assert importer.insert_match_rows_into_db(connection, [(match, accounts, rows)]) == []
+    assert not [stmt for (stmt, params) in connection.statements if stmt == importer.rollups.upsert_stmts[
+        'champion_stats_rollup']]
+
+    connection = FakeConnection([(match['gameId'], 'kr')])
+    assert importer.insert_match_rows_into_db(connection, [(match, accounts, rows)]) == [match['gameId']]
+    assert not [stmt for (stmt, params) in connection.statements if stmt.startswith('INSERT')]
+    assert importer.insert_single_match_into_db(connection, match, accounts) is None
+    assert not [stmt for (stmt, params) in connection.statements if stmt.startswith('INSERT')]
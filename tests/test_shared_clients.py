@@ -0,0 +1,27 @@
+import threading
+import time
+
+import import_historical_data as importer
+
+
+class SlowArchive:
+    instances = []
+
+    def __init__(self, directory):
+        # Give the other threads time to find no archive yet
+        time.sleep(0.05)
+        SlowArchive.instances.append(self)
+
+
+def test_worker_threads_share_one_match_archive(monkeypatch):
+    monkeypatch.setattr(importer, 'MatchArchive', SlowArchive)
+    monkeypatch.setattr(importer, 'MATCH_ARCHIVE_DIR', '/tmp/archive')
+    monkeypatch.setattr(importer, 'match_archive', None)
+    archives = []
+    threads = [threading.Thread(target=lambda: archives.append(importer.get_match_archive())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(SlowArchive.instances) == 1
+    assert archives == SlowArchive.instances * 8
@@ -0,0 +1,46 @@
+import os
+import re
+
+import import_static_data as importer
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema')
+
+
+class FakeCursor:
+    def __init__(self, stored_rows):
+        self.stored_rows = stored_rows
+        self.statements = []
+
+    def execute(self, stmt, params=None):
+        self.statements.append(stmt)
+
+    def executemany(self, stmt, rows):
+        self.statements.append(stmt)
+
+    def __iter__(self):
+        return iter(self.stored_rows)
+
+
+def test_upsert_keeps_insert_ignore_so_values_that_do_not_fit_are_clamped():
+    upsert_stmt = importer.get_upsert_stmt(importer.CHAMPIONS_INSERT_STMT)
+    assert upsert_stmt.startswith('INSERT IGNORE INTO champions ')
+    assert upsert_stmt.endswith('row_hash = VALUES(row_hash)')
+
+    # Ashe is stored with an outdated hash and Annie is new
+    cursor = FakeCursor([('22', 'outdated', 1)])
+    rows = [(22, '10.4.1', 'Ashe', 'the Frost Archer', 'blurb', 2, 3, 2, 4, 'Mana', 570.0, 87.0, 280.0, 32.0, 325, 26.0,
+             3.4, 30.0, 0.5, 600, 3.5, 0.55, 7.0, 0.65, 0.0, 0.0, 59.0, 2.96, 3.33, 0.658, True, 'new'),
+            (1, '10.4.1', 'Annie', 'the Dark Child', 'blurb', 2, 3, 10, 6, 'Mana', 524.0, 88.0, 418.0, 25.0, 335, 19.2,
+             4.0, 30.0, 0.5, 625, 5.5, 0.55, 8.0, 0.8, 0.0, 0.0, 50.4, 2.63, 1.36, 0.579, True, 'new')]
+    importer.update_table(cursor, 'champions', importer.CHAMPIONS_INSERT_STMT, rows, ('champion_id',), '10.4.1',
+                          ('row_hash',))
+    assert [stmt for stmt in cursor.statements if stmt.startswith('INSERT')] == [upsert_stmt]
+
+
+def test_static_columns_fit_the_largest_values():
+    for path in ('create_static_tables.sql', os.path.join('migrations', '003_static_row_hashes.sql')):
+        with open(os.path.join(SCHEMA_DIR, path)) as f:
+            sql = f.read()
+        for (column, column_type) in (('stat_movespeed', 'SMALLINT'), ('stat_attackrange', 'SMALLINT'),
+                                      ('cooldown', 'SMALLINT'), ('blurb', 'TEXT')):
+            assert re.search(r'\b{} {}\b'.format(column, column_type), sql), (path, column)
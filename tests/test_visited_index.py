@@ -0,0 +1,27 @@
+from crawl_frontier import LocalFrontier
+import import_historical_data as importer
+from visited_index import MATCHES, VisitedIndex
+
+
+class FailingFrontier(LocalFrontier):
+    # Fails every other entry of a batch
+    def send_message_batch(self, QueueUrl, Entries):
+        response = super().send_message_batch(QueueUrl, Entries[::2])
+        response['Failed'] = [{'Id': entry['Id'], 'Code': 'InternalError'} for entry in Entries[1::2]]
+        return response
+
+
+def test_filter_unvisited_does_not_mark_keys():
+    index = VisitedIndex(None)
+    index.mark_visited(MATCHES, ['na1:1'])
+    assert index.filter_unvisited(MATCHES, ['na1:1', 'na1:2', 'na1:3', 'na1:2']) == ['na1:2', 'na1:3']
+    # Keys are only visited once the caller marks them
+    assert index.filter_unvisited(MATCHES, ['na1:2']) == ['na1:2']
+    index.mark_visited(MATCHES, ['na1:2'])
+    assert index.is_visited(MATCHES, 'na1:2')
+    assert index.filter_unvisited(MATCHES, ['na1:2', 'na1:3']) == ['na1:3']
+
+
+def test_send_matches_to_sqs_returns_only_the_matches_that_were_sent():
+    assert importer.send_matches_to_sqs(FailingFrontier(), 'na1', [1, 2, 3, 4]) == [1, 3]
+    assert importer.send_matches_to_sqs(None, 'na1', [1, 2]) == []
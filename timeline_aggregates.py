@@ -0,0 +1,143 @@
+import argparse
+import csv
+from db_connections import get_connection
+from import_historical_data import MATCH_PARTICIPANT_TIMELINES_COLUMNS, TIMELINE_INTERVALS, TIMELINE_STAT_KINDS
+import sys
+from typing import Dict, List, Sequence, Tuple
+
+# Per champion and patch aggregates of the participant timelines, derived with NumPy
+# Timelines are read from match_participant_timelines straight into one float matrix, a row per participant and a
+# column per stat kind and interval, with NULL read as NaN. Grouping and averaging are whole-matrix operations, so no
+# Python code runs per participant. The gold and xp curves estimate the gold and xp a champion has at 10, 20 and 30
+# minutes from its average per-minute deltas.
+# numpy is only imported when aggregates are derived, so the importers run without it.
+#
+# python timeline_aggregates.py --patches 10.4 10.5 --output aggregates.csv
+
+# Patch is selected as numbers, so every selected column converts to a float in one step
+TIMELINES_SELECT_STMT = (
+    'SELECT p.champion_id, '
+    'CAST(SUBSTRING_INDEX(m.game_version, \'.\', 1) AS UNSIGNED), '
+    'CAST(SUBSTRING_INDEX(SUBSTRING_INDEX(m.game_version, \'.\', 2), \'.\', -1) AS UNSIGNED), '
+    '{0} '
+    'FROM match_participant_timelines AS t '
+    'JOIN match_participants AS p ON p.match_id = t.match_id AND p.match_participant_id = t.match_participant_id '
+    'JOIN matches AS m ON m.match_id = t.match_id'
+)
+FETCH_SIZE = 50000
+# champion_id, patch major, patch minor
+NUM_KEY_COLUMNS = 3
+TIMELINE_COLUMNS = MATCH_PARTICIPANT_TIMELINES_COLUMNS[2:]
+# Intervals with a known length in minutes. The curves end at 30 minutes because 30-end has none
+CURVE_INTERVAL_MINUTES = (10, 10, 10)
+CURVE_STAT_KINDS = ('goldPerMinDeltas', 'xpPerMinDeltas')
+
+
+def get_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('The timeline aggregates need numpy. Install it with: pip install numpy')
+    return numpy
+
+
+# Return a (participants, NUM_KEY_COLUMNS + len(TIMELINE_COLUMNS)) matrix of every participant timeline
+# @param patches Only read these patches, e.g. ['10.4']. Every patch if None
+def load_timelines(connection, patches: Sequence[str] = None):
+    numpy = get_numpy()
+    stmt = TIMELINES_SELECT_STMT.format(', '.join('t.' + column for column in TIMELINE_COLUMNS))
+    params = []
+    if patches:
+        stmt += ' WHERE {}'.format(' OR '.join(['m.game_version LIKE %s'] * len(patches)))
+        params = [patch + '.%' for patch in patches]
+    chunks = []
+    cursor = connection.cursor()
+    try:
+        cursor.execute(stmt, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            chunks.append(numpy.array(rows, dtype=numpy.float64))
+    finally:
+        cursor.close()
+    if not chunks:
+        return numpy.empty((0, NUM_KEY_COLUMNS + len(TIMELINE_COLUMNS)))
+    return numpy.concatenate(chunks)
+
+
+# Average every timeline column per champion and patch, ignoring missing values
+# Return (keys, counts, means): the (champion_id, patch major, patch minor) of every group, the number of
+# participants with a value in every column, and the mean of every column (NaN if no participant had a value)
+def derive_timeline_means(timelines) -> Tuple:
+    numpy = get_numpy()
+    (keys, groups) = numpy.unique(timelines[:, :NUM_KEY_COLUMNS].astype(numpy.int64), axis=0, return_inverse=True)
+    groups = groups.reshape(-1)
+    values = timelines[:, NUM_KEY_COLUMNS:]
+    present = ~numpy.isnan(values)
+    counts = numpy.zeros((len(keys), values.shape[1]))
+    sums = numpy.zeros((len(keys), values.shape[1]))
+    numpy.add.at(counts, groups, present)
+    numpy.add.at(sums, groups, numpy.where(present, values, 0.0))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+    return keys, counts, means
+
+
+# Cumulative value of a per-minute stat kind at the end of every interval of CURVE_INTERVAL_MINUTES
+def derive_curves(means, stat_kind: str):
+    numpy = get_numpy()
+    start = TIMELINE_STAT_KINDS.index(stat_kind) * len(TIMELINE_INTERVALS)
+    per_minute = means[:, start:start + len(CURVE_INTERVAL_MINUTES)]
+    return numpy.cumsum(per_minute * numpy.array(CURVE_INTERVAL_MINUTES), axis=1)
+
+
+# Return one dict per champion and patch with the participant count, the mean of every timeline column and the gold
+# and xp curves, e.g. {'champion_id': 266, 'patch': '10.4', 'participants': 1520, 'goldPerMin_0_10': 312.4, ...,
+# 'gold_at_10': 3124.0, 'gold_at_20': ...}
+def get_timeline_aggregates(timelines) -> List[Dict]:
+    numpy = get_numpy()
+    if not len(timelines):
+        return []
+    (keys, counts, means) = derive_timeline_means(timelines)
+    columns = list(TIMELINE_COLUMNS)
+    values = [means]
+    for stat_kind in CURVE_STAT_KINDS:
+        name = stat_kind[:-len('PerMinDeltas')]
+        columns += ['{}_at_{}'.format(name, sum(CURVE_INTERVAL_MINUTES[:i + 1]))
+                    for i in range(len(CURVE_INTERVAL_MINUTES))]
+        values.append(derive_curves(means, stat_kind))
+    # NaN becomes None, so it is written as an empty CSV field
+    rows = numpy.round(numpy.hstack(values), 3).astype(object)
+    rows[numpy.isnan(rows.astype(numpy.float64))] = None
+    participants = counts.max(axis=1).astype(numpy.int64).tolist()
+    return [dict({'champion_id': champion_id, 'patch': '{}.{}'.format(major, minor), 'participants': count},
+                 **dict(zip(columns, row)))
+            for ((champion_id, major, minor), count, row) in zip(keys.tolist(), participants, rows.tolist())]
+
+
+def write_csv(aggregates: Sequence[Dict], file):
+    if not aggregates:
+        return
+    writer = csv.DictWriter(file, fieldnames=list(aggregates[0]))
+    writer.writeheader()
+    writer.writerows(aggregates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Derive per champion and patch timeline aggregates')
+    parser.add_argument('--patches', nargs='*', help='Only these patches, e.g. 10.4 10.5')
+    parser.add_argument('--output', help='CSV file to write. Written to stdout if not set')
+    args = parser.parse_args()
+    db_connection = get_connection()
+    try:
+        timeline_matrix = load_timelines(db_connection, args.patches)
+    finally:
+        db_connection.close()
+    print('Read {} participant timelines'.format(len(timeline_matrix)), file=sys.stderr)
+    timeline_aggregates = get_timeline_aggregates(timeline_matrix)
+    if args.output:
+        with open(args.output, 'w', newline='') as output_file:
+            write_csv(timeline_aggregates, output_file)
+    else:
+        write_csv(timeline_aggregates, sys.stdout)
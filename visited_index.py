@@ -0,0 +1,109 @@
+import hashlib
+import mmap
+import os
+import threading
+from typing import Dict, Iterable, List
+
+# Bloom filters of the accounts and matches the crawler has already visited. Checked before any Riot API request or
+# SQS message is sent so the same match is not queued once per participant. A false positive skips an unvisited
+# account or match, which only costs a little coverage.
+# Filters are backed by memory mapped files, so every bit that is set is persisted to disk immediately and the
+# filters are reloaded from the same files on the next (warm or cold) start.
+
+VISITED_INDEX_DIR = '/tmp/visited_index'
+ACCOUNTS = 'accounts'
+MATCHES = 'matches'
+# Sized for a 1% false positive rate: ~9.6 bits and 7 hashes per expected item
+EXPECTED_ITEMS = {ACCOUNTS: 2000000, MATCHES: 10000000}
+BITS_PER_ITEM = 10
+NUM_HASHES = 7
+
+
+class BloomFilter:
+    # @param path File backing the filter. If None the filter only lives in memory
+    def __init__(self, num_bits: int, num_hashes: int = NUM_HASHES, path: str = None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.lock = threading.Lock()
+        self.file = None
+        num_bytes = (num_bits + 7) // 8
+        if path is None:
+            self.bits = bytearray(num_bytes)
+            self.is_new = True
+            return
+        self.is_new = not os.path.exists(path) or os.path.getsize(path) != num_bytes
+        # Discard the file if it was written with different parameters
+        self.file = open(path, 'w+b' if self.is_new else 'r+b')
+        if self.is_new:
+            self.file.truncate(num_bytes)
+        self.bits = mmap.mmap(self.file.fileno(), num_bytes)
+
+    def get_positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(key))
+
+    # Return True if the key was not in the filter before
+    def add(self, key: str) -> bool:
+        positions = self.get_positions(key)
+        is_new_key = False
+        with self.lock:
+            for position in positions:
+                mask = 1 << (position & 7)
+                if not self.bits[position >> 3] & mask:
+                    self.bits[position >> 3] |= mask
+                    is_new_key = True
+        return is_new_key
+
+    def flush(self):
+        if self.file is not None:
+            self.bits.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.bits.close()
+            self.file.close()
+            self.file = None
+
+
+class VisitedIndex:
+    def __init__(self, directory: str = VISITED_INDEX_DIR):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.filters: Dict[str, BloomFilter] = {
+            kind: BloomFilter(expected_items * BITS_PER_ITEM, NUM_HASHES,
+                              os.path.join(directory, kind + '.bloom') if directory else None)
+            for (kind, expected_items) in EXPECTED_ITEMS.items()
+        }
+
+    # True if the filter of this kind did not exist on disk yet and should be seeded from the DB
+    def is_new(self, kind: str) -> bool:
+        return self.filters[kind].is_new
+
+    def is_visited(self, kind: str, key: str) -> bool:
+        return str(key) in self.filters[kind]
+
+    def mark_visited(self, kind: str, keys: Iterable):
+        bloom_filter = self.filters[kind]
+        for key in keys:
+            bloom_filter.add(str(key))
+
+    # Return the keys not visited yet, in order and without duplicates. They are not marked as visited, so the caller
+    # can mark them once they were stored or queued and a failure does not drop them from the crawl
+    def filter_unvisited(self, kind: str, keys: Iterable) -> List:
+        bloom_filter = self.filters[kind]
+        seen = set()
+        unvisited = []
+        for key in keys:
+            if key not in seen and str(key) not in bloom_filter:
+                seen.add(key)
+                unvisited.append(key)
+        return unvisited
+
+    def flush(self):
+        for bloom_filter in self.filters.values():
+            bloom_filter.flush()